@@ -1,4 +1,6 @@
 -- data definitions for SQLite 3.45
+-- `foreign_keys` and `synchronous` only last for one connection, so `DbMgr` also applies them (via
+-- `DB_PRAGMAS` in `constants.py`) to every connection it opens
 
 PRAGMA foreign_keys = ON; -- weirdly required by SQLite
 PRAGMA journal_mode = WAL; -- speeds DB access but can result in multiple DB files
@@ -0,0 +1,10 @@
+-- covering indexes for the queries that read the 'grants' table, so none of them has to scan the whole table
+
+-- `KarmaMgr.get_top_granters`: grants to one recipient, grouped by granter
+CREATE INDEX IF NOT EXISTS grants_recipient_granter_idx ON grants (recipient_id, granter_id);
+
+-- `KarmaMgr.get_top_recipients`: one granter's grants of one amount, grouped by recipient
+CREATE INDEX IF NOT EXISTS grants_granter_amount_recipient_idx ON grants (granter_id, amount, recipient_id);
+
+-- `GrantMgr.export_grants`: every grant in timestamp order
+CREATE INDEX IF NOT EXISTS grants_timestamp_idx ON grants (timestamp, granter_id, recipient_id, amount);
@@ -0,0 +1,55 @@
+-- running totals of grants between each granter and recipient, so `/instakarma my-stats` reads a handful of rows
+-- instead of grouping a user's entire grant history
+
+CREATE TABLE grant_pair_totals
+(
+    granter_id   INTEGER NOT NULL,
+    recipient_id INTEGER NOT NULL,
+    plus_count   INTEGER NOT NULL DEFAULT 0, -- number of +1 grants from granter to recipient
+    minus_count  INTEGER NOT NULL DEFAULT 0, -- number of -1 grants from granter to recipient
+    PRIMARY KEY (granter_id, recipient_id),
+    FOREIGN KEY (granter_id) REFERENCES entities (entity_id),
+    FOREIGN KEY (recipient_id) REFERENCES entities (entity_id)
+) WITHOUT ROWID;
+
+-- `KarmaMgr.get_top_granters`: one recipient's granters, most grants first
+CREATE INDEX grant_pair_totals_recipient_total_idx
+    ON grant_pair_totals (recipient_id, plus_count + minus_count DESC, granter_id);
+
+-- `KarmaMgr.get_top_recipients`: one granter's recipients, most +1 (or -1) grants first
+CREATE INDEX grant_pair_totals_granter_plus_idx ON grant_pair_totals (granter_id, plus_count DESC, recipient_id);
+CREATE INDEX grant_pair_totals_granter_minus_idx ON grant_pair_totals (granter_id, minus_count DESC, recipient_id);
+
+-- triggers keep the totals current in the same transaction as every change to 'grants'
+CREATE TRIGGER grants_insert_pair_totals
+    AFTER INSERT
+    ON grants
+BEGIN
+    INSERT INTO grant_pair_totals (granter_id, recipient_id, plus_count, minus_count)
+    VALUES (NEW.granter_id, NEW.recipient_id, NEW.amount = 1, NEW.amount = -1)
+    ON CONFLICT (granter_id, recipient_id) DO UPDATE SET plus_count  = plus_count + excluded.plus_count,
+                                                         minus_count = minus_count + excluded.minus_count;
+END;
+
+CREATE TRIGGER grants_delete_pair_totals
+    AFTER DELETE
+    ON grants
+BEGIN
+    UPDATE grant_pair_totals
+    SET plus_count  = plus_count - (OLD.amount = 1),
+        minus_count = minus_count - (OLD.amount = -1)
+    WHERE granter_id = OLD.granter_id
+      AND recipient_id = OLD.recipient_id;
+    DELETE
+    FROM grant_pair_totals
+    WHERE granter_id = OLD.granter_id
+      AND recipient_id = OLD.recipient_id
+      AND plus_count = 0
+      AND minus_count = 0;
+END;
+
+-- totals for the grants made before this migration
+INSERT INTO grant_pair_totals (granter_id, recipient_id, plus_count, minus_count)
+SELECT granter_id, recipient_id, SUM(amount = 1), SUM(amount = -1)
+FROM grants
+GROUP BY granter_id, recipient_id;
@@ -0,0 +1,9 @@
+-- highest grant_id that each incremental `instakarma-admin export-grants` consumer has exported, so the next export
+-- only has to read newer grants
+
+CREATE TABLE export_watermarks
+(
+    name          TEXT PRIMARY KEY,                            -- chosen by the consumer, like 'nightly-analytics'
+    last_grant_id INTEGER  NOT NULL,                           -- grants with a higher grant_id haven't been exported
+    updated_at    DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
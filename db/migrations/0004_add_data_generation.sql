@@ -0,0 +1,35 @@
+-- a counter that goes up whenever entities or grant totals change other than by a grant, so a running bot can tell
+-- that its in-memory caches are stale, even when the change was made by another process like `instakarma-admin`
+-- or the `sqlite3` shell. Grants don't bump it: the bot writes each grant through to its own caches, and no other
+-- process grants karma
+
+CREATE TABLE data_generation
+(
+    generation INTEGER NOT NULL
+);
+
+INSERT INTO data_generation (generation)
+VALUES (0);
+
+-- new entities aren't bumped for, since the caches only hold entities that were already in the DB
+CREATE TRIGGER entities_update_data_generation
+    AFTER UPDATE OF name, user_id, opted_in
+    ON entities
+BEGIN
+    UPDATE data_generation SET generation = generation + 1;
+END;
+
+CREATE TRIGGER entities_delete_data_generation
+    AFTER DELETE
+    ON entities
+BEGIN
+    UPDATE data_generation SET generation = generation + 1;
+END;
+
+-- like when `instakarma-admin rebuild-pair-totals` empties the table before refilling it
+CREATE TRIGGER grant_pair_totals_delete_data_generation
+    AFTER DELETE
+    ON grant_pair_totals
+BEGIN
+    UPDATE data_generation SET generation = generation + 1;
+END;
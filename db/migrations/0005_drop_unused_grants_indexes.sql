@@ -0,0 +1,9 @@
+-- since 0002, `KarmaMgr.get_top_granters`, `get_top_recipients` and `get_my_stats` read 'grant_pair_totals' instead
+-- of 'grants', so these two indexes from 0001 no longer serve any query (`query-plan-check` shows the plans). They
+-- still cost a B-tree update for every grant and take up space, so drop them. `instakarma-admin rebuild-pair-totals`
+-- reads all of 'grants' with or without them, and now sorts its groups in a temporary B-tree instead. Nothing
+-- deletes entities, so no foreign key check has to find an entity's grants either
+
+DROP INDEX IF EXISTS grants_recipient_granter_idx;
+
+DROP INDEX IF EXISTS grants_granter_amount_recipient_idx;
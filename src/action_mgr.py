@@ -1,20 +1,80 @@
+from constants import PROFILE_ADMIN_USER_IDS, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS, SLASH_SUBCOMMANDS
 from db_mgr import DbMgr
-from enums import Action, Status
+from entity import Entity
 from entity_mgr import EntityMgr
+from enums import Status
 from karma_mgr import KarmaMgr
+from lazy_string import LazyString
+from leaderboard_index import LeaderboardIndex
+from metrics_mgr import MetricsMgr
+from my_stats import MyStats
 import response_blocks
+from stack_profiler import StackProfiler
 from string_mgr import StringMgr
 
 from logging import Logger
-import sqlite3
+import time
 
 
 class ActionMgr:
     """Collection of methods to handle each action (not slash command) a user can perform with instakarma."""
 
-    def __init__(self, db_mgr: DbMgr, logger: Logger):
+    def __init__(self,
+                 db_mgr: DbMgr,
+                 logger: Logger,
+                 leaderboard_index: LeaderboardIndex | None = None,
+                 profiler: StackProfiler | None = None):
+        """:param profiler: Profiler for admins to run with `/instakarma profile`; without one, it's not a command"""
+
         self.db_mgr = db_mgr
         self.logger = logger
+        self.leaderboard_index = leaderboard_index or LeaderboardIndex(db_mgr, logger)
+        self.profiler = profiler
+
+    def handle_subcommand(self,
+                          command: dict,
+                          respond,
+                          entity_mgr: EntityMgr,
+                          karma_mgr: KarmaMgr) -> None:
+        """Call the appropriate handler for an `/instakarma` subcommand.
+
+        Errors are logged and reported to the user instead of raised, since this usually runs on a worker thread
+        where nothing else would see them.
+
+        :param command: If the user typed `/instakarma foo 2` this is `foo 2`
+        :param respond: Any text passed to this callback function will be displayed to the user in Slack
+        """
+
+        subcommand: str = command['text'].lower()
+        words: list[str] = subcommand.split()
+        # label metrics with the subcommand's name, but not with anything else users type, so there are few labels
+        metric_label: str = 'help' if not words else words[0] if words[0] in SLASH_SUBCOMMANDS else 'invalid'
+        with MetricsMgr.timer('slash_command_seconds', subcommand=metric_label):
+            try:
+                match words:
+                    case [] | ['help']:
+                        self.help(respond)
+                    case ['leaderboard']:
+                        self.leaderboard(respond)
+                    case ['leaderboard', page]:
+                        self.leaderboard(respond, page)
+                    case ['my-stats']:
+                        self.my_stats(command, respond, entity_mgr, karma_mgr)
+                    case ['opt-in']:
+                        self.set_status(command, respond, Status.OPTED_IN, entity_mgr)
+                    case ['opt-out']:
+                        self.set_status(command, respond, Status.OPTED_OUT, entity_mgr)
+                    # only for admins, and not in the help, so to anyone else it's just an invalid subcommand
+                    case ['profile', *profile_args] if (self.profiler is not None and
+                                                        command['user_id'] in PROFILE_ADMIN_USER_IDS):
+                        self.profile(respond, profile_args)
+                    case _:
+                        respond(StringMgr.get_string('error.invalid-slash-subcommand', subcommand=subcommand))
+                        self.help(respond)
+            except Exception as e:
+                MetricsMgr.increment('slash_command_errors_total', subcommand=metric_label)
+                self.logger.error(LazyString('slash-command.error', subcommand=subcommand, e=e), exc_info=True)
+                respond(StringMgr.get_string('error.general', e=e))
 
     def help(self, respond) -> None:
         """Print usage info."""
@@ -23,25 +83,20 @@ class ActionMgr:
                 blocks=response_blocks.help,
                 response_type='ephemeral')
 
-    def leaderboard(self, respond) -> None:
-        """Respond to Slack with a list of all non-user entities and their karma, in descending karma order."""
-
-        try:
-            results: list = self.db_mgr.execute_statement("""
-                                                          SELECT name, karma
-                                                          FROM entities
-                                                          WHERE user_id IS NULL
-                                                          AND karma IS NOT 0
-                                                          ORDER BY karma DESC, name;""",
-                                                          ())
-        except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('action.leaderboard.sqlite3error', e=e))
-            raise
-        leader_text: str = "\n".join(f"• {karma} {name}" for name, karma in results)
-        if not leader_text:
-            leader_text = StringMgr.get_string('action.leaderboard.leader-text-when-no-karma')
+    def leaderboard(self, respond, page: str = '1') -> None:
+        """Respond to Slack with one page of non-user entities and their karma, in descending karma order.
+
+        :param page: Page number the user asked for, like '2' from `/instakarma leaderboard 2`
+        """
+
+        blocks: list[dict] | None = self.leaderboard_index.get_page_blocks(int(page)) if page.isdecimal() else None
+        if blocks is None:
+            respond(StringMgr.get_string('action.leaderboard.invalid-page',
+                                         page=page,
+                                         num_pages=self.leaderboard_index.get_num_pages()))
+            return
         respond(text=StringMgr.get_string('action.leaderboard.respond-text'),
-                blocks=response_blocks.leaderboard(leader_text),
+                blocks=blocks,
                 response_type="ephemeral")
 
     def my_stats(self,
@@ -52,70 +107,90 @@ class ActionMgr:
         """Respond to Slack with how much karma the user has, who they've given the most karma to,
         and who has given them the most karma.
 
-        If the user has opted out, don't display any stats.
+        If the user has opted out, don't display any stats. The time taken to build the response is recorded in
+        the 'my_stats_seconds' histogram.
         """
 
+        started_at: float = time.perf_counter()
         name: str = entity_mgr.get_name_from_user_id(command['user_id'])
+        entity: Entity | None = entity_mgr.get_entity(name)
+
+        if entity is None:
+            blocks: list[dict] = response_blocks.my_stats(
+                name, StringMgr.get_string('action.my-stats.your-karma-text-when-user-not-in-db'), '', '', '')
+        elif not entity.opted_in:
+            blocks: list[dict] = response_blocks.my_stats(
+                name,
+                StringMgr.get_string('action.my-stats.opted-out') + "\n" +
+                StringMgr.get_string('action.my-stats.opt-in-instructions'),
+                '', '', '')
+        else:
+            stats: MyStats = karma_mgr.get_my_stats(entity)
+            your_karma_text: str = (StringMgr.get_string('action.my-stats.my-karma-header') + "\n" +
+                                    StringMgr.get_string('action.my-stats.my-karma', amount=stats.karma) + "\n")
+            blocks: list[dict] = response_blocks.my_stats(
+                name,
+                your_karma_text,
+                self._ranking_text('action.my-stats.top-positive-recipients-header',
+                                   'action.my-stats.top-positive-recipients-none',
+                                   [StringMgr.get_string('action.my-stats.top-recipient',
+                                                         amount=str(amount),
+                                                         recipient_name=recipient_name)
+                                    for recipient_name, amount in stats.top_positive_recipients]),
+                self._ranking_text('action.my-stats.top-negative-recipients-header',
+                                   'action.my-stats.top-negative-recipients-none',
+                                   [StringMgr.get_string('action.my-stats.top-recipient',
+                                                         amount=str(amount),
+                                                         recipient_name=recipient_name)
+                                    for recipient_name, amount in stats.top_negative_recipients]),
+                self._ranking_text('action.my-stats.top-granters-header',
+                                   'action.my-stats.top-granters-none',
+                                   [StringMgr.get_string('action.my-stats.top-granter',
+                                                         amount=str(amount),
+                                                         granter_name=granter_name)
+                                    for granter_name, amount in stats.top_granters]))
+        MetricsMgr.observe('my_stats_seconds', time.perf_counter() - started_at)
 
-        if not entity_mgr.name_exists_in_db(name):
-            your_karma_text: str = StringMgr.get_string('action.my-stats.your-karma-text-when-user-not-in-db')
-            respond(text=StringMgr.get_string('action.my-stats.respond-text', name=name),
-                    blocks=response_blocks.my_stats(name, your_karma_text, '', '', ''),
-                    response_type='ephemeral')
-            return
+        respond(text=StringMgr.get_string('action.my-stats.respond-text', name=name),
+                blocks=blocks,
+                response_type='ephemeral')
 
-        status: Status = entity_mgr.get_status(name)
-        if status == Status.OPTED_OUT:
-            your_karma_text: str = StringMgr.get_string('action.my-stats.opted-out') + "\n" + \
-                                   StringMgr.get_string('action.my-stats.opt-in-instructions')
-            respond(text=StringMgr.get_string('action.my-stats.respond-text', name=name),
-                    blocks=response_blocks.my_stats(name, your_karma_text, '', '', ''),
-                    response_type='ephemeral')
-            return
+    @staticmethod
+    def _ranking_text(header_key: str, none_key: str, lines: list[str]) -> str:
+        """Join a header and one line per ranked entity into one block of text, one line each.
 
-        your_karma_text: str = StringMgr.get_string('action.my-stats.my-karma-header') + "\n" + \
-                               StringMgr.get_string('action.my-stats.my-karma',
-                                                    amount=karma_mgr.get_karma(name)) + "\n"
+        :param none_key: Key of the line to show instead if nobody is ranked
+        """
 
-        top_positive_recipients: list[tuple[str, int]] = karma_mgr.get_top_recipients(name, Action.INCREMENT)
-        top_positive_recipients_text: str = StringMgr.get_string(
-            'action.my-stats.top-positive-recipients-header') + "\n"
-        if not top_positive_recipients:
-            top_positive_recipients_text += StringMgr.get_string('action.my-stats.top-positive-recipients-none') + "\n"
-        else:
-            for recipient_name, amount in top_positive_recipients:
-                top_positive_recipients_text += StringMgr.get_string('action.my-stats.top-recipient',
-                                                                     amount=str(amount),
-                                                                     recipient_name=recipient_name) + "\n"
-
-        top_negative_recipients: list[tuple[str, int]] = karma_mgr.get_top_recipients(name, Action.DECREMENT)
-        top_negative_recipients_text: str = StringMgr.get_string(
-            'action.my-stats.top-negative-recipients-header') + "\n"
-        if not top_negative_recipients:
-            top_negative_recipients_text += StringMgr.get_string('action.my-stats.top-negative-recipients-none') + "\n"
-        else:
-            for recipient_name, amount in top_negative_recipients:
-                top_negative_recipients_text += StringMgr.get_string('action.my-stats.top-recipient',
-                                                                     amount=str(amount),
-                                                                     recipient_name=recipient_name) + "\n"
-
-        top_granters: list[tuple[str, int]] = karma_mgr.get_top_granters(name)
-        top_granters_text = StringMgr.get_string('action.my-stats.top-granters-header') + "\n"
-        if not top_granters:
-            top_granters_text += StringMgr.get_string('action.my-stats.top-granters-none') + "\n"
-        else:
-            for granter_name, amount in top_granters:
-                top_granters_text += StringMgr.get_string('action.my-stats.top-granter',
-                                                          amount=str(amount),
-                                                          granter_name=granter_name) + "\n"
+        return "\n".join([StringMgr.get_string(header_key),
+                          *(lines or [StringMgr.get_string(none_key)])]) + "\n"
 
-        respond(text=StringMgr.get_string('action.my-stats.respond-text', name=name),
-                blocks=response_blocks.my_stats(name,
-                                                your_karma_text,
-                                                top_positive_recipients_text,
-                                                top_negative_recipients_text,
-                                                top_granters_text),
-                response_type='ephemeral')
+    def profile(self, respond, profile_args: list[str]) -> None:
+        """Start or stop profiling the bot, for `/instakarma profile [SECONDS | stop]`.
+
+        :param profile_args: Words after 'profile': nothing to profile for `PROFILE_DEFAULT_SECONDS`, a number of
+                             seconds up to `PROFILE_MAX_SECONDS`, or 'stop' to stop early
+        """
+
+        match profile_args:
+            case ['stop']:
+                if not self.profiler.is_profiling():
+                    respond(StringMgr.get_string('action.profile.not-profiling'))
+                    return
+                self.profiler.stop()
+                respond(StringMgr.get_string('action.profile.stopped', output_dir=self.profiler.output_dir))
+                return
+            case []:
+                seconds: float = PROFILE_DEFAULT_SECONDS
+            case [seconds_text] if seconds_text.isdecimal() and 0 < int(seconds_text) <= PROFILE_MAX_SECONDS:
+                seconds: float = int(seconds_text)
+            case _:
+                respond(StringMgr.get_string('action.profile.usage', max_seconds=PROFILE_MAX_SECONDS))
+                return
+        if not self.profiler.start(seconds):
+            respond(StringMgr.get_string('action.profile.already-profiling'))
+            return
+        respond(StringMgr.get_string('action.profile.started', seconds=seconds, output_dir=self.profiler.output_dir))
 
     def set_status(self,
                    command: dict,
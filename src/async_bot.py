@@ -0,0 +1,132 @@
+from action_mgr import ActionMgr
+from constants import GRANT_WORKERS, SLASH_COMMAND_ACK_WARNING_SECONDS, SLASH_COMMAND_WORKERS
+from entity_mgr import EntityMgr
+from grant_mgr import GrantMgr
+from karma_mgr import KarmaMgr
+from lazy_string import LazyString
+from metrics_mgr import MetricsMgr
+from reply_collector import ReplyCollector
+from timed_async_web_client import TimedAsyncWebClient
+from utils import ignore_channel
+from utils import ignored_channel_id_to_name
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+import time
+
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+
+
+class AsyncBot:
+    """Run instakarma-bot on asyncio with Slack Bolt's `AsyncApp`. Used by `./instakarma-bot.py --async`.
+
+    Listeners run on the event loop, so many events can be in flight without a thread for each one.
+    Blocking work goes to thread pools, one for grant messages and one for slash commands. Their replies are
+    collected and then sent to Slack concurrently.
+    """
+
+    def __init__(self,
+                 slack_bot_token: str,
+                 action_mgr: ActionMgr,
+                 entity_mgr: EntityMgr,
+                 grant_mgr: GrantMgr,
+                 karma_mgr: KarmaMgr,
+                 logger: Logger):
+        self.action_mgr = action_mgr
+        self.entity_mgr = entity_mgr
+        self.grant_mgr = grant_mgr
+        self.karma_mgr = karma_mgr
+        self.logger = logger
+        self.grant_executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=GRANT_WORKERS,
+                                                                     thread_name_prefix='grant')
+        self.slash_command_executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=SLASH_COMMAND_WORKERS,
+                                                                             thread_name_prefix='slash-command')
+        self.app: AsyncApp = AsyncApp(client=TimedAsyncWebClient(token=slack_bot_token))
+        self.app.use(self.use_timed_client)
+        self.app.message(r'(\+\+|--)')(self.handle_karma_grants)
+        self.app.command('/instakarma')(self.handle_instakarma_command)
+        self.app.event('message')(self.handle_message_events)
+
+    async def handle_karma_grants(self, message: dict, say, client) -> None:
+        """Async version of `handle_karma_grants` in `instakarma-bot.py`.
+
+        :param message: The incoming Slack message
+        :param say: any text passed to this coroutine will be displayed to the user in Slack
+        :param client: used to send ephemeral messages (displayed to sender only)
+        """
+
+        with MetricsMgr.timer('listener_seconds', listener='handle_karma_grants'):
+            channel_id: str = message['channel']
+            thread_timestamp: str | None = message.get('thread_ts', None)  # set if grant occurred in a thread
+
+            if ignore_channel(channel_id):
+                self.logger.info("Ignored message in channel "
+                                 f"{ignored_channel_id_to_name(channel_id)!r}")
+                await client.chat_postEphemeral(channel=channel_id,
+                                                user=message['user'],
+                                                text="❌ instakarma is disabled in this channel",
+                                                thread_ts=thread_timestamp)
+                return
+
+            replies: ReplyCollector = ReplyCollector()
+            await asyncio.get_running_loop().run_in_executor(self.grant_executor,
+                                                             self.grant_mgr.handle_grants,
+                                                             replies,
+                                                             message['user'],
+                                                             message['text'],
+                                                             thread_timestamp)
+            await replies.send(say)
+
+    async def handle_instakarma_command(self, ack, respond, command) -> None:
+        """Async version of `handle_instakarma_command` in `instakarma-bot.py`.
+
+        :param ack: Slack requires us to await this coroutine to acknowledge receipt of the slash command
+        :param respond: Any text passed to this coroutine will be displayed to the user in Slack
+        :param command: If the user typed `/instakarma foo` this is `foo`
+        """
+
+        with MetricsMgr.timer('listener_seconds', listener='handle_instakarma_command'):
+            received_at: float = time.perf_counter()
+            await ack()  # required by Slack SDK
+            ack_seconds: float = time.perf_counter() - received_at
+            MetricsMgr.observe('slash_command_ack_seconds', ack_seconds)
+            if ack_seconds > SLASH_COMMAND_ACK_WARNING_SECONDS:
+                self.logger.warning(LazyString('slash-command.slow-ack',
+                                               seconds=ack_seconds,
+                                               subcommand=command['text']))
+
+            replies: ReplyCollector = ReplyCollector()
+            await asyncio.get_running_loop().run_in_executor(self.slash_command_executor,
+                                                             self.action_mgr.handle_subcommand,
+                                                             command,
+                                                             replies,
+                                                             self.entity_mgr,
+                                                             self.karma_mgr)
+            await replies.send(respond)
+
+    async def handle_message_events(self, body) -> None:
+        """Accept all messages but do nothing.
+
+        This suppresses the console output that normally appears after every message.
+        """
+
+        with MetricsMgr.timer('listener_seconds', listener='handle_message_events'):
+            pass  # timed anyway, so its count shows how many messages the bot sees
+
+    async def use_timed_client(self, context, next) -> None:
+        """Async version of `use_timed_client` in `instakarma-bot.py`."""
+
+        context['client'] = TimedAsyncWebClient.from_client(context.client)
+        context.pop('say', None)  # Bolt already made `say()` with the plain client; it's remade from the new one
+        await next()
+
+    def run(self, slack_app_token: str) -> None:
+        """Listen for Slack events until the process is stopped."""
+
+        try:
+            asyncio.run(AsyncSocketModeHandler(app=self.app, app_token=slack_app_token).start_async())
+        finally:
+            self.grant_executor.shutdown()
+            self.slash_command_executor.shutdown()
@@ -1,5 +1,5 @@
 from channel import Channel
-from enums import Environment
+from enums import Environment, LogFormat
 
 from typing import Final
 
@@ -17,10 +17,52 @@ SLACK_BOT_TOKEN_SECRET_ID: Final[str] = f'instakarma/{ENVIRONMENT.value}_SLACK_B
 # for db operations
 DB_DDL_FILE_NAME: Final[str] = '../db/instakarma_ddl.sql'
 DB_FILE_NAME: Final[str] = '../db/instakarma.db'
-DB_BACKUP_FILE_NAME: Final[str] = f'{DB_FILE_NAME}.backup'
+DB_MIGRATIONS_DIR: Final[str] = '../db/migrations'  # files named like '0001_add_foo.sql', applied in numeric order
+DB_SLOW_QUERY_SECONDS: Final[float] = 0.05  # log statements slower than this, with their query plan; 0 turns it off
+
+# for DB backups, made by `instakarma-admin backup-db` or on a schedule by `instakarma-bot`
+DB_BACKUP_DIR: Final[str] = '../db/backups'  # backups are named like 'instakarma-20250101-120000.db'
+DB_BACKUP_INTERVAL_SECONDS: Final[int] = 0  # how often `instakarma-bot` backs up the DB; 0 means it doesn't
+DB_BACKUP_KEEP: Final[int] = 7  # after each backup, delete all but this many of the newest backups
+DB_BACKUP_PAGES_PER_STEP: Final[int] = 1000  # DB pages copied at a time, so 4MB with SQLite's default page size
+DB_BACKUP_STEP_SLEEP_SECONDS: Final[float] = 0.05  # pause between steps, so a backup doesn't hog the disk
+
+# applied to every pooled DB connection when it's opened, since most PRAGMAs only last as long as the connection
+DB_PRAGMAS: Final[dict[str, str | int]] = {
+    'foreign_keys': 'ON',  # weirdly required by SQLite
+    'synchronous': 'NORMAL',  # good balance between speed and safety in WAL mode
+    'busy_timeout': 5000,  # milliseconds to wait for a lock before raising 'database is locked'
+    'cache_size': -16000,  # negative means KiB, so this is 16MB of page cache per connection
+    'mmap_size': 64 * 1024 * 1024,  # 64MB of memory-mapped I/O
+    'temp_store': 'MEMORY',  # keep temp tables and sort spills out of the filesystem
+}
+
+# for SlackApiMgr's cache of Slack user names
+USER_DIRECTORY_REFRESH_SECONDS: Final[int] = 60 * 60  # reload every user name from `users.list` this often
+USER_DIRECTORY_TTL_SECONDS: Final[int] = 6 * 60 * 60  # after this long, re-check a cached name with `users.info`
+USERS_LIST_PAGE_SIZE: Final[int] = 200  # Slack recommends no more than 200 users per `users.list` page
+
+# for GrantWriter, which commits grants from many messages together in one transaction
+# how long a batch waits for more grants after its first; 0 means a batch is whatever queued up while the previous
+# batch was being written, which batches bursts without slowing down a lone grant
+GRANT_BATCH_MAX_DELAY_SECONDS: Final[float] = 0.0
+GRANT_BATCH_MAX_SIZE: Final[int] = 64  # commit a batch as soon as it has this many grants
+GRANT_QUEUE_SIZE: Final[int] = 1000  # grants waiting beyond this make new grants wait for room
+GRANT_QUEUE_TIMEOUT_SECONDS: Final[float] = 5.0  # give up on a grant if the queue has no room for this long
+GRANT_RESULT_TIMEOUT_SECONDS: Final[float] = 10.0  # give up on a queued grant if it isn't written within this long
+# a grant skips the writer thread only if no grant has been written for this long, so grants in a burst still queue
+GRANT_WRITER_IDLE_SECONDS: Final[float] = 0.1
+GRANT_WORKERS: Final[int] = 8  # in `--async` mode, threads that handle grant messages
+
+# max number of 'entities' rows `EntityCache` keeps in memory
+ENTITY_CACHE_SIZE: Final[int] = 10_000
 
 # for `instakarma-admin`
-GRANTS_EXPORT_FILE: Final[str] = 'grants.csv'
+GRANTS_EXPORT_CHUNK_SIZE: Final[int] = 5000  # grants read from the DB and written out at a time
+GRANTS_EXPORT_FILE_STEM: Final[str] = 'grants'  # exports go to 'grants.csv' or 'grants.ndjson', plus '.gz' if gzipped
+GRANTS_EXPORT_FOLLOW_POLL_SECONDS: Final[float] = 1.0  # `export-grants --follow` checks for new grants this often
+GRANTS_EXPORT_GZIP_LEVEL: Final[int] = 6  # gzip's default of 9 is much slower and barely smaller
+GRANTS_EXPORT_WATERMARK: Final[str] = 'default'  # watermark for incremental exports that don't name their own
 
 # for `instakarma-bot`
 
@@ -32,16 +74,110 @@ else:
     IGNORED_CHANNELS: Final[list[Channel]] = [Channel(name='mushrooms', id='C080AKZJBH7'),
                                               Channel(name='cats', id='C07SHR3JBQD')]
 
+# Slack shows the user an error if a slash command isn't acknowledged within 3 seconds
+SLASH_COMMAND_ACK_WARNING_SECONDS: Final[float] = 1.0  # log a warning if acknowledging takes longer than this
+SLASH_COMMAND_WORKERS: Final[int] = 4  # threads that run slash commands after they've been acknowledged
+SLASH_SUBCOMMANDS: Final[tuple[str, ...]] = ('help', 'leaderboard', 'my-stats', 'opt-in', 'opt-out', 'profile')
+
 LOG_FILE: Final[str] = '../logs/instakarma.log'
 LOG_FILE_SIZE: Final[int] = 1024 * 1024 * 10  # 10MB
 LOG_FILE_COUNT: Final[int] = 5
+LOG_FORMAT: Final[LogFormat] = LogFormat.TEXT  # or LogFormat.JSON for one JSON object per line
 LOG_LEVEL: Final[str] = 'INFO'
+LOG_QUEUED: Final[bool] = True  # write logs on a background thread, so logging never waits for the disk
 LOGGER_NAME: Final[str] = 'instakarma'
 
+# for `log-benchmark`, which times grant handling with each way `LogMgr` can log
+LOG_BENCHMARK_LOG_CALLS: Final[int] = 20_000  # log calls timed on their own, before grants are timed
+LOG_BENCHMARK_OBJECTS: Final[int] = 1000
+LOG_BENCHMARK_RATE: Final[float] = 500.0  # grant messages per second, spread over the threads
+LOG_BENCHMARK_SECONDS: Final[float] = 5.0  # how long grants are timed for with each logging setup
+LOG_BENCHMARK_USERS: Final[int] = 100
+
+# for `/instakarma leaderboard`
+LEADERBOARD_PAGE_SIZE: Final[int] = 25  # keeps each page well under Slack's 3000-character limit for a text block
+
 # for `/instakarma my-stats`
+MY_STATS_CACHE_SIZE: Final[int] = 1000  # number of users whose stats snapshots `MyStatsCache` keeps in memory
+MY_STATS_P99_BUDGET_SECONDS: Final[float] = 0.01  # `my-stats-benchmark` fails if p99 latency under load is slower
 NUM_TOP_GRANTERS: Final[int] = 5
 NUM_TOP_RECIPIENTS: Final[int] = 5
 
+# for MetricsMgr and MetricsServer
+LATENCY_BUCKETS: Final[tuple[float, ...]] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+METRICS_FETCH_TIMEOUT_SECONDS: Final[float] = 5.0  # how long `instakarma-admin dump-metrics` waits for the bot
+METRICS_HOST: Final[str] = '127.0.0.1'  # local only; metrics name DB queries and Slack methods, so don't expose them
+METRICS_NAMESPACE: Final[str] = 'instakarma'  # prefix of every metric name in Prometheus text format
+METRICS_PORT: Final[int] = 9464  # 0 turns off the bot's metrics endpoint
+
+# for MemoryMonitor, which checks instakarma-bot's RSS, and traces allocations when it's run with `--memory-diagnostics`
+MEMORY_CHECK_INTERVAL_SECONDS: Final[float] = 60.0  # how often RSS is checked against MEMORY_RSS_WARNING_MB
+MEMORY_REPORT_FILE: Final[str] = '../logs/memory-report.txt'  # reports are appended, so growth can be followed
+MEMORY_REPORT_INTERVAL_SECONDS: Final[float] = 15 * 60.0  # the first snapshot, after this long, is the baseline
+MEMORY_REPORT_TOP_N: Final[int] = 20  # modules and allocation sites listed in each report
+MEMORY_RSS_WARNING_MB: Final[int] = 512  # log a warning if RSS goes over this; 0 turns off the warning
+MEMORY_RSS_WARNING_STEP_MB: Final[int] = 64  # warn again each time RSS grows this much more
+MEMORY_TRACE_FRAMES: Final[int] = 25  # frames kept per allocation; enough to reach `src/` from inside slack_sdk
+
+# for StackProfiler, which `instakarma-bot` runs on SIGUSR1 or on `/instakarma profile` from an admin
+PROFILE_ADMIN_USER_IDS: Final[frozenset[str]] = frozenset()  # Slack user IDs, like 'U07R69E3YKB', who may profile
+PROFILE_DEFAULT_SECONDS: Final[float] = 30.0  # how long to profile for, unless `/instakarma profile` says otherwise
+PROFILE_DIR: Final[str] = '../logs'  # results are written next to the logs
+PROFILE_MAX_SECONDS: Final[float] = 600.0
+PROFILE_SAMPLE_INTERVAL_SECONDS: Final[float] = 0.01  # how often every thread's stack is sampled while profiling
+
+# for MessageParser, so that no message (like a giant paste) can take long to parse or trigger a flood of grants
+PARSER_MAX_MESSAGE_LENGTH: Final[int] = 40_000  # Slack's own limit; only this many characters of a message are parsed
+PARSER_MAX_RECIPIENTS: Final[int] = 50  # karma is only granted to this many recipients from one message
+
+# for `parser-benchmark`
+PARSER_BASELINE_FILE: Final[str] = '../test/parser-baseline.json'  # machine-specific, so git ignores it
+PARSER_BENCHMARK_ROUNDS: Final[int] = 5  # throughput is taken from the fastest round
+PARSER_BENCHMARK_SECONDS: Final[float] = 1.0  # time each parser method on each workload for at least this long
+PARSER_BENCHMARK_THRESHOLD: Final[float] = 0.25  # fail if throughput drops by more than this fraction of baseline
+PARSER_CORPUS_FILE: Final[str] = '../test/parser-corpus.json'
+PARSER_WORST_CASE_BUDGET_SECONDS: Final[float] = 0.05  # fail if any adversarial message takes longer to parse
+TEST_MESSAGES_FILE: Final[str] = '../test/test-messages.md'
+
+# for `grant-benchmark`, which times grants one after another with and without pooled DB connections
+GRANT_BENCHMARK_GRANTS: Final[int] = 2000  # grants timed in each round
+GRANT_BENCHMARK_OBJECTS: Final[int] = 100
+GRANT_BENCHMARK_ROUNDS: Final[int] = 5  # grants/sec is taken from the fastest round
+GRANT_BENCHMARK_USERS: Final[int] = 100
+
+# for `group-commit-benchmark`, which times bursts of grants that arrive at once with each way of writing them
+GROUP_COMMIT_BENCHMARK_BURST_SIZES: Final[tuple[int, ...]] = (1, 2, 8, 32)  # grants per burst, one per thread
+GROUP_COMMIT_BENCHMARK_GRANTS: Final[int] = 2000  # grants timed in each round, for each burst size
+GROUP_COMMIT_BENCHMARK_OBJECTS: Final[int] = 100
+GROUP_COMMIT_BENCHMARK_ROUNDS: Final[int] = 5  # grants/sec is taken from the fastest round
+GROUP_COMMIT_BENCHMARK_USERS: Final[int] = 100
+
+# for `grant-stress-test`, which grants karma from many threads at once and checks that the totals add up
+GRANT_STRESS_TEST_GRANTS: Final[int] = 400  # grants made by each granting thread
+GRANT_STRESS_TEST_MAX_REPORTED: Final[int] = 10  # errors and mismatches printed, of each
+GRANT_STRESS_TEST_OBJECTS: Final[int] = 2  # few, so the threads keep updating the same rows
+GRANT_STRESS_TEST_READERS: Final[int] = 4  # threads reading karma and stats meanwhile
+GRANT_STRESS_TEST_USERS: Final[int] = 20
+
+# for `query-plan-check`, which checks that the queries that read grants use their indexes
+QUERY_PLAN_CHECK_GRANTS: Final[int] = 1000  # grants in the test DB, so every query has rows to find
+QUERY_PLAN_CHECK_OBJECTS: Final[int] = 50
+QUERY_PLAN_CHECK_USERS: Final[int] = 50
+
+# for `my-stats-benchmark`, which times `/instakarma my-stats` while other threads grant karma
+MY_STATS_BENCHMARK_GRANTERS: Final[int] = 4  # threads granting karma as fast as they can
+MY_STATS_BENCHMARK_GRANTS: Final[int] = 200_000  # grants already in the DB before timing starts
+MY_STATS_BENCHMARK_OBJECTS: Final[int] = 5000
+MY_STATS_BENCHMARK_RATE: Final[float] = 200.0  # my-stats calls per second, spread over the reader threads
+MY_STATS_BENCHMARK_READERS: Final[int] = 4  # threads calling my-stats, like `SLASH_COMMAND_WORKERS`
+MY_STATS_BENCHMARK_SECONDS: Final[float] = 10.0
+MY_STATS_BENCHMARK_USERS: Final[int] = 1000
+
+# for `strings-benchmark`, which times `StringMgr.get_string()` before and after strings.yml was compiled
+STRINGS_BENCHMARK_CALLS: Final[int] = 200_000  # calls timed in each round, for each kind of string
+STRINGS_BENCHMARK_ROUNDS: Final[int] = 5  # calls/sec and load time are taken from the fastest round
+
 # for StringMgr
 STRINGS_FILE: Final[str] = 'strings.yml'
+STRINGS_CACHE_FILE: Final[str] = '../cache/strings.json'  # compiled from STRINGS_FILE; rebuilt whenever that changes
 STRING_PLACEHOLDER: Final[str] = 'PLACEHOLDER_UI_STRING'  # return this if the key isn't in the map
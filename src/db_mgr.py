@@ -1,50 +1,239 @@
-from constants import DB_FILE_NAME, DB_DDL_FILE_NAME, DB_BACKUP_FILE_NAME
-from logging import Logger
+from constants import (DB_BACKUP_DIR, DB_BACKUP_INTERVAL_SECONDS, DB_BACKUP_KEEP, DB_BACKUP_PAGES_PER_STEP,
+                       DB_BACKUP_STEP_SLEEP_SECONDS, DB_DDL_FILE_NAME, DB_FILE_NAME, DB_MIGRATIONS_DIR, DB_PRAGMAS,
+                       DB_SLOW_QUERY_SECONDS)
+from lazy_string import LazyString
+from metrics_mgr import MetricsMgr
 from string_mgr import StringMgr
 
+from collections.abc import Callable, Iterator
+from contextlib import closing, contextmanager
+from datetime import datetime
+from logging import Logger
 from pathlib import Path
 from sqlite3 import Connection, Cursor
 import sqlite3
 import sys
+import threading
+from threading import Event, Lock, Thread
+import time
 
 
 class DbMgr:
-    """Collect all DB-related methods in one class."""
+    """Collect all DB-related methods in one class.
+
+    Each thread gets its own long-lived DB connection, opened on first use and tuned with `DB_PRAGMAS`.
+    SQLite connections shouldn't be shared between threads, but reusing one per thread saves the cost of
+    opening a connection (and re-reading the schema) for every statement.
+    """
+
+    def __init__(self,
+                 logger: Logger,
+                 pragmas: dict[str, str | int] = DB_PRAGMAS,
+                 db_file_name: str = DB_FILE_NAME,
+                 slow_query_seconds: float = DB_SLOW_QUERY_SECONDS):
+        """:param slow_query_seconds: `execute_statement()` logs statements slower than this; 0 turns it off"""
 
-    def __init__(self, logger: Logger):
         self.logger: Logger = logger
+        self.db_file_name: str = db_file_name
+        self.pragmas: dict[str, str | int] = pragmas
+        self.slow_query_seconds: float = slow_query_seconds
+        self._slow_statements: set[str] = set()  # statements already logged as slow, so each is only logged once
+        self._slow_statements_lock: Lock = Lock()
+        self._thread_local: threading.local = threading.local()
+        self._connections: list[Connection] = []  # every pooled connection, so they can all be closed on shutdown
+        self._connections_lock: Lock = Lock()
+        self._stop_backing_up: Event = Event()
+        self._backup_thread: Thread | None = None
+        self._change_listeners: list[Callable[[], None]] = []
+        self._data_generation: int | None = None  # highest 'data_generation' seen, or None before the first check
+        self._data_generation_lock: Lock = Lock()
 
     def get_db_connection(self) -> Connection:
-        """Open and return a DB connection.
+        """Return the calling thread's pooled DB connection, opening it first if needed.
 
         :returns: Connection object to DB
         :raises sqlite3.Error: If it can't connect to the DB
         """
+
+        conn: Connection | None = getattr(self._thread_local, 'conn', None)
+        if conn is not None:
+            return conn
         try:
-            return sqlite3.connect(DB_FILE_NAME)
+            # only the owning thread uses the connection, but `close_all_connections()` may close it from another
+            conn = sqlite3.connect(self.db_file_name, check_same_thread=False)
+            self.apply_pragmas(conn)
         except sqlite3.Error as e:
-            self.logger.critical(StringMgr.get_string('db.error.connection', db_file_name=DB_FILE_NAME, e=e))
+            self.logger.critical(LazyString('db.error.connection', db_file_name=self.db_file_name, e=e))
             raise
+        self._thread_local.conn = conn
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def apply_pragmas(self, conn: Connection) -> None:
+        """Tune a freshly opened connection with the PRAGMA profile this DbMgr was created with.
+
+        :raises sqlite3.Error: If SQLite rejects a PRAGMA
+        """
+
+        for pragma, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {pragma} = {value};')
+
+    def close_all_connections(self) -> None:
+        """Close every pooled connection. Call this once when shutting down."""
+
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._thread_local = threading.local()
+
+    def add_change_listener(self, listener: Callable[[], None]) -> None:
+        """Have `check_for_changes()` call `listener`, like a cache's `clear()`, when the DB changes under it."""
+
+        with self._data_generation_lock:
+            self._change_listeners.append(listener)
+
+    def check_for_changes(self) -> None:
+        """Call every change listener if entities or grant totals changed, other than by a grant, since last time.
+
+        Call this before serving anything from an in-memory cache. Triggers added by migration 0004 bump the
+        'data_generation' table with every such change, whichever process makes it, so this sees changes made by
+        `instakarma-admin` as well as by this process. The generation is only read after some other connection has
+        committed, as `PRAGMA data_version` shows, so a check costs one PRAGMA while the DB is idle.
+
+        :raises sqlite3.Error: If something goes wrong with the DB
+        """
+
+        conn: Connection = self.get_db_connection()
+        data_version: int = conn.execute('PRAGMA data_version;').fetchone()[0]
+        if data_version != getattr(self._thread_local, 'data_version', None):
+            # a connection's own commits don't change its data_version, but this thread's commits are already
+            # written through to the caches, so an older generation from this connection is harmless
+            self._thread_local.data_generation = conn.execute('SELECT generation FROM data_generation;').fetchone()[0]
+            self._thread_local.data_version = data_version
+        generation: int = self._thread_local.data_generation
+        seen_generation: int | None = self._data_generation
+        if seen_generation is not None and generation <= seen_generation:
+            return  # the usual case, so it doesn't wait for the lock
+        with self._data_generation_lock:
+            if self._data_generation is not None and generation <= self._data_generation:
+                return
+            is_first_check: bool = self._data_generation is None
+            self._data_generation = generation
+            if is_first_check:
+                return  # nothing has been cached from before now
+            self.logger.info(LazyString('db.changed', generation=generation))
+            for listener in self._change_listeners:  # under the lock, so no check returns before the caches clear
+                listener()
 
     def execute_statement(self, statement: str, parms: tuple) -> list[tuple]:
-        """Open a DB connection, execute an SQL statement, close the connection.
+        """Execute and commit an SQL statement on the calling thread's pooled connection.
+
+        Each call is timed in the 'db_query_seconds' histogram, labelled with the name of the method that made it
+        (like 'EntityMgr.get_karma'), since that names the query better than its SQL does. A statement slower than
+        `slow_query_seconds` is logged with its query plan (see `_log_slow_query()`).
 
         :returns: List of results as tuples
         :raises sqlite3.Error: If something goes wrong with the DB
         """
 
-        log_friendly_statement: str = self.format_statement_for_log(statement)
-        with self.get_db_connection() as conn:
+        query: str = sys._getframe(1).f_code.co_qualname
+        with self.get_db_connection() as conn, MetricsMgr.timer('db_query_seconds', query=query):
             try:
+                started_at: float = time.perf_counter()
                 cursor: Cursor = conn.execute(statement, parms)
+                results: list[tuple] = cursor.fetchall()  # fetch first, since statements with RETURNING block commits
                 conn.commit()
-                return cursor.fetchall()
+                seconds: float = time.perf_counter() - started_at
             except sqlite3.Error as e:
                 conn.rollback()
-                self.logger.error(StringMgr.get_string('db.error.rollback',
-                                                       statement=log_friendly_statement,
-                                                       parms=parms, e=e))
+                self.logger.error(LazyString('db.error.rollback',
+                                             statement=self.format_statement_for_log(statement),
+                                             parms=parms, e=e))
                 raise
+            if self.slow_query_seconds and seconds > self.slow_query_seconds:
+                self._log_slow_query(conn, statement, parms, query, seconds,
+                                     len(results) if cursor.description else cursor.rowcount)
+            return results
+
+    def _log_slow_query(self,
+                        conn: Connection,
+                        statement: str,
+                        parms: tuple,
+                        query: str,
+                        seconds: float,
+                        num_rows: int) -> None:
+        """Count a slow statement in 'db_slow_queries_total', and log it with its query plan the first time.
+
+        The plan is captured now, with the same parameters, so it shows how SQLite ran the statement against the
+        DB as it is, like a SCAN of a whole table that's missing an index. Only the first slow run of each
+        statement is logged, so a statement that's always slow doesn't flood the log.
+        """
+
+        MetricsMgr.increment('db_slow_queries_total', query=query)
+        with self._slow_statements_lock:
+            if statement in self._slow_statements:
+                return
+            self._slow_statements.add(statement)
+
+        try:
+            plan: str = self.format_query_plan(conn.execute(f'EXPLAIN QUERY PLAN {statement}', parms).fetchall())
+        except sqlite3.Error as e:
+            plan: str = StringMgr.get_string('db.slow-query.no-plan', e=e)
+        self.logger.warning(LazyString('db.slow-query.logged',
+                                       seconds=seconds,
+                                       num_rows=num_rows,
+                                       query=query,
+                                       statement=self.format_statement_for_log(statement),
+                                       parms=parms,
+                                       plan=plan))
+
+    @staticmethod
+    def format_query_plan(plan_rows: list[tuple[int, int, int, str]]) -> str:
+        """Format the rows of `EXPLAIN QUERY PLAN` as a tree, like the `sqlite3` shell does.
+
+        :param plan_rows: (id, parent id, unused, detail) rows, where a parent id of 0 means a top-level step
+        :returns: One step per line, each indented under its parent, like '  SEARCH g USING INDEX ...'
+        """
+
+        depths: dict[int, int] = {0: -1}
+        lines: list[str] = []
+        for step_id, parent_id, _, detail in plan_rows:
+            depths[step_id] = depths.get(parent_id, -1) + 1
+            lines.append(f"{'  ' * depths[step_id]}{detail}")
+        return '\n'.join(lines)
+
+    @contextmanager
+    def transaction(self) -> Iterator[Connection]:
+        """Run several statements as one atomic transaction on the calling thread's pooled connection.
+
+        The write lock is taken up front with `BEGIN IMMEDIATE`, so a transaction that reads before it writes
+        can't be invalidated by another writer halfway through. Commits if the `with` block finishes normally,
+        rolls back if it raises.
+
+        How long each transaction waited for the write lock, and then held it until its commit or rollback, are
+        timed in the 'db_write_lock_wait_seconds' and 'db_write_lock_hold_seconds' histograms, labelled with the
+        name of the method that started it.
+
+        :returns: Connection to execute the transaction's statements on
+        :raises sqlite3.Error: If something goes wrong with the DB
+        """
+
+        caller: str = sys._getframe(2).f_code.co_qualname  # 1 is the `__enter__()` of `@contextmanager`
+        conn: Connection = self.get_db_connection()
+        started_at: float = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE;')
+        locked_at: float = time.perf_counter()
+        MetricsMgr.observe('db_write_lock_wait_seconds', locked_at - started_at, transaction=caller)
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            MetricsMgr.observe('db_write_lock_hold_seconds', time.perf_counter() - locked_at, transaction=caller)
+            raise
+        conn.commit()
+        MetricsMgr.observe('db_write_lock_hold_seconds', time.perf_counter() - locked_at, transaction=caller)
 
     def init_db(self) -> None:
         """Create an empty DB if it doesn't already exist.
@@ -54,7 +243,7 @@ class DbMgr:
         :raises sqlite3.Error: If anything goes wrong with the DB
         """
 
-        db_path: Path = Path(DB_FILE_NAME)
+        db_path: Path = Path(self.db_file_name)
         db_ddl_path: Path = Path(DB_DDL_FILE_NAME)
 
         if db_path.exists():
@@ -75,6 +264,64 @@ class DbMgr:
                                             db_ddl_path=db_ddl_path.resolve())
             self.logger.info(msg)
 
+    def get_schema_version(self) -> int:
+        """Get the number of the most recent migration applied to the DB.
+
+        Create the 'schema_version' table if it doesn't exist yet.
+
+        :returns: The DB's schema version, or 0 if no migrations have been applied
+        :raises sqlite3.Error: If anything goes wrong with the DB
+        """
+
+        self.execute_statement("""
+                               CREATE TABLE IF NOT EXISTS schema_version
+                               (
+                                   version    INTEGER PRIMARY KEY,
+                                   name       TEXT     NOT NULL,
+                                   applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+                               );""",
+                               ())
+        results: list = self.execute_statement("""
+                                               SELECT COALESCE(MAX(version), 0)
+                                               FROM schema_version;""",
+                                               ())
+        return results[0][0]
+
+    def migrate_db(self) -> list[str]:
+        """Apply every migration in `DB_MIGRATIONS_DIR` that's newer than the DB's schema version.
+
+        Each migration runs in its own transaction along with the 'schema_version' update that records it,
+        so a failed migration leaves the DB at the previous version.
+
+        :returns: Names of the migrations that were applied, in the order they were applied
+        :raises sqlite3.Error: If a migration fails
+        """
+
+        current_version: int = self.get_schema_version()
+        applied: list[str] = []
+        for migration_path in sorted(Path(DB_MIGRATIONS_DIR).glob('[0-9]*.sql')):
+            version: int = int(migration_path.name.split('_')[0])
+            if version <= current_version:
+                continue
+            conn: Connection = self.get_db_connection()
+            try:
+                # the script leaves its transaction open, so the version is recorded, with bound parameters,
+                # in the same transaction as the migration
+                conn.executescript('BEGIN IMMEDIATE;\n' + migration_path.read_text())
+                conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?);',
+                             (version, migration_path.stem))
+                conn.commit()
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                self.logger.critical(LazyString('db.error.could-not-migrate',
+                                                migration=migration_path.name,
+                                                e=e))
+                raise
+            self.logger.info(LazyString('db.migrated', migration=migration_path.name, version=version))
+            applied.append(migration_path.name)
+        return applied
+
     def format_statement_for_log(self, statement: str) -> str:
         """Format a statement as a single line for logging.
 
@@ -87,39 +334,112 @@ class DbMgr:
         statement = statement.replace('\n', ' ')  # replace newlines with spaces
         return ' '.join(statement.split())  # replace multiple spaces with a single space
 
-    def backup_db(self) -> None:
-        """Copy the DB file to another local file.
+    def backup_db(self,
+                  backup_dir: str = DB_BACKUP_DIR,
+                  keep: int = DB_BACKUP_KEEP,
+                  pages_per_step: int = DB_BACKUP_PAGES_PER_STEP,
+                  step_sleep_seconds: float = DB_BACKUP_STEP_SLEEP_SECONDS,
+                  progress: Callable[[int, int], None] | None = None) -> Path:
+        """Copy the live DB to a new timestamped file in `backup_dir`, then delete all but the newest `keep` backups.
 
-        This should only be called from `instakarma-admin`, so it exits on failure instead of logging and raising.
-        """
+        The DB is copied `pages_per_step` pages at a time with SQLite's online backup API, pausing
+        `step_sleep_seconds` between steps. The copy is made inside one read transaction, so it's a consistent
+        snapshot of the DB as it was when the backup started. In WAL mode a reader never blocks writers, so the bot
+        keeps recording grants throughout; without that transaction, every grant would restart the copy.
+
+        The copy is written under a temporary name, passes `PRAGMA integrity_check`, and only then gets its final
+        name, so every file named like a backup is complete and sound.
 
-        db_path: Path = Path(DB_FILE_NAME)
-        db_backup_path: Path = Path(DB_BACKUP_FILE_NAME)
+        :param progress: Called after each step with the number of pages copied so far and the total
+        :returns: Path of the new backup
+        :raises FileNotFoundError: If there's no DB to back up
+        :raises FileExistsError: If a backup with the same timestamp already exists
+        :raises sqlite3.Error: If the backup fails or the copy fails its integrity check
+        :raises OSError: If the backup can't be written or an old backup can't be deleted
+        """
 
+        db_path: Path = Path(self.db_file_name)
         if not db_path.exists():
-            sys.exit(StringMgr.get_string('db.error.no-db-file', db_path=db_path))
+            raise FileNotFoundError(StringMgr.get_string('db.error.no-db-file', db_path=db_path))
+        backup_path: Path = Path(backup_dir) / f'{db_path.stem}-{datetime.now():%Y%m%d-%H%M%S}.db'
+        if backup_path.exists():
+            raise FileExistsError(StringMgr.get_string('db.error.db-backup-file-exists', backup_path=backup_path))
+        temp_path: Path = backup_path.with_name(f'{backup_path.name}.tmp')
 
-        if db_backup_path.exists():
-            sys.exit(StringMgr.get_string('db.error.db-backup-file-exists', db_backup_path=db_backup_path))
-
-        # checkpoint to truncate WAL and consolidate DB to 1 file
-        with self.get_db_connection() as conn:
-            try:
-                cursor: Cursor = conn.execute('PRAGMA wal_checkpoint(TRUNCATE);')
-                results: tuple[int, int, int] = cursor.fetchone()
-                if results[0]:
-                    sys.exit(StringMgr.get_string('db.error.truncation-blocked'))
-                print(StringMgr.get_string('db.truncated', single_db_file=db_path.resolve()))
-            except sqlite3.Error as e:
-                sys.exit(StringMgr.get_string('db.error.could-not-truncate', e=e))
+        def step_done(status: int, remaining: int, total: int) -> None:
+            if progress is not None:
+                progress(total - remaining, total)
+            if remaining:
+                time.sleep(step_sleep_seconds)
 
+        start: float = time.perf_counter()
         try:
-            with sqlite3.connect(DB_FILE_NAME) as source, \
-                 sqlite3.connect(DB_BACKUP_FILE_NAME) as destination:
-                source.backup(destination)
-        except sqlite3.Error as e:
-            sys.exit(StringMgr.get_string('db.error.could-not-backup', e=e))
+            backup_path.parent.mkdir(parents=True, exist_ok=True)
+            # dedicated connections, so the long read transaction doesn't tie up a pooled one
+            with closing(sqlite3.connect(self.db_file_name)) as source, closing(sqlite3.connect(temp_path)) as dest:
+                source.execute('BEGIN;')
+                source.execute('SELECT COUNT(*) FROM sqlite_schema;')  # starts the read, fixing the snapshot
+                source.backup(dest, pages=pages_per_step, progress=step_done)
+                source.rollback()
+                # the snapshot kept the WAL from being checkpointed, so catch up now instead of in the bot's next commit
+                source.execute('PRAGMA wal_checkpoint(PASSIVE);')
+                dest.execute('PRAGMA journal_mode = DELETE;')  # so the backup is one self-contained file
+                problems: list[str] = [row[0] for row in dest.execute('PRAGMA integrity_check;')]
+                num_pages: int = dest.execute('PRAGMA page_count;').fetchone()[0]
+            if problems != ['ok']:
+                raise sqlite3.DatabaseError(StringMgr.get_string('db.error.backup-failed-integrity-check',
+                                                                 problems='; '.join(problems)))
+            temp_path.replace(backup_path)
+        except (OSError, sqlite3.Error) as e:
+            self.logger.error(LazyString('db.error.could-not-backup', e=e))
+            raise
+        finally:
+            temp_path.unlink(missing_ok=True)  # only still there if the backup failed or was interrupted
+        self.logger.info(LazyString('db.backed-up',
+                                    db_path=db_path.resolve(),
+                                    backup_path=backup_path.resolve(),
+                                    pages=num_pages,
+                                    seconds=time.perf_counter() - start))
+        self.rotate_backups(backup_dir, db_path.stem, keep)
+        return backup_path
+
+    def rotate_backups(self, backup_dir: str, stem: str, keep: int) -> list[Path]:
+        """Delete all but the newest `keep` backups of the DB named `stem` in `backup_dir`.
+
+        Backup names end with their timestamp, so sorting by name sorts them by age. The newest backup is always
+        kept, even if `keep` is 0.
+
+        :returns: Paths of the deleted backups
+        :raises OSError: If a backup can't be deleted
+        """
+
+        backup_paths: list[Path] = sorted(Path(backup_dir).glob(f'{stem}-[0-9]*-[0-9]*.db'))
+        removed: list[Path] = backup_paths[:-max(keep, 1)]
+        for backup_path in removed:
+            backup_path.unlink()
+            self.logger.info(LazyString('db.backup-removed', backup_path=backup_path.resolve(), keep=keep))
+        return removed
+
+    def start_backup_schedule(self, interval_seconds: float = DB_BACKUP_INTERVAL_SECONDS) -> None:
+        """Back up the DB every `interval_seconds` with `backup_db()`'s defaults, on a background thread."""
+
+        def back_up_forever() -> None:
+            while not self._stop_backing_up.wait(interval_seconds):
+                try:
+                    self.backup_db()
+                except Exception as e:  # keep to the schedule; the next backup may well succeed
+                    self.logger.error(LazyString('db.error.scheduled-backup-failed',
+                                                 interval_seconds=interval_seconds,
+                                                 e=e))
+
+        self._stop_backing_up.clear()
+        self._backup_thread = Thread(target=back_up_forever, name='db-backup', daemon=True)
+        self._backup_thread.start()
+
+    def stop_backup_schedule(self) -> None:
+        """Stop the background thread started by `start_backup_schedule()`, after any backup in progress."""
 
-        print(StringMgr.get_string('db.backed-up',
-                                   db_file_path=db_path.resolve(),
-                                   db_backup_file_path=db_backup_path.resolve()))
+        self._stop_backing_up.set()
+        if self._backup_thread is not None:
+            self._backup_thread.join()
+            self._backup_thread = None
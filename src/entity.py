@@ -0,0 +1,10 @@
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class Entity:
+    """One row of the 'entities' table."""
+    entity_id: int
+    name: str
+    user_id: str | None
+    karma: int
+    opted_in: bool
@@ -0,0 +1,124 @@
+from constants import ENTITY_CACHE_SIZE
+from entity import Entity
+from metrics_mgr import MetricsMgr
+
+from collections import OrderedDict
+import dataclasses
+from threading import Lock
+
+
+class EntityCache:
+    """In-process LRU cache of rows from the 'entities' table, so common lookups don't have to query the DB.
+
+    Entities can be looked up by entity_id, name, or user_id. Callers that change an entity in the DB must
+    write the change through to this cache too, or it will serve stale data. An entity read from the DB is only
+    cached if it wasn't changed while it was being read, so a read that raced a write can't put a stale copy back.
+    Hits and misses are counted in the 'entity_cache_hits_total' and 'entity_cache_misses_total' metrics.
+    Thread-safe, since Slack Bolt calls listeners from a pool of worker threads.
+    """
+
+    def __init__(self, max_size: int = ENTITY_CACHE_SIZE):
+        self.max_size: int = max_size
+        self._entities: OrderedDict[int, Entity] = OrderedDict()  # keyed by entity_id, least recently used first
+        self._ids_by_name: dict[str, int] = {}
+        self._ids_by_user_id: dict[str, int] = {}
+        self._generation: int = 0  # goes up by one with every update
+        self._updated_at: dict[int, int] = {}  # entity_id -> generation of its latest update
+        self._cleared_at: int = -1  # generation of the latest `clear()`
+        self._lock: Lock = Lock()
+
+    def get_by_entity_id(self, entity_id: int) -> Entity | None:
+        """:returns: The cached entity with this entity_id, or None if it isn't cached"""
+
+        with self._lock:
+            return self._get(entity_id)
+
+    def get_by_name(self, name: str) -> Entity | None:
+        """:returns: The cached entity with this name, or None if it isn't cached"""
+
+        with self._lock:
+            return self._get(self._ids_by_name.get(name))
+
+    def get_by_user_id(self, user_id: str) -> Entity | None:
+        """:returns: The cached entity with this Slack user ID, or None if it isn't cached"""
+
+        with self._lock:
+            return self._get(self._ids_by_user_id.get(user_id))
+
+    def get_generation(self) -> int:
+        """Call this before reading an entity from the DB, and pass the result to `put()`.
+
+        :returns: The current update generation
+        """
+
+        with self._lock:
+            return self._generation
+
+    def put(self, entity: Entity, generation: int) -> None:
+        """Add an entity read from the DB to the cache, unless it was updated after `generation`. Replaces any
+        older copy of it and evicts the least recently used entity if the cache is full.
+
+        :param generation: What `get_generation()` returned before the entity was read
+        """
+
+        with self._lock:
+            if max(self._cleared_at, self._updated_at.get(entity.entity_id, -1)) >= generation:
+                return
+            self._put(entity)
+
+    def update(self, entity_id: int, **changes) -> None:
+        """Change some fields of an entity, like `update(3, karma=7)`, after changing them in the DB.
+
+        If the entity isn't cached, nothing is changed, but a read of it that's still in progress won't be cached.
+        """
+
+        with self._lock:
+            entity: Entity | None = self._entities.get(entity_id)
+            if entity is not None:
+                self._put(dataclasses.replace(entity, **changes))
+            self._updated_at[entity_id] = self._generation
+            self._generation += 1
+
+    def clear(self) -> None:
+        """Empty the cache, e.g. after the DB was changed by something that didn't write through."""
+
+        with self._lock:
+            self._entities.clear()
+            self._ids_by_name.clear()
+            self._ids_by_user_id.clear()
+            self._updated_at.clear()
+            self._cleared_at = self._generation
+            self._generation += 1
+
+    def _get(self, entity_id: int | None) -> Entity | None:
+        """Look up an entity, count the hit or miss, and mark it as most recently used. Caller holds the lock."""
+
+        entity: Entity | None = self._entities.get(entity_id) if entity_id is not None else None
+        if entity is None:
+            MetricsMgr.increment('entity_cache_misses_total')
+            return None
+        MetricsMgr.increment('entity_cache_hits_total')
+        self._entities.move_to_end(entity_id)
+        return entity
+
+    def _put(self, entity: Entity) -> None:
+        """Add or replace an entity, evicting the least recently used ones if needed. Caller holds the lock."""
+
+        self._remove(entity.entity_id)
+        self._entities[entity.entity_id] = entity
+        self._ids_by_name[entity.name] = entity.entity_id
+        if entity.user_id is not None:
+            self._ids_by_user_id[entity.user_id] = entity.entity_id
+        while len(self._entities) > self.max_size:
+            self._remove(next(iter(self._entities)))
+
+    def _remove(self, entity_id: int) -> None:
+        """Drop an entity and its name and user_id keys from the cache. Caller holds the lock."""
+
+        entity: Entity | None = self._entities.pop(entity_id, None)
+        if entity is None:
+            return
+        if self._ids_by_name.get(entity.name) == entity_id:
+            del self._ids_by_name[entity.name]
+        if entity.user_id is not None and self._ids_by_user_id.get(entity.user_id) == entity_id:
+            del self._ids_by_user_id[entity.user_id]
@@ -1,7 +1,9 @@
 from db_mgr import DbMgr
+from entity import Entity
+from entity_cache import EntityCache
 from enums import Status
+from lazy_string import LazyString
 from slack_api_mgr import SlackApiMgr
-from string_mgr import StringMgr
 
 from logging import Logger
 import sqlite3
@@ -11,37 +13,91 @@ from slack_sdk.errors import SlackApiError
 
 
 class EntityMgr:
+    """Handle all behavior relating to entities.
+
+    Entity lookups are served from `entity_cache` when possible. Every method here that changes the 'entities'
+    table writes the change through to the cache, so the cache never serves stale data from this process. Before
+    each lookup, `DbMgr.check_for_changes()` clears the cache if another process, like `instakarma-admin`, changed
+    an entity.
+    """
+
     def __init__(self,
                  db_mgr: DbMgr,
                  logger: Logger,
-                 slack_api_mgr: SlackApiMgr = None):
+                 slack_api_mgr: SlackApiMgr = None,
+                 entity_cache: EntityCache | None = None):
         self.db_mgr: DbMgr = db_mgr
         self.logger: Logger = logger
         self.slack_api_mgr: SlackApiMgr = slack_api_mgr
+        self.entity_cache: EntityCache = entity_cache or EntityCache()
+        self.db_mgr.add_change_listener(self.entity_cache.clear)
+
+    def get_entity(self, name: str) -> Entity | None:
+        """Get an entity by name, from the cache if possible and from the DB otherwise.
+
+        :returns: The entity, or None if there's no entity with that name in the DB
+        :raises sqlite3.error: If something goes wrong with the DB
+        """
+
+        self.db_mgr.check_for_changes()
+        entity: Entity | None = self.entity_cache.get_by_name(name)
+        if entity is None:
+            entity = self._load_entity('name', name)
+        return entity
+
+    def _load_entity(self, column: Literal['name', 'user_id'], value: str) -> Entity | None:
+        """Read an entity from the DB by name or user_id and add it to the cache.
+
+        :returns: The entity, or None if there's no matching entity in the DB
+        :raises sqlite3.error: If something goes wrong with the DB
+        """
+
+        generation: int = self.entity_cache.get_generation()
+        results: list = self.db_mgr.execute_statement(f"""
+                                                      SELECT entity_id, name, user_id, karma, opted_in
+                                                      FROM entities
+                                                      WHERE {column} = ?;""",
+                                                      (value,))
+        if not results:
+            return None
+        entity: Entity = self._cache_row(results[0], generation)
+        return entity
+
+    def _cache_row(self, row: tuple, generation: int) -> Entity:
+        """Convert an 'entities' row of (entity_id, name, user_id, karma, opted_in) to an Entity and cache it,
+        unless the entity has changed since it was read.
+
+        :param generation: What `EntityCache.get_generation()` returned before the row was read
+        :returns: The entity
+        """
+
+        entity_id, name, user_id, karma, opted_in = row
+        entity: Entity = Entity(entity_id=entity_id,
+                                name=name,
+                                user_id=user_id,
+                                karma=karma,
+                                opted_in=bool(opted_in))
+        self.entity_cache.put(entity, generation)
+        return entity
 
     def get_status(self, name: str) -> Status:
         """Get the status of an entity, identifying it by name.
 
         :returns: Status of the entity
         :raises sqlite3.error: If something goes wrong with the DB
+        :raises ValueError: If there's no entity with that name in the DB
         """
 
         try:
-            results: list = self.db_mgr.execute_statement("""
-                                                          SELECT opted_in
-                                                          FROM entities
-                                                          WHERE name = ?;""",
-                                                          (name,))
-            result: list = results[0]
-            if result:
-                status: Status = Status.OPTED_IN if result[0] else Status.OPTED_OUT
-                return status
-            else:
-                self.logger.info(StringMgr.get_string('entity.error.not-in-db', name=name))
-                raise ValueError
+            entity: Entity | None = self.get_entity(name)
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('entity.error.no-status', name=name, e=e))
+            self.logger.error(LazyString('entity.error.no-status', name=name, e=e))
             raise
+        if entity is None:
+            self.logger.info(LazyString('entity.error.not-in-db', name=name))
+            raise ValueError
+        status: Status = Status.OPTED_IN if entity.opted_in else Status.OPTED_OUT
+        return status
 
     def name_exists_in_db(self, name: str) -> bool:
         """See if an entity with a particular name exists in the 'entities' table.
@@ -51,15 +107,10 @@ class EntityMgr:
         """
 
         try:
-            results: list = self.db_mgr.execute_statement("""
-                                                          SELECT *
-                                                          FROM entities
-                                                          WHERE name = ?;""",
-                                                          (name,))
-            exists: bool = len(results) > 0
+            exists: bool = self.get_entity(name) is not None
             return exists
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('entity.error.could-not-check-name', name=name, e=e))
+            self.logger.error(LazyString('entity.error.could-not-check-name', name=name, e=e))
             raise
 
     def set_status(self, name: str, new_status: Status) -> None:
@@ -68,46 +119,50 @@ class EntityMgr:
         :raises sqlite3.error: If something goes wrong with the DB
         """
 
+        opted_in: bool = new_status == Status.OPTED_IN
         try:
-            self.db_mgr.execute_statement(f"""
+            results: list = self.db_mgr.execute_statement(f"""
                                            UPDATE entities
-                                           SET opted_in = {'TRUE' if new_status == Status.OPTED_IN else 'FALSE'}
-                                           WHERE name = ?;""",
-                                           (name,))
-            self.logger.info(StringMgr.get_string('entity.current-status', name=name, status=new_status.value))
+                                           SET opted_in = {'TRUE' if opted_in else 'FALSE'}
+                                           WHERE name = ?
+                                           RETURNING entity_id;""",
+                                                          (name,))
+            self.logger.info(LazyString('entity.current-status', name=name, status=new_status.value))
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('entity.error.could-not-set-status',
-                                                   name=name,
-                                                   status=new_status.value,
-                                                   e=e))
+            self.logger.error(LazyString('entity.error.could-not-set-status',
+                                         name=name,
+                                         status=new_status.value,
+                                         e=e))
             raise
+        if results:  # update it even if it isn't cached, so a read of it that's in progress isn't cached
+            self.entity_cache.update(results[0][0], opted_in=opted_in)
 
     def get_name_from_user_id(self, user_id: str) -> str:
         """ Convert an entity's user_id to its name.
 
-        Consult the DB and/or Slack API and add DB entries as needed.
+        Consult the cache, DB, and/or Slack API and add DB entries as needed.
 
         :returns: Name corresponding to the provided user_id
         :raises sqlite3.error: If something goes wrong with the DB
         """
 
+        self.db_mgr.check_for_changes()
+        entity: Entity | None = self.entity_cache.get_by_user_id(user_id)
+        if entity is not None:
+            return entity.name
+
         # if row exists in DB with that user_id and name, return name
         try:
-            results: list = self.db_mgr.execute_statement("""
-                                                          SELECT name
-                                                          FROM entities
-                                                          WHERE user_id = ?;""",
-                                                          (user_id,))
+            entity = self._load_entity('user_id', user_id)
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('entity.error.could-not-get-name-from-user-id',
-                                                   user_id=user_id,
-                                                   e=e))
+            self.logger.error(LazyString('entity.error.could-not-get-name-from-user-id',
+                                         user_id=user_id,
+                                         e=e))
             raise
 
-        if len(results):
-            name: str = results[0][0]
-            if name:
-                return name
+        if entity is not None:
+            if entity.name:
+                return entity.name
             else:
                 # else if row exists for that `user_id` but it has no value for 'name',
                 # look up `name` in the API, update the row with `name`, and return the `name`
@@ -122,11 +177,12 @@ class EntityMgr:
                                                   WHERE user_id = ?;""",
                                                   (name, user_id))
                 except sqlite3.Error as e:
-                    self.logger.error(StringMgr.get_string('entity.error.could-not-set-name',
-                                                           name=name,
-                                                           user_id=user_id,
-                                                           e=e))
+                    self.logger.error(LazyString('entity.error.could-not-set-name',
+                                                 name=name,
+                                                 user_id=user_id,
+                                                 e=e))
                     raise
+                self.entity_cache.update(entity.entity_id, name=name)
                 return name
         # else insert a row with name and user_id and return name
         try:
@@ -134,17 +190,23 @@ class EntityMgr:
         except SlackApiError:
             raise
         try:
-            self.db_mgr.execute_statement("""
-                                          INSERT INTO entities (name, user_id)
-                                          VALUES (?, ?);""",
-                                          (name, user_id))
+            # another thread may have added the same user since we looked, so ignore a duplicate and reload it
+            generation: int = self.entity_cache.get_generation()
+            results: list = self.db_mgr.execute_statement("""
+                                                          INSERT OR IGNORE INTO entities (name, user_id)
+                                                          VALUES (?, ?)
+                                                          RETURNING entity_id, name, user_id, karma, opted_in;""",
+                                                          (name, user_id))
+            entity = self._cache_row(results[0], generation) if results else self._load_entity('user_id', user_id)
+            if entity is None:  # the insert was ignored because a different user already has this name
+                raise sqlite3.IntegrityError(f'UNIQUE constraint failed: entities.name ({name!r})')
+            return entity.name
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('entity.error.could-not-add-name-and-user-id',
-                                                   name=name,
-                                                   user_id=user_id,
-                                                   e=e))
+            self.logger.error(LazyString('entity.error.could-not-add-name-and-user-id',
+                                         name=name,
+                                         user_id=user_id,
+                                         e=e))
             raise
-        return name
 
     def add_entity(self, name: str, user_id: str | None) -> None:
         """Add an entity to the table.
@@ -154,17 +216,24 @@ class EntityMgr:
         :raises sqlite3.Error: If something goes wrong with the DB
         """
 
+        self.db_mgr.check_for_changes()
+        if self.entity_cache.get_by_name(name) is not None:
+            return
         try:
-            self.db_mgr.execute_statement("""
-                                          INSERT OR IGNORE INTO entities (name, user_id)
-                                          VALUES (?, ?);""",
-                                          (name, user_id))
+            generation: int = self.entity_cache.get_generation()
+            results: list = self.db_mgr.execute_statement("""
+                                                          INSERT OR IGNORE INTO entities (name, user_id)
+                                                          VALUES (?, ?)
+                                                          RETURNING entity_id, name, user_id, karma, opted_in;""",
+                                                          (name, user_id))
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('entity.error.could-not-add-entity',
-                                                   name=name,
-                                                   user_id=user_id,
-                                                   e=e))
+            self.logger.error(LazyString('entity.error.could-not-add-entity',
+                                         name=name,
+                                         user_id=user_id,
+                                         e=e))
             raise
+        if results:  # nothing is returned if the entity already existed
+            self._cache_row(results[0], generation)
 
     def list_entities(self, attribute: Literal['karma', 'name']) -> list[tuple[str, int]]:
         """List all entities in the DB either alphabetically or by descending karma.
@@ -181,7 +250,7 @@ class EntityMgr:
                                          ORDER BY {attribute} {'DESC' if attribute == 'karma' else 'ASC'};""",
                                                           ())
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('entity.error.could-not-list-entities', e=e))
+            self.logger.error(LazyString('entity.error.could-not-list-entities', e=e))
             raise
         entities: list[tuple[str, int]] = [(name, karma) for name, karma in results]
         return entities
@@ -201,7 +270,7 @@ class EntityMgr:
                                                           ORDER BY name;""",
                                                           ())
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('entity.error.could-not-list-opted-out', e=e))
+            self.logger.error(LazyString('entity.error.could-not-list-opted-out', e=e))
             raise
         entities: list[str] = [result[0] for result in results]
         return entities
@@ -11,6 +11,28 @@ class Action(Enum):
     INCREMENT: str = '++'
 
 
+class ExportFormat(Enum):
+    """File formats `instakarma-admin export-grants` can write."""
+
+    CSV: str = 'csv'  # a header row, then one row per grant
+    NDJSON: str = 'ndjson'  # one JSON object per grant per line
+
+
+class LogFormat(Enum):
+    """How `LogMgr` writes each log record."""
+
+    JSON: str = 'json'  # one JSON object per line, with the string key and its fields
+    TEXT: str = 'text'  # "<time> - <level> - <message>"
+
+
+class RecipientKind(Enum):
+    """What kind of thing `MessageParser` found a karma operator after."""
+
+    INVALID_USER: str = 'invalid-user'  # "@foo++", where "foo" isn't a Slack user
+    OBJECT: str = 'object'  # "foo++" or "foo--"
+    VALID_USER: str = 'valid-user'  # "<@U123>++", which is how Slack sends a real @-mention
+
+
 class Status(Enum):
     """Slack users can opt out if they don't want to participate in instakarma."""
 
@@ -13,3 +13,15 @@ class OptedOutGranterError(Exception):
     """An opted-out user has tried to grant karma."""
 
     pass
+
+
+class GrantQueueFullError(Exception):
+    """Grants are arriving faster than `GrantWriter` can write them, so a grant was refused without being recorded."""
+
+    pass
+
+
+class GrantTimeoutError(Exception):
+    """`GrantWriter` started writing a grant but didn't finish in time, so it may or may not have been recorded."""
+
+    pass
@@ -0,0 +1,114 @@
+import os
+import sys
+
+if os.path.basename(os.getcwd()) != 'src':
+    print("Error: 'grant-benchmark' must be run from the '<REPO-ROOT-DIR>/src/' directory")
+    sys.exit(1)
+
+from constants import *
+from db_mgr import DbMgr
+from entity_cache import EntityCache
+from entity_mgr import EntityMgr
+from grant_writer import GrantWriter
+from karma_mgr import KarmaMgr
+from string_mgr import StringMgr
+
+import argparse
+from argparse import ArgumentParser
+import logging
+from logging import Logger
+from pathlib import Path
+import random
+from sqlite3 import Connection
+import sqlite3
+import tempfile
+import time
+
+
+class UnpooledDbMgr(DbMgr):
+    """DbMgr as it was before connection pooling: every statement gets a new connection with SQLite's defaults."""
+
+    def get_db_connection(self) -> Connection:
+        return sqlite3.connect(self.db_file_name, check_same_thread=False)
+
+
+def make_db(db_mgr: DbMgr, num_users: int, num_objects: int) -> None:
+    """Create a test DB with `num_users` users to grant karma and `num_objects` objects to receive it."""
+
+    db_mgr.init_db()
+    db_mgr.migrate_db()
+    with db_mgr.transaction() as conn:
+        conn.executemany('INSERT INTO entities (name, user_id) VALUES (?, ?);',
+                         [(f'@user{i}', f'U{i:08d}') for i in range(num_users)] +
+                         [(f'thing{i}', None) for i in range(num_objects)])
+
+
+def time_grants(db_mgr: DbMgr, num_grants: int, num_users: int, num_objects: int) -> float:
+    """Grant karma `num_grants` times in a row from one thread, like `foo++` messages handled one at a time.
+
+    The entity cache is off, so each grant also reads its granter and recipient from the DB, and the grant writer
+    isn't started, so each grant is committed on its own by the calling thread.
+
+    :returns: Grants per second
+    """
+
+    entity_mgr: EntityMgr = EntityMgr(db_mgr, logger, entity_cache=EntityCache(max_size=0))
+    karma_mgr: KarmaMgr = KarmaMgr(db_mgr, entity_mgr, logger,
+                                   GrantWriter(db_mgr, entity_mgr.entity_cache, logger))
+    grants: list[tuple[str, str]] = [(f'@user{random.randrange(num_users)}', f'thing{random.randrange(num_objects)}')
+                                     for _ in range(num_grants)]
+    start: float = time.perf_counter()
+    for granter_name, recipient_name in grants:
+        karma_mgr.grant_karma(granter_name, recipient_name, 1)
+    return num_grants / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """Parse CLI parameters, then time grants with and without pooled DB connections."""
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description=StringMgr.get_string('grant-benchmark.description'),
+        prog=StringMgr.get_string('grant-benchmark.prog'))
+    parser.add_argument('--grants',
+                        default=GRANT_BENCHMARK_GRANTS,
+                        help=StringMgr.get_string('grant-benchmark.help.grants'),
+                        type=int)
+    parser.add_argument('--rounds',
+                        default=GRANT_BENCHMARK_ROUNDS,
+                        help=StringMgr.get_string('grant-benchmark.help.rounds'),
+                        type=int)
+    args: argparse.Namespace = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_mgrs: dict[str, DbMgr] = {
+            'unpooled': UnpooledDbMgr(logger, db_file_name=str(Path(temp_dir) / 'unpooled.db')),
+            'pooled': DbMgr(logger, db_file_name=str(Path(temp_dir) / 'pooled.db'))}
+        for db_mgr in db_mgrs.values():
+            make_db(db_mgr, GRANT_BENCHMARK_USERS, GRANT_BENCHMARK_OBJECTS)
+
+        # rounds alternate between setups, so a slow patch on a shared machine doesn't land all on one of them
+        best_grants_per_sec: dict[str, float] = dict.fromkeys(db_mgrs, 0.0)
+        for _ in range(args.rounds):
+            for setup, db_mgr in db_mgrs.items():
+                grants_per_sec: float = time_grants(db_mgr, args.grants, GRANT_BENCHMARK_USERS,
+                                                    GRANT_BENCHMARK_OBJECTS)
+                best_grants_per_sec[setup] = max(best_grants_per_sec[setup], grants_per_sec)
+        for db_mgr in db_mgrs.values():
+            db_mgr.close_all_connections()
+
+    for setup, grants_per_sec in best_grants_per_sec.items():
+        print(StringMgr.get_string('grant-benchmark.result',
+                                   setup=setup,
+                                   grants=args.grants,
+                                   grants_per_sec=grants_per_sec,
+                                   rounds=args.rounds))
+    print(StringMgr.get_string('grant-benchmark.speedup',
+                               speedup=best_grants_per_sec['pooled'] / best_grants_per_sec['unpooled']))
+
+
+if __name__ == '__main__':
+    # thousands of grants shouldn't go to the bot's log
+    logger: Logger = logging.getLogger(StringMgr.get_string('grant-benchmark.prog'))
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    main()
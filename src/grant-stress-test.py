@@ -0,0 +1,200 @@
+import os
+import sys
+
+if os.path.basename(os.getcwd()) != 'src':
+    print("Error: 'grant-stress-test' must be run from the '<REPO-ROOT-DIR>/src/' directory")
+    sys.exit(1)
+
+from constants import *
+from db_mgr import DbMgr
+from entity_mgr import EntityMgr
+from enums import Action
+from grant_writer import GrantWriter
+from karma_mgr import KarmaMgr
+from my_stats_cache import MyStatsCache
+from string_mgr import StringMgr
+
+import argparse
+from argparse import ArgumentParser
+import logging
+from logging import Logger
+from pathlib import Path
+import random
+import tempfile
+from threading import Event, Lock, Thread
+import time
+
+
+def run_stress(entity_mgr: EntityMgr,
+               karma_mgr: KarmaMgr,
+               num_users: int,
+               num_objects: int,
+               num_granters: int,
+               grants_per_granter: int,
+               num_readers: int) -> tuple[list[Exception], list[Exception]]:
+    """Grant karma from `num_granters` threads at once, as fast as they can, while `num_readers` threads read.
+
+    Every grant goes to one of only `num_objects` objects, so the threads keep updating the same rows.
+
+    :returns: Every exception raised by the granting threads, and every exception raised by the reading threads
+    """
+
+    grant_errors: list[Exception] = []
+    read_errors: list[Exception] = []
+    errors_lock: Lock = Lock()
+    stop_reading: Event = Event()
+
+    def record_error(errors: list[Exception], e: Exception) -> None:
+        with errors_lock:
+            errors.append(e)
+
+    def grant() -> None:
+        for _ in range(grants_per_granter):
+            try:
+                karma_mgr.grant_karma(f'@user{random.randrange(num_users)}', f'thing{random.randrange(num_objects)}',
+                                      random.choice((1, -1)))
+            except Exception as e:
+                record_error(grant_errors, e)
+
+    def read() -> None:
+        while not stop_reading.is_set():
+            try:
+                karma_mgr.get_top_granters(f'thing{random.randrange(num_objects)}')
+                karma_mgr.get_top_recipients(f'@user{random.randrange(num_users)}', Action.INCREMENT)
+                karma_mgr.get_my_stats(entity_mgr.get_entity(f'@user{random.randrange(num_users)}'))
+                entity_mgr.list_entities('karma')
+            except Exception as e:
+                record_error(read_errors, e)
+
+    granters: list[Thread] = [Thread(target=grant) for _ in range(num_granters)]
+    readers: list[Thread] = [Thread(target=read) for _ in range(num_readers)]
+    for thread in readers + granters:
+        thread.start()
+    for thread in granters:
+        thread.join()
+    stop_reading.set()
+    for thread in readers:
+        thread.join()
+    return grant_errors, read_errors
+
+
+def find_mismatches(db_mgr: DbMgr, karma_mgr: KarmaMgr, expected_grants: int) -> list[str]:
+    """Compare the DB's running totals, and the totals the caches serve, with the 'grants' table itself.
+
+    :returns: A description of each mismatch
+    """
+
+    mismatches: list[str] = []
+    num_grants: int = db_mgr.execute_statement('SELECT COUNT(*) FROM grants;', ())[0][0]
+    if num_grants != expected_grants:
+        mismatches.append(StringMgr.get_string('grant-stress-test.mismatch.grants',
+                                               expected=expected_grants,
+                                               actual=num_grants))
+    for name, karma, grants_sum in db_mgr.execute_statement("""
+                                    SELECT e.name, e.karma, COALESCE(SUM(g.amount), 0)
+                                    FROM entities e
+                                    LEFT JOIN grants g ON g.recipient_id = e.entity_id
+                                    GROUP BY e.entity_id
+                                    ORDER BY e.name;""",
+                                                            ()):
+        if karma != grants_sum:
+            mismatches.append(StringMgr.get_string('grant-stress-test.mismatch.karma',
+                                                   name=name,
+                                                   karma=karma,
+                                                   grants_sum=grants_sum))
+        elif karma_mgr.get_karma(name) != karma:
+            mismatches.append(StringMgr.get_string('grant-stress-test.mismatch.cached-karma',
+                                                   name=name,
+                                                   karma=karma,
+                                                   cached_karma=karma_mgr.get_karma(name)))
+    num_bad_pairs: int = db_mgr.execute_statement("""
+                                    SELECT COUNT(*)
+                                    FROM (SELECT granter_id, recipient_id, SUM(amount = 1) AS plus_count,
+                                                 SUM(amount = -1) AS minus_count
+                                          FROM grants
+                                          GROUP BY granter_id, recipient_id) g
+                                    FULL JOIN grant_pair_totals p USING (granter_id, recipient_id)
+                                    WHERE p.plus_count IS NOT g.plus_count OR p.minus_count IS NOT g.minus_count;""",
+                                                  ())[0][0]
+    if num_bad_pairs:
+        mismatches.append(StringMgr.get_string('grant-stress-test.mismatch.pair-totals', pairs=num_bad_pairs))
+    return mismatches
+
+
+def main() -> None:
+    """Parse CLI parameters, grant karma from many threads at once on a test DB, and check that the totals add up."""
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description=StringMgr.get_string('grant-stress-test.description'),
+        prog=StringMgr.get_string('grant-stress-test.prog'))
+    parser.add_argument('--grants',
+                        default=GRANT_STRESS_TEST_GRANTS,
+                        help=StringMgr.get_string('grant-stress-test.help.grants'),
+                        type=int)
+    parser.add_argument('--no-writer',
+                        action='store_true',
+                        help=StringMgr.get_string('grant-stress-test.help.no-writer'))
+    parser.add_argument('--objects',
+                        default=GRANT_STRESS_TEST_OBJECTS,
+                        help=StringMgr.get_string('grant-stress-test.help.objects'),
+                        type=int)
+    parser.add_argument('--readers',
+                        default=GRANT_STRESS_TEST_READERS,
+                        help=StringMgr.get_string('grant-stress-test.help.readers'),
+                        type=int)
+    parser.add_argument('--threads',
+                        default=GRANT_WORKERS,
+                        help=StringMgr.get_string('grant-stress-test.help.threads'),
+                        type=int)
+    args: argparse.Namespace = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_mgr: DbMgr = DbMgr(logger, db_file_name=str(Path(temp_dir) / 'instakarma.db'))
+        db_mgr.init_db()
+        db_mgr.migrate_db()
+        with db_mgr.transaction() as conn:
+            conn.executemany('INSERT INTO entities (name, user_id) VALUES (?, ?);',
+                             [(f'@user{i}', f'U{i:08d}') for i in range(GRANT_STRESS_TEST_USERS)] +
+                             [(f'thing{i}', None) for i in range(args.objects)])
+
+        my_stats_cache: MyStatsCache = MyStatsCache()
+        entity_mgr: EntityMgr = EntityMgr(db_mgr, logger)
+        grant_writer: GrantWriter = GrantWriter(db_mgr, entity_mgr.entity_cache, logger,
+                                                my_stats_cache=my_stats_cache)
+        karma_mgr: KarmaMgr = KarmaMgr(db_mgr, entity_mgr, logger, grant_writer, my_stats_cache)
+        if not args.no_writer:
+            grant_writer.start()
+        start: float = time.perf_counter()
+        try:
+            grant_errors, read_errors = run_stress(entity_mgr, karma_mgr, GRANT_STRESS_TEST_USERS, args.objects,
+                                                   args.threads, args.grants, args.readers)
+        finally:
+            grant_writer.close()
+        seconds: float = time.perf_counter() - start
+        # a grant that raised was rolled back, so it shouldn't be in the DB
+        mismatches: list[str] = find_mismatches(db_mgr, karma_mgr, args.threads * args.grants - len(grant_errors))
+        db_mgr.close_all_connections()
+
+    errors: list[Exception] = grant_errors + read_errors
+    print(StringMgr.get_string('grant-stress-test.result',
+                               grants=args.threads * args.grants,
+                               threads=args.threads,
+                               readers=args.readers,
+                               seconds=seconds,
+                               errors=len(errors),
+                               mismatches=len(mismatches)))
+    for e in errors[:GRANT_STRESS_TEST_MAX_REPORTED]:
+        print(StringMgr.get_string('grant-stress-test.error', e=repr(e)))
+    for mismatch in mismatches[:GRANT_STRESS_TEST_MAX_REPORTED]:
+        print(mismatch)
+    if errors or mismatches:
+        sys.exit(StringMgr.get_string('grant-stress-test.failed'))
+    print(StringMgr.get_string('grant-stress-test.passed'))
+
+
+if __name__ == '__main__':
+    # thousands of grants shouldn't go to the bot's log
+    logger: Logger = logging.getLogger(StringMgr.get_string('grant-stress-test.prog'))
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    main()
@@ -1,16 +1,16 @@
-from constants import GRANTS_EXPORT_FILE
 from db_mgr import DbMgr
 from entity_mgr import EntityMgr
-from enums import Action
-from exceptions import OptedOutRecipientError, OptedOutGranterError
+from enums import Action, RecipientKind
+from exceptions import GrantQueueFullError, GrantTimeoutError, OptedOutRecipientError, OptedOutGranterError
 from karma_mgr import KarmaMgr
+from lazy_string import LazyString
 from message_parser import MessageParser
+from metrics_mgr import MetricsMgr
+from recipient import Recipient
+from reply_collector import ReplyCollector
 from string_mgr import StringMgr
 
 from logging import Logger
-from pathlib import Path
-import sqlite3
-from typing import Final
 
 from slack_sdk.errors import SlackApiError
 
@@ -30,6 +30,44 @@ class GrantMgr:
         self.logger = logger
         self.message_parser = message_parser
 
+    def handle_grants(self,
+                      say,
+                      granter_user_id: str,
+                      msg_text: str,
+                      thread_timestamp: str | None = None) -> None:
+        """Find every karma recipient in a message and grant (or refuse to grant) karma to each of them.
+
+        :param say: Any text passed to this callback will be displayed to the user in Slack. It's called once, with
+                    the replies for every recipient on separate lines, so a message with many recipients makes one
+                    Slack API call instead of one per recipient.
+        :param granter_user_id: User ID of the person granting karma
+        :param msg_text: Full text of the Slack message
+        :param thread_timestamp: The timestamp of the thread where the grant occurred or None
+                                 if it occurred in a channel instead of a thread
+        """
+
+        with MetricsMgr.timer('message_parse_seconds'):
+            recipients: list[Recipient] = self.message_parser.scan(msg_text)
+
+        # Keep the original reply order: valid users first, then invalid users, then objects
+        valid_user_recipients: list[tuple[str, Action]] = \
+            [(r.name, r.action) for r in recipients if r.kind is RecipientKind.VALID_USER]
+        invalid_user_recipients: list[tuple[str, Action]] = \
+            [(r.name, r.action) for r in recipients if r.kind is RecipientKind.INVALID_USER]
+        object_recipients: list[tuple[str, Action]] = \
+            [(r.name, r.action) for r in recipients if r.kind is RecipientKind.OBJECT]
+
+        replies: ReplyCollector = ReplyCollector()
+        try:
+            for recipient in valid_user_recipients:
+                self.grant_to_valid_user(replies, granter_user_id, recipient, thread_timestamp)
+            for recipient in invalid_user_recipients:
+                self.grant_to_invalid_user(replies, granter_user_id, recipient, thread_timestamp)
+            for recipient in object_recipients:
+                self.grant_to_object(replies, granter_user_id, recipient, thread_timestamp)
+        finally:  # if a grant fails, still send the replies for the grants before it
+            replies.send_as_one(say, thread_ts=thread_timestamp)
+
     def grant_to_valid_user(self,
                             say,
                             granter_user_id: str,
@@ -56,32 +94,32 @@ class GrantMgr:
         try:
             granter_name: str = self.entity_mgr.get_name_from_user_id(granter_user_id)
         except SlackApiError:
-            self.logger.error(StringMgr.get_string('grant.log.error.no-name-for-user-id',
-                                                   user_id=granter_user_id))
+            self.logger.error(LazyString('grant.log.error.no-name-for-user-id',
+                                         user_id=granter_user_id))
             return
         try:
             recipient_name: str = self.entity_mgr.get_name_from_user_id(recipient_user_id)
         except SlackApiError:
-            self.logger.error(StringMgr.get_string('grant.log.error.no-name-for-user-id',
-                                                   user_id=recipient_user_id))
+            self.logger.error(LazyString('grant.log.error.no-name-for-user-id',
+                                         user_id=recipient_user_id))
             return
 
         if action == Action.DECREMENT:
-            self.logger.info(StringMgr.get_string('grant.log.info.remove-karma-from-person',
-                                                  granter_name=granter_name,
-                                                  recipient_name=recipient_name))
+            self.logger.info(LazyString('grant.log.info.remove-karma-from-person',
+                                        granter_name=granter_name,
+                                        recipient_name=recipient_name))
             say(StringMgr.get_string('grant.remove-karma-from-person'), thread_ts=thread_timestamp)
             return
 
         if recipient_name == granter_name:
-            self.logger.info(StringMgr.get_string('grant.log.info.self-grant',
-                                                  granter_name=granter_name,
-                                                  amount=amount))
+            self.logger.info(LazyString('grant.log.info.self-grant',
+                                        granter_name=granter_name,
+                                        amount=amount))
             say(StringMgr.get_string('grant.self-grant'), thread_ts=thread_timestamp)
             return
 
         try:
-            self.karma_mgr.grant_karma(granter_name, recipient_name, amount)
+            recipient_total_karma: int = self.karma_mgr.grant_karma(granter_name, recipient_name, amount)
         except OptedOutRecipientError:
             say(StringMgr.get_string('grant.recipient-opted-out', name=recipient_name),
                 thread_ts=thread_timestamp)
@@ -90,7 +128,12 @@ class GrantMgr:
             say(StringMgr.get_string('grant.granter-opted-out'),
                 thread_ts=thread_timestamp)
             return
-        recipient_total_karma: int = self.karma_mgr.get_karma(recipient_name)
+        except GrantQueueFullError:
+            say(StringMgr.get_string('grant.busy'), thread_ts=thread_timestamp)
+            return
+        except GrantTimeoutError:
+            say(StringMgr.get_string('grant.timeout'), thread_ts=thread_timestamp)
+            return
         say(StringMgr.get_string('grant.success',
                                  emoji=emoji,
                                  recipient_name=recipient_name,
@@ -116,17 +159,17 @@ class GrantMgr:
         try:
             granter_name: str = self.entity_mgr.get_name_from_user_id(granter_user_id)
         except SlackApiError:
-            self.logger.error(StringMgr.get_string('grant.log.error.no-name-for-user-id',
-                                                   user_id=granter_user_id))
+            self.logger.error(LazyString('grant.log.error.no-name-for-user-id',
+                                         user_id=granter_user_id))
             return
 
         recipient_name: str = recipient[0]
         action: Action = recipient[1]
         amount, _, _ = self.message_parser.get_amount_verb_emoji(action)
-        self.logger.info(StringMgr.get_string('grant.log.info.invalid-person',
-                                              granter_name=granter_name,
-                                              amount=amount,
-                                              recipient_name=recipient_name))
+        self.logger.info(LazyString('grant.log.info.invalid-person',
+                                    granter_name=granter_name,
+                                    amount=amount,
+                                    recipient_name=recipient_name))
         say(StringMgr.get_string('grant.invalid-person', recipient_name=recipient_name),
             thread_ts=thread_timestamp)
 
@@ -154,8 +197,7 @@ class GrantMgr:
         amount, verb, emoji = self.message_parser.get_amount_verb_emoji(action)
         self.entity_mgr.add_entity(recipient_name, None)
         try:
-            self.karma_mgr.grant_karma(granter_name, recipient_name, amount)
-            recipient_total_karma: int = self.karma_mgr.get_karma(recipient_name)
+            recipient_total_karma: int = self.karma_mgr.grant_karma(granter_name, recipient_name, amount)
             say(f"{emoji} {recipient_name} {verb}, now has {recipient_total_karma} karma",
                 thread_ts=thread_timestamp)
 
@@ -167,42 +209,8 @@ class GrantMgr:
             say(StringMgr.get_string('grant.granter-opted-out', name=recipient_name),
                 thread_ts=thread_timestamp)
 
-    def export_grants(self) -> None:
-        """ Dump a history of all grants that are in the DB into a local CSV file.
-
-        Since this is designed to be called only from `instakarma-admin`:
-            * Exit rather than raise an error if anything goes wrong
-            * Print messages instead of logging them
+        except GrantQueueFullError:
+            say(StringMgr.get_string('grant.busy'), thread_ts=thread_timestamp)
 
-        :raises SystemExit: If anything goes wrong
-        """
-
-        grants_export_file_path: Final[Path] = Path(GRANTS_EXPORT_FILE)
-        if grants_export_file_path.exists():
-            raise SystemExit(StringMgr.get_string('grant.log.error.export-file-exists',
-                                          grants_export_file_path=grants_export_file_path.resolve()))
-        try:
-            results: list = self.db_mgr.execute_statement(
-                """
-                SELECT r.name AS recipient_name,
-                       g.name AS granter_name,
-                       gr.amount,
-                       gr.timestamp
-                FROM grants gr
-                JOIN entities r on gr.recipient_id = r.entity_id
-                JOIN entities g on gr.granter_id = g.entity_id
-                ORDER BY gr.timestamp;""",
-                ())
-        except sqlite3.Error as e:
-            raise SystemExit(f"error: {e}")
-        try:
-            with open(grants_export_file_path, 'w') as file:
-                file.write('TIMESTAMP,GRANTER,AMOUNT,RECIPIENT\n')
-                for recipient_name, granter_name, delta, timestamp in results:
-                    file.write(f"{timestamp},{granter_name},{delta},{recipient_name}\n")
-        except Exception as e:
-            raise SystemExit(StringMgr.get_string('grants.log.error.write-file',
-                                                  grants_export_file_path=grants_export_file_path.resolve(),
-                                                  e=e))
-        print(StringMgr.get_string('grant.grants-exported',
-                                   grants_export_file_path=grants_export_file_path.resolve()))
+        except GrantTimeoutError:
+            say(StringMgr.get_string('grant.timeout'), thread_ts=thread_timestamp)
@@ -0,0 +1,282 @@
+from constants import GRANT_BATCH_MAX_DELAY_SECONDS, GRANT_BATCH_MAX_SIZE, GRANT_QUEUE_SIZE, \
+    GRANT_QUEUE_TIMEOUT_SECONDS, GRANT_RESULT_TIMEOUT_SECONDS, GRANT_WRITER_IDLE_SECONDS
+from db_mgr import DbMgr
+from entity_cache import EntityCache
+from exceptions import GrantQueueFullError, GrantTimeoutError, OptedOutGranterError, OptedOutRecipientError
+from histogram import Histogram
+from lazy_string import LazyString
+from leaderboard_index import LeaderboardIndex
+from metrics_mgr import MetricsMgr
+from my_stats_cache import MyStatsCache
+
+from concurrent.futures import Future, TimeoutError
+from dataclasses import dataclass, field
+from logging import Logger
+import queue
+from queue import Queue
+from sqlite3 import Connection
+import sqlite3
+from threading import Lock, Thread
+import time
+
+
+@dataclass
+class PendingGrant:
+    """A grant waiting in the queue, and the Future its caller is waiting on for the recipient's new karma."""
+    granter_id: int
+    recipient_id: int
+    amount: int
+    future: Future = field(default_factory=Future)
+    queued_at: float = field(default_factory=time.perf_counter)
+
+
+class GrantWriter:
+    """Write karma grants to the DB, batching grants from many messages into one transaction ("group commit").
+
+    Until `start()` is called, `write()` writes each grant in its own transaction on the caller's thread.
+    After that, `write()` queues the grant for a dedicated writer thread, which commits everything that arrived
+    within `max_delay_seconds` of the first waiting grant (up to `max_batch_size` grants) in one transaction,
+    then tells each caller its recipient's new karma. But if no grant has been written for `idle_seconds`,
+    `write()` writes the grant itself, since a lone grant would only wait for the hand-off to the writer thread.
+    Grants that follow it within `idle_seconds`, like the rest of a burst, are queued as usual.
+    Grants are written one transaction at a time either way.
+
+    Each grant re-checks that its granter and recipient are opted in, inside its transaction, so a grant can't
+    slip past an opt-out that committed after its caller last looked.
+
+    If there's a leaderboard index, it's told about each committed grant, in commit order. If there's a my-stats
+    cache, each committed grant's granter and recipient are invalidated in it before their callers are told.
+    """
+
+    _STOP: object = object()  # queued by `close()` to tell the writer thread to finish
+
+    def __init__(self,
+                 db_mgr: DbMgr,
+                 entity_cache: EntityCache,
+                 logger: Logger,
+                 leaderboard_index: LeaderboardIndex | None = None,
+                 my_stats_cache: MyStatsCache | None = None,
+                 max_batch_size: int = GRANT_BATCH_MAX_SIZE,
+                 max_delay_seconds: float = GRANT_BATCH_MAX_DELAY_SECONDS,
+                 queue_size: int = GRANT_QUEUE_SIZE,
+                 idle_seconds: float | None = GRANT_WRITER_IDLE_SECONDS):
+        """:param idle_seconds: How long no grant must have been written for `write()` to write a grant itself,
+                             or None to always queue grants once the writer thread is started
+        """
+
+        self.db_mgr = db_mgr
+        self.entity_cache = entity_cache
+        self.logger = logger
+        self.leaderboard_index = leaderboard_index
+        self.my_stats_cache = my_stats_cache
+        self.max_batch_size: int = max_batch_size
+        self.max_delay_seconds: float = max_delay_seconds
+        self.idle_seconds: float | None = idle_seconds
+        self._last_write_at: float = float('-inf')  # `time.monotonic()` when the latest batch started being written
+        self._queue: Queue = Queue(maxsize=queue_size)  # bounded, so a burst slows callers down instead of piling up
+        self._queue_wait_histogram: Histogram = MetricsMgr.get_histogram('grant_queue_wait_seconds')
+        self._writer_thread: Thread | None = None
+        self._write_lock: Lock = Lock()  # held while writing a batch, so the caches see grants in commit order
+        self._start_lock: Lock = Lock()
+
+    def start(self) -> None:
+        """Start the writer thread, so grants are batched from now on."""
+
+        self._writer_thread = Thread(target=self._write_forever, name='grant-writer', daemon=True)
+        self._writer_thread.start()
+
+    def close(self) -> None:
+        """Write every grant that's already queued, then stop the writer thread."""
+
+        with self._start_lock:  # so the stopped thread isn't mistaken for a dead one and restarted
+            if self._writer_thread is None:
+                return
+            self._queue.put(self._STOP)
+            self._writer_thread.join()
+            self._writer_thread = None
+
+    def write(self, granter_id: int, recipient_id: int, amount: int) -> int:
+        """Record a grant and update the recipient's karma.
+
+        :returns: The recipient's karma after the grant
+        :raises OptedOutGranterError: If the granter isn't opted in when the grant is written
+        :raises OptedOutRecipientError: If the recipient isn't opted in when the grant is written
+        :raises GrantQueueFullError: If the queue stays full for `GRANT_QUEUE_TIMEOUT_SECONDS`, or the grant waits
+                                     in it for `GRANT_RESULT_TIMEOUT_SECONDS`, so it wasn't recorded
+        :raises GrantTimeoutError: If the grant is still being written after twice `GRANT_RESULT_TIMEOUT_SECONDS`
+        :raises sqlite3.Error: If anything goes wrong with the DB
+        """
+
+        pending_grant: PendingGrant = PendingGrant(granter_id, recipient_id, amount)
+        if self._writer_thread is None:
+            with self._write_lock:
+                self._write_batch([pending_grant])
+            return pending_grant.future.result()
+        if self._is_idle() and self._write_lock.acquire(blocking=False):
+            try:
+                self._write_batch([pending_grant])
+            finally:
+                self._write_lock.release()
+            return pending_grant.future.result()
+
+        self._restart_if_dead()
+        try:
+            self._queue.put(pending_grant, timeout=GRANT_QUEUE_TIMEOUT_SECONDS)
+        except queue.Full:
+            self.logger.error(LazyString('grant-writer.queue-full', size=self._queue.maxsize))
+            raise GrantQueueFullError
+        try:
+            return pending_grant.future.result(timeout=GRANT_RESULT_TIMEOUT_SECONDS)
+        except TimeoutError:
+            pass
+        if pending_grant.future.cancel():  # the writer thread skips cancelled grants, so it will never be written
+            self.logger.error(LazyString('grant-writer.result-timeout', seconds=GRANT_RESULT_TIMEOUT_SECONDS))
+            raise GrantQueueFullError
+        try:  # its batch is already being written, so it's worth waiting a little longer
+            return pending_grant.future.result(timeout=GRANT_RESULT_TIMEOUT_SECONDS)
+        except TimeoutError:
+            self.logger.error(LazyString('grant-writer.write-timeout', seconds=2 * GRANT_RESULT_TIMEOUT_SECONDS))
+            raise GrantTimeoutError
+
+    def _is_idle(self) -> bool:
+        """Whether a new grant should skip the writer thread: nothing is queued, and no grant has been written lately.
+
+        A grant written just now means a burst may be arriving, and the rest of it should be batched.
+        """
+
+        return (self.idle_seconds is not None
+                and time.monotonic() - self._last_write_at >= self.idle_seconds
+                and self._queue.empty())
+
+    def _restart_if_dead(self) -> None:
+        """Start a new writer thread if the current one died, so queued grants don't wait for a thread that's gone."""
+
+        with self._start_lock:
+            if self._writer_thread is not None and not self._writer_thread.is_alive():
+                self.logger.error(LazyString('grant-writer.restarted'))
+                self.start()
+
+    def _write_forever(self) -> None:
+        """Collect queued grants into batches and write each batch, until `close()` is called."""
+
+        stopping: bool = False
+        while not stopping:
+            batch: list[PendingGrant] = []
+            item = self._queue.get()  # wait as long as it takes for the first grant of a batch
+            deadline: float = time.monotonic() + self.max_delay_seconds
+            while True:
+                if item is self._STOP:
+                    stopping = True
+                    break
+                if item.future.set_running_or_notify_cancel():  # False if its caller gave up waiting
+                    batch.append(item)
+                if len(batch) >= self.max_batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            try:
+                with self._write_lock:
+                    self._write_batch(batch)
+            except Exception as e:  # keep the thread alive for later grants, and never leave a caller waiting
+                self.logger.error(LazyString('grant-writer.batch-failed', size=len(batch), e=e))
+                for pending_grant in batch:
+                    if not pending_grant.future.done():
+                        pending_grant.future.set_exception(e)
+
+    def _write_batch(self, batch: list[PendingGrant]) -> None:
+        """Write a batch of grants in one transaction and resolve each grant's Future.
+
+        Each grant gets its own savepoint, so one failed grant doesn't undo the rest of the batch.
+        The caches are only updated after the commit, so an entity read from the DB meanwhile, which can't see the
+        new karma yet, isn't cached over it. Batches are written one at a time, so caches see grants in commit order.
+        """
+
+        self._last_write_at = time.monotonic()
+        started_at: float = time.perf_counter()
+        for pending_grant in batch:
+            self._queue_wait_histogram.observe(started_at - pending_grant.queued_at)
+        MetricsMgr.increment('grant_batches_total')
+        MetricsMgr.increment('grants_written_total', len(batch))
+        results: list[tuple[PendingGrant, tuple | None, Exception | None]] = []
+        try:
+            with self.db_mgr.transaction() as conn:
+                for pending_grant in batch:
+                    conn.execute('SAVEPOINT grant;')
+                    try:
+                        recipient: tuple = self._write_grant(conn, pending_grant)
+                    except (sqlite3.Error, OptedOutGranterError, OptedOutRecipientError) as e:
+                        conn.execute('ROLLBACK TO grant;')
+                        conn.execute('RELEASE grant;')
+                        results.append((pending_grant, None, e))
+                        continue
+                    conn.execute('RELEASE grant;')
+                    results.append((pending_grant, recipient, None))
+        except Exception as e:  # the transaction failed, so none of the batch was written
+            if self.leaderboard_index is not None:
+                self.leaderboard_index.invalidate()  # in case the commit itself failed partway
+            if self.my_stats_cache is not None:
+                self.my_stats_cache.clear()
+            self.logger.error(LazyString('grant-writer.batch-failed', size=len(batch), e=e))
+            for pending_grant in batch:
+                pending_grant.future.set_exception(e)
+            return
+
+        for pending_grant, recipient, error in results:
+            if error is not None:
+                pending_grant.future.set_exception(error)
+                continue
+            recipient_total_karma, recipient_name, recipient_user_id = recipient
+            try:
+                self.entity_cache.update(pending_grant.recipient_id, karma=recipient_total_karma)
+                if self.leaderboard_index is not None:
+                    self.leaderboard_index.update(recipient_name, recipient_user_id, recipient_total_karma)
+                if self.my_stats_cache is not None:
+                    self.my_stats_cache.invalidate(pending_grant.granter_id, pending_grant.recipient_id)
+            except Exception as e:  # the grant is committed, so its caller still gets its result
+                self.logger.error(LazyString('grant-writer.cache-update-failed', e=e))
+                self.entity_cache.clear()
+                if self.leaderboard_index is not None:
+                    self.leaderboard_index.invalidate()
+                if self.my_stats_cache is not None:
+                    self.my_stats_cache.clear()
+            pending_grant.future.set_result(recipient_total_karma)
+
+    def _write_grant(self, conn: Connection, pending_grant: PendingGrant) -> tuple[int, str, str | None]:
+        """Record one grant and update the recipient's karma, as part of the caller's transaction.
+
+        The caller's transaction holds the write lock, so neither entity can opt out between the check and the grant.
+
+        :returns: The recipient's karma after the grant, name, and Slack user ID (None for non-user entities)
+        :raises OptedOutGranterError: If the granter isn't opted in
+        :raises OptedOutRecipientError: If the recipient isn't opted in
+        :raises sqlite3.Error: If anything goes wrong with the DB
+        """
+
+        granter: tuple[int] | None = conn.execute("""
+                                                  SELECT opted_in
+                                                  FROM entities
+                                                  WHERE entity_id = ?;""",
+                                                  (pending_grant.granter_id,)).fetchone()
+        if granter is None or not granter[0]:
+            raise OptedOutGranterError
+        # update the 'entities' table, which tracks total karma for each entity
+        recipient: tuple[int, str, str | None] | None = conn.execute("""
+                                                                     UPDATE entities
+                                                                     SET karma = karma + ?
+                                                                     WHERE entity_id = ?
+                                                                     AND opted_in
+                                                                     RETURNING karma, name, user_id;""",
+                                                                     (pending_grant.amount,
+                                                                      pending_grant.recipient_id)).fetchone()
+        if recipient is None:
+            raise OptedOutRecipientError
+        # make an entry in the 'grants' table for auditing
+        conn.execute("""
+                     INSERT INTO grants (granter_id, recipient_id, amount)
+                     VALUES (?, ?, ?);""",
+                     (pending_grant.granter_id, pending_grant.recipient_id, pending_grant.amount))
+        return recipient
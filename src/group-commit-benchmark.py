@@ -0,0 +1,137 @@
+import os
+import sys
+
+if os.path.basename(os.getcwd()) != 'src':
+    print("Error: 'group-commit-benchmark' must be run from the '<REPO-ROOT-DIR>/src/' directory")
+    sys.exit(1)
+
+from constants import *
+from db_mgr import DbMgr
+from entity_mgr import EntityMgr
+from grant_writer import GrantWriter
+from karma_mgr import KarmaMgr
+from string_mgr import StringMgr
+
+import argparse
+from argparse import ArgumentParser
+import logging
+from logging import Logger
+from pathlib import Path
+import random
+import tempfile
+from threading import Barrier, Thread
+import time
+
+# how each setup writes grants: (start the grant writer thread?, let `write()` skip it when it's been idle this long)
+SETUPS: dict[str, tuple[bool, float | None]] = {
+    'direct': (False, None),  # each caller commits its own grant, as before grants were batched
+    'queued': (True, None),  # every grant goes through the writer thread
+    'default': (True, GRANT_WRITER_IDLE_SECONDS),  # how the bot runs: the writer thread, unless it's been idle
+}
+
+
+def make_db(db_mgr: DbMgr, num_users: int, num_objects: int) -> None:
+    """Create a test DB with `num_users` users to grant karma and `num_objects` objects to receive it."""
+
+    db_mgr.init_db()
+    db_mgr.migrate_db()
+    with db_mgr.transaction() as conn:
+        conn.executemany('INSERT INTO entities (name, user_id) VALUES (?, ?);',
+                         [(f'@user{i}', f'U{i:08d}') for i in range(num_users)] +
+                         [(f'thing{i}', None) for i in range(num_objects)])
+
+
+def time_bursts(karma_mgr: KarmaMgr,
+                grant_writer: GrantWriter,
+                use_writer_thread: bool,
+                burst_size: int,
+                num_grants: int,
+                num_users: int,
+                num_objects: int) -> float:
+    """Grant karma in bursts of `burst_size` grants that all arrive at once, like a busy channel's `foo++` messages.
+
+    Each of `burst_size` threads makes one grant per burst, and waits for the others before starting the next.
+
+    :returns: Grants per second
+    """
+
+    num_bursts: int = max(1, num_grants // burst_size)
+    barrier: Barrier = Barrier(burst_size)
+
+    def grant() -> None:
+        for _ in range(num_bursts):
+            barrier.wait()
+            karma_mgr.grant_karma(f'@user{random.randrange(num_users)}', f'thing{random.randrange(num_objects)}', 1)
+
+    threads: list[Thread] = [Thread(target=grant) for _ in range(burst_size)]
+    if use_writer_thread:
+        grant_writer.start()
+    start: float = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        grant_writer.close()
+    return num_bursts * burst_size / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """Parse CLI parameters, then time bursts of grants of each size with each way of writing them."""
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description=StringMgr.get_string('group-commit-benchmark.description'),
+        prog=StringMgr.get_string('group-commit-benchmark.prog'))
+    parser.add_argument('--burst-sizes',
+                        default=GROUP_COMMIT_BENCHMARK_BURST_SIZES,
+                        help=StringMgr.get_string('group-commit-benchmark.help.burst-sizes'),
+                        nargs='+',
+                        type=int)
+    parser.add_argument('--grants',
+                        default=GROUP_COMMIT_BENCHMARK_GRANTS,
+                        help=StringMgr.get_string('group-commit-benchmark.help.grants'),
+                        type=int)
+    parser.add_argument('--rounds',
+                        default=GROUP_COMMIT_BENCHMARK_ROUNDS,
+                        help=StringMgr.get_string('group-commit-benchmark.help.rounds'),
+                        type=int)
+    args: argparse.Namespace = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_mgrs: dict[str, DbMgr] = {setup: DbMgr(logger, db_file_name=str(Path(temp_dir) / f'{setup}.db'))
+                                     for setup in SETUPS}
+        karma_mgrs: dict[str, KarmaMgr] = {}
+        grant_writers: dict[str, GrantWriter] = {}
+        for setup, db_mgr in db_mgrs.items():
+            make_db(db_mgr, GROUP_COMMIT_BENCHMARK_USERS, GROUP_COMMIT_BENCHMARK_OBJECTS)
+            entity_mgr: EntityMgr = EntityMgr(db_mgr, logger)
+            grant_writers[setup] = GrantWriter(db_mgr, entity_mgr.entity_cache, logger,
+                                               idle_seconds=SETUPS[setup][1])
+            karma_mgrs[setup] = KarmaMgr(db_mgr, entity_mgr, logger, grant_writers[setup])
+
+        for burst_size in args.burst_sizes:
+            # rounds alternate between setups, so a slow patch on a shared machine doesn't land all on one of them
+            best_grants_per_sec: dict[str, float] = dict.fromkeys(SETUPS, 0.0)
+            for _ in range(args.rounds):
+                for setup, (use_writer_thread, _) in SETUPS.items():
+                    grants_per_sec: float = time_bursts(karma_mgrs[setup], grant_writers[setup], use_writer_thread,
+                                                        burst_size, args.grants, GROUP_COMMIT_BENCHMARK_USERS,
+                                                        GROUP_COMMIT_BENCHMARK_OBJECTS)
+                    best_grants_per_sec[setup] = max(best_grants_per_sec[setup], grants_per_sec)
+            for setup, grants_per_sec in best_grants_per_sec.items():
+                print(StringMgr.get_string('group-commit-benchmark.result',
+                                           burst_size=burst_size,
+                                           setup=setup,
+                                           grants_per_sec=grants_per_sec,
+                                           rounds=args.rounds))
+        for db_mgr in db_mgrs.values():
+            db_mgr.close_all_connections()
+
+
+if __name__ == '__main__':
+    # thousands of grants shouldn't go to the bot's log
+    logger: Logger = logging.getLogger(StringMgr.get_string('group-commit-benchmark.prog'))
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    main()
@@ -0,0 +1,46 @@
+from bisect import bisect_left
+from threading import Lock
+
+
+class Histogram:
+    """Count observations, like latencies in seconds, in cumulative buckets the way Prometheus does."""
+
+    def __init__(self, bucket_bounds: tuple[float, ...]):
+        """:param bucket_bounds: Upper bounds of the buckets, in increasing order. An extra '+Inf' bucket is
+                                 always added."""
+
+        self.bucket_bounds: tuple[float, ...] = bucket_bounds
+        self.count: int = 0
+        self.sum: float = 0.0
+        self.max: float = 0.0
+        self._bucket_counts: list[int] = [0] * (len(bucket_bounds) + 1)  # non-cumulative; last one is '+Inf'
+        self._lock: Lock = Lock()
+
+    def observe(self, value: float) -> None:
+        """Record one observation."""
+
+        with self._lock:
+            self._bucket_counts[bisect_left(self.bucket_bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def snapshot(self) -> dict:
+        """Take a consistent copy of the histogram, so its count, sum, and buckets all agree.
+
+        :returns: {'count', 'sum', 'max', 'buckets'}, where 'buckets' is (upper bound, number of observations <= that
+                  bound) for every bucket, ending with '+Inf'
+        """
+
+        with self._lock:
+            count: int = self.count
+            total: float = self.sum
+            maximum: float = self.max
+            counts: list[int] = list(self._bucket_counts)
+        buckets: list[tuple[float, int]] = []
+        running_total: int = 0
+        for bound, bucket_count in zip(self.bucket_bounds + (float('inf'),), counts):
+            running_total += bucket_count
+            buckets.append((bound, running_total))
+        return {'count': count, 'sum': total, 'max': maximum, 'buckets': buckets}
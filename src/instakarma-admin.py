@@ -8,7 +8,8 @@ if os.path.basename(os.getcwd()) != 'src':
 from constants import *
 from db_mgr import DbMgr
 from entity_mgr import EntityMgr
-from enums import Status
+from enums import ExportFormat, Status
+from grant_exporter import GrantExporter
 from grant_mgr import GrantMgr
 from karma_mgr import KarmaMgr
 from log_mgr import LogMgr
@@ -17,24 +18,219 @@ from string_mgr import StringMgr
 
 import argparse
 from argparse import ArgumentParser
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+import gzip
+import io
+import json
 from logging import Logger
+from pathlib import Path
 import sqlite3
 import sys
+from typing import BinaryIO, TextIO
+import urllib.request
 
 
 def init_db() -> None:
-    """Initialize the DB.
+    """Initialize the DB, then apply any migrations it doesn't have yet, like the bot does at startup.
 
-    No-op if the DB already exists.
+    Every command can then rely on the tables and indexes that migrations add. Prints each migration it applies.
 
     :raises SystemExit: If there are DB errors
     """
 
-    result: str = ''
     try:
         db_manager.init_db()
+        applied: list[str] = db_manager.migrate_db()
     except sqlite3.Error as e:
         raise SystemExit(StringMgr.get_string('error.sqlite3', e=e))
+    for migration in applied:
+        print(StringMgr.get_string('instakarma-admin.migrate.applied', migration=migration))
+
+
+def backup_db(backup_dir: str, keep: int, pages_per_step: int, step_sleep_seconds: float) -> None:
+    """Back up the DB while the bot keeps running, showing how far the copy has got.
+
+    :raises SystemExit: If the backup fails
+    """
+
+    last_percent: int | None = None
+
+    def show_progress(copied: int, total: int) -> None:
+        nonlocal last_percent
+        percent: int = copied * 100 // total if total else 100
+        if percent != last_percent:
+            last_percent = percent
+            print(StringMgr.get_string('instakarma-admin.backup-db.progress', copied=copied, total=total,
+                                       percent=percent),
+                  end='',
+                  flush=True)
+
+    try:
+        backup_path: Path = db_manager.backup_db(backup_dir, keep, pages_per_step, step_sleep_seconds, show_progress)
+    except (OSError, sqlite3.Error) as e:
+        if last_percent is not None:
+            print()  # end the progress line
+        sys.exit(StringMgr.get_string('instakarma-admin.backup-db.failed', e=e))
+    print()
+    print(StringMgr.get_string('instakarma-admin.backup-db.backed-up', backup_path=backup_path.resolve()))
+
+
+def dump_metrics(as_json: bool, port: int) -> None:
+    """Print a snapshot of the running bot's metrics, fetched from its metrics endpoint.
+
+    :param as_json: Print the snapshot exactly as the bot sent it, instead of one summary line per metric
+    :raises SystemExit: If the bot can't be reached
+    """
+
+    url: str = f'http://{METRICS_HOST}:{port}/metrics.json'
+    try:
+        with urllib.request.urlopen(url, timeout=METRICS_FETCH_TIMEOUT_SECONDS) as response:
+            body: bytes = response.read()
+    except OSError as e:
+        sys.exit(StringMgr.get_string('instakarma-admin.dump-metrics.failed', url=url, e=e))
+    if as_json:
+        print(body.decode())
+        return
+
+    snapshot: dict = json.loads(body)
+    if not snapshot['histograms'] and not snapshot['counters']:
+        print(StringMgr.get_string('instakarma-admin.dump-metrics.no-metrics'))
+        return
+
+    def metric_name(metric: dict) -> str:
+        labels: str = ','.join(f'{label}={value}' for label, value in metric['labels'].items())
+        return f"{metric['name']}{{{labels}}}" if labels else metric['name']
+
+    counters: dict[str, int] = {metric_name(counter): counter['value'] for counter in snapshot['counters']}
+    for histogram in snapshot['histograms']:
+        # like 'db_query_errors_total{query=EntityMgr.get_karma}' for 'db_query_seconds{query=EntityMgr.get_karma}'
+        errors_name: str = metric_name({'name': f"{histogram['name'].removesuffix('_seconds')}_errors_total",
+                                        'labels': histogram['labels']})
+        print(StringMgr.get_string('instakarma-admin.dump-metrics.histogram',
+                                   metric=metric_name(histogram),
+                                   count=histogram['count'],
+                                   mean_ms=histogram['sum'] / histogram['count'] * 1e3 if histogram['count'] else 0.0,
+                                   max_ms=histogram['max'] * 1e3,
+                                   errors=counters.pop(errors_name, 0)))
+    for name, value in counters.items():
+        print(StringMgr.get_string('instakarma-admin.dump-metrics.counter', metric=name, value=value))
+
+
+@contextmanager
+def open_text_output(binary_output: BinaryIO, compress: bool) -> Iterator[TextIO]:
+    """Wrap a binary stream for writing UTF-8 text, gzipped if `compress` is set.
+
+    `binary_output` is left open afterward, so this works for stdout too.
+    """
+
+    compressor: gzip.GzipFile | None = (gzip.GzipFile(fileobj=binary_output,
+                                                      mode='wb',
+                                                      compresslevel=GRANTS_EXPORT_GZIP_LEVEL)
+                                        if compress else None)
+    text_output: io.TextIOWrapper = io.TextIOWrapper(compressor or binary_output, encoding='utf-8', newline='')
+    try:
+        yield text_output
+    finally:
+        text_output.flush()
+        text_output.detach()  # closing the wrapper would close `binary_output` too
+        if compressor is not None:
+            compressor.close()  # writes the gzip trailer
+
+
+def export_grants(output: str | None, export_format: ExportFormat, compress: bool, watermark: str | None) -> None:
+    """Export grants to a file, or to stdout if `output` is '-'.
+
+    A file is written under a temporary name and renamed when it's complete, so an older export is replaced all at
+    once and a failed export never leaves a partial file behind. When writing to stdout, messages go to stderr so
+    they don't mix with the exported grants.
+
+    :param output: File to write, or None for 'grants.csv' or 'grants.ndjson' (plus '.gz' if `compress` is set)
+    :param watermark: If set, only export grants newer than this watermark, then advance it past them
+    :raises SystemExit: If there are DB errors or the file can't be written
+    """
+
+    to_stdout: bool = output == '-'
+    export_path: Path = Path(output or f'{GRANTS_EXPORT_FILE_STEM}.{export_format.value}{".gz" if compress else ""}')
+    temp_path: Path = export_path.with_name(f'{export_path.name}.{os.getpid()}.tmp')
+    try:
+        after_grant_id: int | None = grant_exporter.get_watermark(watermark) if watermark is not None else None
+        with nullcontext(sys.stdout.buffer) if to_stdout else open(temp_path, 'wb') as binary_output:
+            with open_text_output(binary_output, compress) as text_output:
+                num_grants, last_grant_id = grant_exporter.export(text_output, export_format, after_grant_id)
+        if not to_stdout:
+            temp_path.replace(export_path)
+        if watermark is not None and last_grant_id is not None:
+            grant_exporter.set_watermark(watermark, last_grant_id)  # only once the grants are safely written
+    except BrokenPipeError:  # whatever stdout was piped to, like `head`, stopped reading
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())  # so exiting doesn't flush to the pipe again
+        sys.exit(1)
+    except (OSError, sqlite3.Error) as e:
+        if not to_stdout:
+            temp_path.unlink(missing_ok=True)
+        sys.exit(StringMgr.get_string('instakarma-admin.export-grants.failed',
+                                      export_path='stdout' if to_stdout else export_path.resolve(),
+                                      e=e))
+    if watermark is None:
+        message: str = StringMgr.get_string('instakarma-admin.export-grants.exported',
+                                            num_grants=num_grants,
+                                            export_path='stdout' if to_stdout else export_path.resolve())
+    else:
+        message: str = StringMgr.get_string('instakarma-admin.export-grants.exported-incremental',
+                                            num_grants=num_grants,
+                                            export_path='stdout' if to_stdout else export_path.resolve(),
+                                            watermark=watermark,
+                                            last_grant_id=last_grant_id or after_grant_id)
+    print(message, file=sys.stderr if to_stdout else sys.stdout)
+
+
+def follow_grants(output: str | None, export_format: ExportFormat, watermark: str) -> None:
+    """Export grants newer than `watermark`, then keep exporting new grants as they're committed, until Ctrl-C.
+
+    Grants go to stdout, or are appended to a file if `output` names one. A CSV file only gets a header row if
+    it's empty, so following again later continues the same file.
+
+    :raises SystemExit: If there are DB errors or the file can't be written
+    """
+
+    to_stdout: bool = output in (None, '-')
+    message_file: TextIO = sys.stderr if to_stdout else sys.stdout
+
+    def report_export(num_grants: int, last_grant_id: int) -> None:
+        print(StringMgr.get_string('instakarma-admin.export-grants.followed',
+                                   num_grants=num_grants,
+                                   watermark=watermark,
+                                   last_grant_id=last_grant_id),
+              file=message_file,
+              flush=True)
+
+    try:
+        with nullcontext(sys.stdout.buffer) if to_stdout else open(output, 'ab') as binary_output:
+            with open_text_output(binary_output, compress=False) as text_output:
+                print(StringMgr.get_string('instakarma-admin.export-grants.following',
+                                           export_path='stdout' if to_stdout else Path(output).resolve(),
+                                           watermark=watermark,
+                                           last_grant_id=grant_exporter.get_watermark(watermark)),
+                      file=message_file,
+                      flush=True)
+                grant_exporter.follow(text_output,
+                                      export_format,
+                                      watermark,
+                                      GRANTS_EXPORT_FOLLOW_POLL_SECONDS,
+                                      write_header=to_stdout or binary_output.tell() == 0,
+                                      on_export=report_export)
+    except KeyboardInterrupt:
+        print(StringMgr.get_string('instakarma-admin.export-grants.stopped-following',
+                                   watermark=watermark,
+                                   last_grant_id=grant_exporter.get_watermark(watermark)),
+              file=message_file)
+    except BrokenPipeError:  # whatever stdout was piped to stopped reading
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())  # so exiting doesn't flush to the pipe again
+        sys.exit(1)
+    except (OSError, sqlite3.Error) as e:
+        sys.exit(StringMgr.get_string('instakarma-admin.export-grants.failed',
+                                      export_path='stdout' if to_stdout else Path(output).resolve(),
+                                      e=e))
 
 
 def set_status(name: str, new_status: Status) -> None:
@@ -74,11 +270,60 @@ def main() -> None:
                                    help=StringMgr.get_string('instakarma-admin.help.add-entity.name-var'),
                                    metavar='NAME')
 
-    subparsers.add_parser('backup-db', help=StringMgr.get_string('instakarma-admin.help.backup-db'))
-    subparsers.add_parser('export-grants', help=StringMgr.get_string('instakarma-admin.help.export-grants'))
+    backup_db_parser = subparsers.add_parser(
+        'backup-db', help=StringMgr.get_string('instakarma-admin.help.backup-db.command'))
+    backup_db_parser.add_argument('--dir',
+                                  default=DB_BACKUP_DIR,
+                                  help=StringMgr.get_string('instakarma-admin.help.backup-db.dir'))
+    backup_db_parser.add_argument('--keep',
+                                  default=DB_BACKUP_KEEP,
+                                  help=StringMgr.get_string('instakarma-admin.help.backup-db.keep'),
+                                  type=int)
+    backup_db_parser.add_argument('--pages',
+                                  default=DB_BACKUP_PAGES_PER_STEP,
+                                  help=StringMgr.get_string('instakarma-admin.help.backup-db.pages'),
+                                  type=int)
+    backup_db_parser.add_argument('--sleep',
+                                  default=DB_BACKUP_STEP_SLEEP_SECONDS,
+                                  help=StringMgr.get_string('instakarma-admin.help.backup-db.sleep'),
+                                  type=float)
+
+    dump_metrics_parser = subparsers.add_parser(
+        'dump-metrics', help=StringMgr.get_string('instakarma-admin.help.dump-metrics.command'))
+    dump_metrics_parser.add_argument('--json',
+                                     action='store_true',
+                                     help=StringMgr.get_string('instakarma-admin.help.dump-metrics.json'))
+    dump_metrics_parser.add_argument('--port',
+                                     default=METRICS_PORT,
+                                     help=StringMgr.get_string('instakarma-admin.help.dump-metrics.port'),
+                                     type=int)
+
+    export_grants_parser = subparsers.add_parser(
+        'export-grants', help=StringMgr.get_string('instakarma-admin.help.export-grants.command'))
+    export_grants_parser.add_argument('--format',
+                                      choices=[export_format.value for export_format in ExportFormat],
+                                      default=ExportFormat.CSV.value,
+                                      help=StringMgr.get_string('instakarma-admin.help.export-grants.format'))
+    export_grants_parser.add_argument('--follow',
+                                      action='store_true',
+                                      help=StringMgr.get_string('instakarma-admin.help.export-grants.follow'))
+    export_grants_parser.add_argument('--gzip',
+                                      action='store_true',
+                                      help=StringMgr.get_string('instakarma-admin.help.export-grants.gzip'))
+    export_grants_parser.add_argument('--incremental',
+                                      action='store_true',
+                                      help=StringMgr.get_string('instakarma-admin.help.export-grants.incremental'))
+    export_grants_parser.add_argument('--output',
+                                      help=StringMgr.get_string('instakarma-admin.help.export-grants.output'),
+                                      metavar='FILE')
+    export_grants_parser.add_argument('--watermark',
+                                      help=StringMgr.get_string('instakarma-admin.help.export-grants.watermark'),
+                                      metavar='NAME')
+
     subparsers.add_parser('list-by-karma', help=StringMgr.get_string('instakarma-admin.help.list-by-karma'))
     subparsers.add_parser('list-by-name', help=StringMgr.get_string('instakarma-admin.help.list-by-name'))
     subparsers.add_parser('list-opted-out', help=StringMgr.get_string('instakarma-admin.help.list-opted-out'))
+    subparsers.add_parser('migrate', help=StringMgr.get_string('instakarma-admin.help.migrate'))
 
     opt_in_parser = subparsers.add_parser('opt-in',
                                           help=StringMgr.get_string('instakarma-admin.help.opt-in.command'))
@@ -92,6 +337,9 @@ def main() -> None:
                                 help=StringMgr.get_string('instakarma-admin.help.opt-out.name-var'),
                                 metavar='NAME')
 
+    subparsers.add_parser('rebuild-pair-totals',
+                          help=StringMgr.get_string('instakarma-admin.help.rebuild-pair-totals'))
+
     args: argparse.Namespace = parser.parse_args()
 
     # print help if no command is provided
@@ -111,10 +359,21 @@ def main() -> None:
             print(StringMgr.get_string('instakarma-admin.add-entity.successful', name=name))
 
         case 'backup-db':
-            db_manager.backup_db()
+            backup_db(args.dir, args.keep, args.pages, args.sleep)
+
+        case 'dump-metrics':
+            dump_metrics(args.json, args.port)
 
         case 'export-grants':
-            grant_manager.export_grants()
+            # naming a watermark or following implies an incremental export
+            watermark: str | None = (args.watermark or GRANTS_EXPORT_WATERMARK
+                                     if args.incremental or args.follow or args.watermark else None)
+            if args.follow:
+                if args.gzip:
+                    export_grants_parser.error(StringMgr.get_string('instakarma-admin.export-grants.follow-gzip'))
+                follow_grants(args.output, ExportFormat(args.format), watermark)
+            else:
+                export_grants(args.output, ExportFormat(args.format), args.gzip, watermark)
 
         case 'list-by-karma':
             try:
@@ -142,12 +401,30 @@ def main() -> None:
             for name in entities:
                 print(name)
 
+        case 'migrate':
+            try:
+                applied: list[str] = db_manager.migrate_db()
+                if not applied:
+                    print(StringMgr.get_string('instakarma-admin.migrate.up-to-date',
+                                               version=db_manager.get_schema_version()))
+            except sqlite3.Error as e:
+                sys.exit(StringMgr.get_string('error.sqlite3', e=e))
+            for migration in applied:
+                print(StringMgr.get_string('instakarma-admin.migrate.applied', migration=migration))
+
         case 'opt-in':
             set_status(args.name, Status.OPTED_IN)
 
         case 'opt-out':
             set_status(args.name, Status.OPTED_OUT)
 
+        case 'rebuild-pair-totals':
+            try:
+                num_pairs: int = karma_manager.rebuild_grant_pair_totals()
+            except sqlite3.Error as e:
+                sys.exit(StringMgr.get_string('error.sqlite3', e=e))
+            print(StringMgr.get_string('instakarma-admin.rebuild-pair-totals.rebuilt', num_pairs=num_pairs))
+
 
 if __name__ == '__main__':
     logger: Logger = LogMgr.get_logger(LOGGER_NAME,
@@ -160,6 +437,7 @@ if __name__ == '__main__':
     karma_manager: KarmaMgr = KarmaMgr(db_manager, entity_manager, logger)
     message_parser: MessageParser = MessageParser(logger)
     grant_manager: GrantMgr = GrantMgr(entity_manager, karma_manager, logger, message_parser, db_manager)
+    grant_exporter: GrantExporter = GrantExporter(db_manager, logger)
 
-    init_db()  # error handling is easier there's a DB guaranteed to be present
+    init_db()  # error handling is easier when there's a fully migrated DB guaranteed to be present
     main()
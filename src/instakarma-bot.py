@@ -11,17 +11,28 @@ from db_mgr import DbMgr
 from enums import *
 from entity_mgr import EntityMgr
 from grant_mgr import GrantMgr
+from grant_writer import GrantWriter
 from karma_mgr import KarmaMgr
+from lazy_string import LazyString
+from leaderboard_index import LeaderboardIndex
 from log_mgr import LogMgr
+from memory_monitor import MemoryMonitor
 from message_parser import MessageParser
+from metrics_mgr import MetricsMgr
+from metrics_server import MetricsServer
+from my_stats_cache import MyStatsCache
 from slack_api_mgr import SlackApiMgr
-from string_mgr import StringMgr
+from stack_profiler import StackProfiler
+from timed_web_client import TimedWebClient
 from utils import ignore_channel
 from utils import ignored_channel_id_to_name
 
+from concurrent.futures import ThreadPoolExecutor
 from logging import Logger
+import signal
+import sys
 import traceback
-from threading import Lock
+import time
 
 import boto3
 from slack_bolt import App
@@ -45,10 +56,11 @@ def get_secret(secret_id: str) -> str:
 
 SLACK_BOT_TOKEN: Final[str] = (os.getenv('SLACK_BOT_TOKEN') or
                                get_secret(SLACK_BOT_TOKEN_SECRET_ID))
-app: App = App(token=SLACK_BOT_TOKEN)
+ASYNC_MODE: Final[bool] = '--async' in sys.argv[1:]  # run on asyncio instead of a thread per event
+MEMORY_DIAGNOSTICS: Final[bool] = '--memory-diagnostics' in sys.argv[1:]  # trace allocations for memory reports
 
 
-@app.message(r'(\+\+|--)')
+@MetricsMgr.timer('listener_seconds', listener='handle_karma_grants')
 def handle_karma_grants(message: dict, say, client) -> None:
     """Look for "++" or "--" in any message in any channel the bot is a member of.
 
@@ -62,93 +74,131 @@ def handle_karma_grants(message: dict, say, client) -> None:
     :param client: used to send ephemeral messages (displayed to sender only)
     """
 
-    with bot_lock:  # don't process other messages until this one is done
-        channel_id: str = message['channel']
-        granter_user_id: str = message['user']
-        msg_text: str = message['text']
-        thread_timestamp: str | None = message.get('thread_ts', None) # set if grant occurred in a thread
+    channel_id: str = message['channel']
+    granter_user_id: str = message['user']
+    msg_text: str = message['text']
+    thread_timestamp: str | None = message.get('thread_ts', None) # set if grant occurred in a thread
 
-        if ignore_channel(channel_id):
-            logger.info("Ignored message in channel "
-                        f"{ignored_channel_id_to_name(channel_id)!r}")
+    if ignore_channel(channel_id):
+        logger.info("Ignored message in channel "
+                    f"{ignored_channel_id_to_name(channel_id)!r}")
 
-            client.chat_postEphemeral(channel=channel_id,
-                                      user=message['user'],
-                                      text="❌ instakarma is disabled in this channel",
-                                      thread_ts=thread_timestamp)
-            return
+        client.chat_postEphemeral(channel=channel_id,
+                                  user=message['user'],
+                                  text="❌ instakarma is disabled in this channel",
+                                  thread_ts=thread_timestamp)
+        return
 
-        valid_user_recipients: list[tuple[str, Action]] = message_parser.detect_valid_user_recipients(msg_text)
-        invalid_user_recipients: list[tuple[str, Action]] = message_parser.detect_invalid_user_recipients(msg_text)
-        object_recipients: list[tuple[str, Action]] = message_parser.detect_object_recipients(msg_text)
+    # no lock needed: `grant_writer` is the single writer path for grants, and batches grants from many messages
+    grant_mgr.handle_grants(say, granter_user_id, msg_text, thread_timestamp)
 
-        for recipient in valid_user_recipients:
-            grant_mgr.grant_to_valid_user(say, granter_user_id, recipient, thread_timestamp)
-        for recipient in invalid_user_recipients:
-            grant_mgr.grant_to_invalid_user(say, granter_user_id, recipient, thread_timestamp)
-        for recipient in object_recipients:
-            grant_mgr.grant_to_object(say, granter_user_id, recipient, thread_timestamp)
 
-
-@app.command('/instakarma')
+@MetricsMgr.timer('listener_seconds', listener='handle_instakarma_command')
 def handle_instakarma_command(ack, respond, command) -> None:
-    """Parse the `/instakarma` slash command and call the appropriate handler for the specified subcommand.
+    """Acknowledge the `/instakarma` slash command, then handle it on a background thread.
+
+    Slack shows the user "dispatch_failed" if a command isn't acknowledged within 3 seconds, so acknowledge
+    before doing anything that might be slow, like DB queries or Slack API calls.
+    No lock needed: each worker thread has its own DB connection, and WAL mode lets reads run alongside grants.
 
     :param ack: Slack requires us to call this callback to acknowledge receipt of the slash command
     :param respond: Any text passed to this callback function will be displayed to the user in Slack
     :param command: If the user typed `/instakarma foo` this is `foo`
     """
 
-    with bot_lock:  # block other slash commands from processing until this one is done
-        ack()  # required by Slack SDK
-        thread_timestamp: str | None = command.get('thread_ts', None)  # set if command occurred in a thread, None otherwise
-
-        subcommand = command['text'].lower()
-        match subcommand:
-            case 'help' | '':
-                action_mgr.help(respond)
-            case 'leaderboard':
-                action_mgr.leaderboard(respond)
-            case 'my-stats':
-                action_mgr.my_stats(command, respond, entity_mgr, karma_mgr)
-            case 'opt-in':
-                action_mgr.set_status(command, respond, Status.OPTED_IN, entity_mgr)
-            case 'opt-out':
-                action_mgr.set_status(command, respond, Status.OPTED_OUT, entity_mgr)
-            case _:
-                respond(StringMgr.get_string('error.invalid-slash-subcommand', subcommand=subcommand))
-                action_mgr.help(respond)
-
-
-@app.event("message")
+    received_at: float = time.perf_counter()
+    ack()  # required by Slack SDK
+    ack_seconds: float = time.perf_counter() - received_at
+    MetricsMgr.observe('slash_command_ack_seconds', ack_seconds)
+    if ack_seconds > SLASH_COMMAND_ACK_WARNING_SECONDS:
+        logger.warning(LazyString('slash-command.slow-ack',
+                                  seconds=ack_seconds,
+                                  subcommand=command['text']))
+    slash_command_executor.submit(action_mgr.handle_subcommand, command, respond, entity_mgr, karma_mgr)
+
+
+@MetricsMgr.timer('listener_seconds', listener='handle_message_events')
 def handle_message_events(body, logger):
     """Accept all messages but do nothing.
 
     This suppresses the console output that normally appears after every message.
     """
-    with bot_lock:  # block other slash commands from processing until this one is done
-        pass
+    pass
+
+
+def use_timed_client(context, next) -> None:
+    """Global middleware that swaps the `WebClient` Slack Bolt made for this request for a `TimedWebClient`.
+
+    Bolt makes a new plain client for each request, and `say()` and the listeners' `client` use it, so without
+    this their Slack API calls wouldn't be timed.
+    """
+
+    context['client'] = TimedWebClient.from_client(context.client)
+    context.pop('say', None)  # Bolt already made `say()` with the plain client; it's remade from the new one
+    next()
+
+
+def run_bot(slack_app_token: str) -> None:
+    """Register the listeners on a Slack Bolt app and listen for Slack events until the process is stopped."""
+
+    app: App = App(client=slack_web_client)
+    app.use(use_timed_client)
+    app.message(r'(\+\+|--)')(handle_karma_grants)
+    app.command('/instakarma')(handle_instakarma_command)
+    app.event('message')(handle_message_events)
+    SocketModeHandler(app=app, app_token=slack_app_token).start()
+
 
 if __name__ == "__main__":
     # TODO: remove unnecessary layers of error handling;
     #  Handle at error location and also at user-facing level
     SLACK_APP_TOKEN: Final[str] = (os.getenv('SLACK_APP_TOKEN') or
                                    get_secret(SLACK_APP_TOKEN_SECRET_ID))
-    slack_message_handler: SocketModeHandler = SocketModeHandler(app=app,
-                                                                 app_token=SLACK_APP_TOKEN)
     logger: Logger = LogMgr.get_logger(LOGGER_NAME,
                                        LOG_FILE,
                                        LOG_LEVEL,
                                        LOG_FILE_SIZE,
                                        LOG_FILE_COUNT)
+    slack_web_client: TimedWebClient = TimedWebClient(token=SLACK_BOT_TOKEN)
     db_mgr: DbMgr = DbMgr(logger)
-    slack_api_mgr: SlackApiMgr = SlackApiMgr(app, logger)
-    action_mgr: ActionMgr = ActionMgr(db_mgr, logger)
+    slack_api_mgr: SlackApiMgr = SlackApiMgr(slack_web_client, logger)
+    leaderboard_index: LeaderboardIndex = LeaderboardIndex(db_mgr, logger)
+    profiler: StackProfiler = StackProfiler(logger)
+    action_mgr: ActionMgr = ActionMgr(db_mgr, logger, leaderboard_index, profiler)
     entity_mgr: EntityMgr = EntityMgr(db_mgr, logger, slack_api_mgr)
-    karma_mgr: KarmaMgr = KarmaMgr(db_mgr, entity_mgr, logger)
+    my_stats_cache: MyStatsCache = MyStatsCache()
+    grant_writer: GrantWriter = GrantWriter(db_mgr, entity_mgr.entity_cache, logger, leaderboard_index, my_stats_cache)
+    karma_mgr: KarmaMgr = KarmaMgr(db_mgr, entity_mgr, logger, grant_writer, my_stats_cache)
     message_parser: MessageParser = MessageParser(logger)
     grant_mgr: GrantMgr = GrantMgr(entity_mgr, karma_mgr, logger, message_parser, db_mgr)
 
     db_mgr.init_db()
-    bot_lock: Lock = Lock()  # bot isn't thread-safe, so prevent concurrent operations
-    slack_message_handler.start()  # launch the Slack listener
+    db_mgr.migrate_db()  # the bot relies on indexes and tables added by migrations
+    slack_api_mgr.start_user_directory_refresh()
+    if DB_BACKUP_INTERVAL_SECONDS:
+        db_mgr.start_backup_schedule()
+    grant_writer.start()
+    memory_monitor: MemoryMonitor = MemoryMonitor(logger)
+    memory_monitor.start(trace=MEMORY_DIAGNOSTICS)
+    if hasattr(signal, 'SIGUSR1'):  # `kill -USR1 <PID>` starts profiling, and sending it again stops early
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.toggle(PROFILE_DEFAULT_SECONDS))
+    metrics_server: MetricsServer = MetricsServer(logger)
+    if METRICS_PORT:
+        metrics_server.start()
+    slash_command_executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=SLASH_COMMAND_WORKERS,
+                                                                    thread_name_prefix='slash-command')
+    try:
+        if ASYNC_MODE:
+            from async_bot import AsyncBot  # only import asyncio dependencies like aiohttp when they're needed
+            AsyncBot(SLACK_BOT_TOKEN, action_mgr, entity_mgr, grant_mgr, karma_mgr, logger).run(SLACK_APP_TOKEN)
+        else:
+            run_bot(SLACK_APP_TOKEN)  # launch the Slack listener
+    finally:
+        profiler.stop()  # write the results of any profiling in progress
+        memory_monitor.stop()  # write a last memory report, if tracing
+        metrics_server.stop()
+        slash_command_executor.shutdown()
+        grant_writer.close()  # write any grants that are still queued
+        slack_api_mgr.stop_user_directory_refresh()
+        db_mgr.stop_backup_schedule()
+        db_mgr.close_all_connections()
@@ -0,0 +1,28 @@
+from lazy_string import LazyString
+
+from datetime import datetime
+import json
+from logging import Formatter, LogRecord
+from typing import Any
+
+
+class JsonLogFormatter(Formatter):
+    """Format each log record as one JSON object per line, for log pipelines that parse structured logs.
+
+    A record whose message is a `LazyString` also gets the string's key as 'event' and its keyword arguments as
+    'fields', so records can be filtered by what happened rather than by matching message text.
+    """
+
+    def format(self, record: LogRecord) -> str:
+        entry: dict[str, Any] = {
+            'time': datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if isinstance(record.msg, LazyString):
+            entry['event'] = record.msg.key_path
+            entry['fields'] = record.msg.kwargs
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)  # `default=str` for fields like exceptions
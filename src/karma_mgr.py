@@ -1,11 +1,17 @@
 from constants import NUM_TOP_GRANTERS, NUM_TOP_RECIPIENTS
 from db_mgr import DbMgr
+from entity import Entity
 from entity_mgr import EntityMgr
-from enums import Action, Status
+from enums import Action
 from exceptions import OptedOutGranterError, OptedOutRecipientError
+from grant_writer import GrantWriter
+from lazy_string import LazyString
+from my_stats import MyStats
+from my_stats_cache import MyStatsCache
 from string_mgr import StringMgr
 
 from logging import Logger
+from sqlite3 import Cursor
 import sqlite3
 
 
@@ -15,10 +21,20 @@ class KarmaMgr:
     def __init__(self,
                  db_mgr: DbMgr,
                  entity_mgr: EntityMgr,
-                 logger: Logger):
+                 logger: Logger,
+                 grant_writer: GrantWriter | None = None,
+                 my_stats_cache: MyStatsCache | None = None):
+        """:param my_stats_cache: Should be the same cache `grant_writer` invalidates, so stats never go stale"""
+
         self.db_mgr = db_mgr
         self.entity_mgr = entity_mgr
         self.logger = logger
+        self.my_stats_cache = my_stats_cache or MyStatsCache()
+        self.grant_writer = grant_writer or GrantWriter(db_mgr,
+                                                        entity_mgr.entity_cache,
+                                                        logger,
+                                                        my_stats_cache=self.my_stats_cache)
+        self.db_mgr.add_change_listener(self.my_stats_cache.clear)
 
     def get_karma(self, name: str) -> int:
         """Get the current karma for any entity, whether person or object.
@@ -29,25 +45,93 @@ class KarmaMgr:
         """
 
         try:
+            entity: Entity | None = self.entity_mgr.get_entity(name)
+        except sqlite3.Error as e:
+            self.logger.error(LazyString('karma.get-karma.sql-error', name=name, e=e))
+            raise
+        if entity is None or not entity.opted_in:
+            msg: str = StringMgr.get_string('karma.get-karma.opted-out', name=name)
+            self.logger.info(msg)
+            raise ValueError(msg)
+        return entity.karma
+
+    def get_my_stats(self, entity: Entity) -> MyStats:
+        """Get an entity's karma, top recipients, and top granters, from the cache if possible.
+
+        On a cache miss, everything is read with one query, so the numbers all come from the same moment. The cache
+        is cleared first if another process, like `instakarma-admin rebuild-pair-totals`, changed the totals.
+
+        :returns: The entity's stats
+        :raises sqlite3.Error: If anything goes wrong with the DB
+        """
+
+        self.db_mgr.check_for_changes()
+        stats: MyStats | None = self.my_stats_cache.get(entity.entity_id)
+        if stats is not None:
+            return stats
+
+        generation: int = self.my_stats_cache.get_generation()
+        try:
+            # each ranking is its own subquery, since LIMIT applies to a whole compound SELECT otherwise;
+            # section 0 is the entity's karma, 1 and 2 its top +1 and -1 recipients, and 3 its top granters
             results: list = self.db_mgr.execute_statement("""
-                                                          SELECT karma
-                                                          FROM entities
-                                                          WHERE name = ? AND opted_in = TRUE;""",
-                                                          (name,))
-            result = results[0]
-            if result:
-                return result[0]
-            else:
-                msg: str = f"{name!r} is opted-out or doesn't exist in 'entities' table"
-                self.logger.info(msg)
-                raise ValueError(msg)
+                                SELECT 0 AS section, NULL AS name, karma AS amount
+                                FROM entities
+                                WHERE entity_id = ?
+                                UNION ALL
+                                SELECT 1, name, amount
+                                FROM (SELECT recipient.name AS name, p.plus_count AS amount
+                                      FROM grant_pair_totals p
+                                      JOIN entities recipient ON p.recipient_id = recipient.entity_id
+                                      WHERE p.granter_id = ? AND p.plus_count > 0
+                                      ORDER BY amount DESC, name
+                                      LIMIT ?)
+                                UNION ALL
+                                SELECT 2, name, amount
+                                FROM (SELECT recipient.name AS name, p.minus_count AS amount
+                                      FROM grant_pair_totals p
+                                      JOIN entities recipient ON p.recipient_id = recipient.entity_id
+                                      WHERE p.granter_id = ? AND p.minus_count > 0
+                                      ORDER BY amount DESC, name
+                                      LIMIT ?)
+                                UNION ALL
+                                SELECT 3, name, amount
+                                FROM (SELECT granter.name AS name, p.plus_count + p.minus_count AS amount
+                                      FROM grant_pair_totals p
+                                      JOIN entities granter ON p.granter_id = granter.entity_id
+                                      WHERE p.recipient_id = ?
+                                      ORDER BY amount DESC, name
+                                      LIMIT ?)
+                                ORDER BY section, amount DESC, name;""",
+                                                          (entity.entity_id,
+                                                           entity.entity_id, NUM_TOP_RECIPIENTS,
+                                                           entity.entity_id, NUM_TOP_RECIPIENTS,
+                                                           entity.entity_id, NUM_TOP_GRANTERS))
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('karma.get-karma.sql-error', name=name, e=e))
+            self.logger.error(LazyString('karma.get-my-stats.sql-error', name=entity.name, e=e))
             raise
 
+        karma: int = entity.karma
+        sections: tuple[list, list, list] = ([], [], [])
+        for section, name, amount in results:
+            if section == 0:
+                karma = amount
+            else:
+                sections[section - 1].append((name, int(amount)))
+        top_positive_recipients, top_negative_recipients, top_granters = sections
+        stats = MyStats(karma=karma,
+                        top_positive_recipients=top_positive_recipients,
+                        top_negative_recipients=[(name, -amount) for name, amount in top_negative_recipients],
+                        top_granters=top_granters)
+        self.my_stats_cache.put(entity.entity_id, stats, generation)
+        return stats
+
     def get_top_granters(self, recipient_name: str) -> list[tuple[str, int]]:
         """Get the names and amount of karma granted to a specific person by their most generous granters.
 
+        Reads the 'grant_pair_totals' table, so the cost depends on how many people have granted to the recipient,
+        not on how many grants they've made.
+
         :returns: List of tuples, where each tuple contains the name of the granter
                   and the amount of karma they've granted to the recipient
         :raises sqlite3.Error: If anything goes wrong with the DB
@@ -56,100 +140,145 @@ class KarmaMgr:
         try:
             results: list = self.db_mgr.execute_statement(f"""
                                                SELECT e_granter.name as top_granter_name,
-                                                      COUNT(*) as times_granted
-                                               FROM grants g
-                                               JOIN entities e_granter ON g.granter_id = e_granter.entity_id
-                                               JOIN entities e_recipient ON g.recipient_id = e_recipient.entity_id
+                                                      p.plus_count + p.minus_count as times_granted
+                                               FROM grant_pair_totals p
+                                               JOIN entities e_granter ON p.granter_id = e_granter.entity_id
+                                               JOIN entities e_recipient ON p.recipient_id = e_recipient.entity_id
                                                WHERE e_recipient.name = ?
-                                               GROUP BY g.granter_id
                                                ORDER BY times_granted DESC, top_granter_name
                                                LIMIT {NUM_TOP_GRANTERS};""",
                                                           (recipient_name,))
 
             return [(name, int(num_grants)) for name, num_grants in results]
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('karma.get-top-granters.sql-error',
-                                                   name=recipient_name,
-                                                   e=e))
+            self.logger.error(LazyString('karma.get-top-granters.sql-error',
+                                         name=recipient_name,
+                                         e=e))
             raise
 
     def get_top_recipients(self, granter_name: str, action: Action) -> list[tuple[str, int]]:
         """Get the names and amount of karma that the granter has been most generous to.
 
+        Reads the 'grant_pair_totals' table, so the cost depends on how many recipients the granter has had,
+        not on how many grants they've made.
+
         :returns: List of tuples, where each tuple contains the name of the recipient
                   and the amount of karma they've received from the recipient
         :raises sqlite3.Error: If anything goes wrong with the DB
         """
 
         amount: int = 1 if action is Action.INCREMENT else -1
+        count_column: str = 'plus_count' if action is Action.INCREMENT else 'minus_count'
         try:
             results: list = self.db_mgr.execute_statement(f"""
                                          SELECT recipient.name as top_recipient_name,
-                                                COUNT(*) as times_received
-                                         FROM grants g
-                                         JOIN entities granter ON g.granter_id = granter.entity_id
-                                         JOIN entities recipient ON g.recipient_id = recipient.entity_id
+                                                p.{count_column} as times_received
+                                         FROM grant_pair_totals p
+                                         JOIN entities granter ON p.granter_id = granter.entity_id
+                                         JOIN entities recipient ON p.recipient_id = recipient.entity_id
                                          WHERE granter.name = ?
-                                         AND g.amount = ?
-                                         GROUP BY g.recipient_id
+                                         AND p.{count_column} > 0
                                          ORDER BY times_received DESC, top_recipient_name
                                          LIMIT ?;""",
-                                                          (granter_name, amount, NUM_TOP_RECIPIENTS))
+                                                          (granter_name, NUM_TOP_RECIPIENTS))
             return [(name, (int(num_grants)) * amount) for name, num_grants in results]
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('karma.get-top-recipients.sql-error',
-                                                   name=granter_name,
-                                                   e=e))
+            self.logger.error(LazyString('karma.get-top-recipients.sql-error',
+                                         name=granter_name,
+                                         e=e))
+            raise
+
+    def rebuild_grant_pair_totals(self) -> int:
+        """Recalculate the whole 'grant_pair_totals' table from the 'grants' table.
+
+        Triggers normally keep the totals current, so this is only needed if 'grants' was changed in a way the
+        triggers don't see, like with the triggers dropped. Runs in one transaction, so readers see either the
+        old totals or the new ones.
+
+        :returns: Number of granter/recipient pairs in the rebuilt table
+        :raises sqlite3.Error: If anything goes wrong with the DB
+        """
+
+        try:
+            with self.db_mgr.transaction() as conn:
+                conn.execute('DELETE FROM grant_pair_totals;')
+                cursor: Cursor = conn.execute("""
+                                              INSERT INTO grant_pair_totals (granter_id, recipient_id,
+                                                                             plus_count, minus_count)
+                                              SELECT granter_id, recipient_id, SUM(amount = 1), SUM(amount = -1)
+                                              FROM grants
+                                              GROUP BY granter_id, recipient_id;""")
+                num_pairs: int = cursor.rowcount
+        except sqlite3.Error as e:
+            self.logger.error(LazyString('karma.rebuild-grant-pair-totals.sql-error', e=e))
             raise
+        self.logger.info(LazyString('karma.rebuild-grant-pair-totals.rebuilt', num_pairs=num_pairs))
+        return num_pairs
 
     def grant_karma(self,
                     granter_name: str,
                     recipient_name: str,
-                    amount: int) -> None:
-        """Grant karma.
+                    amount: int) -> int:
+        """Grant karma and return the recipient's new karma total.
+
+        Both entities' statuses come from the entity cache. `grant_writer` records the grant and updates the
+        recipient's karma in one transaction, so `entities.karma` can never get out of step with the `grants` table.
+        That transaction checks both statuses again, in case either entity opted out after it was cached.
 
+        :returns: The recipient's karma after the grant
         :raises OptedOutGranterError: If the granter has `opted-out` status
         :raises OptedOutRecipientError: If the recipient has `opted-out` status
+        :raises ValueError: If the granter or recipient doesn't exist in the DB
+        :raises GrantQueueFullError: If grants are arriving faster than they can be written
+        :raises GrantTimeoutError: If the grant took too long to write, so it may or may not have been recorded
         :raises sqlite3.Error: If anything goes wrong with the DB
         """
 
-        if self.entity_mgr.get_status(granter_name) == Status.OPTED_OUT:
-            self.logger.info(StringMgr.get_string('karma.grant-karma.granter-opted-out',
-                                                  granter_name=granter_name,
-                                                  amount=amount,
-                                                  recipient_name=recipient_name))
-            raise OptedOutGranterError
+        try:
+            granter: Entity | None = self.entity_mgr.get_entity(granter_name)
+            recipient: Entity | None = self.entity_mgr.get_entity(recipient_name)
+            for name, entity in ((granter_name, granter), (recipient_name, recipient)):
+                if entity is None:
+                    self.logger.info(LazyString('entity.error.not-in-db', name=name))
+                    raise ValueError(name)
 
-        if self.entity_mgr.get_status(recipient_name) == Status.OPTED_OUT:
-            self.logger.info(StringMgr.get_string('karma.grant-karma.recipient-opted-out',
-                                                  granter_name=granter_name,
-                                                  amount=amount,
-                                                  recipient_name=recipient_name))
-            raise OptedOutRecipientError
+            if not granter.opted_in:
+                self.logger.info(LazyString('karma.grant-karma.granter-opted-out',
+                                            granter_name=granter_name,
+                                            amount=amount,
+                                            recipient_name=recipient_name))
+                raise OptedOutGranterError
 
-        try:
-            # make an entry in the 'grants' table using subqueries to look up 'entity_id' for granter and recipient
-            self.db_mgr.execute_statement("""
-                                              INSERT INTO grants (granter_id, recipient_id, amount)
-                                              SELECT
-                                                  (SELECT entity_id FROM entities WHERE name = ?),
-                                                  (SELECT entity_id FROM entities WHERE name = ?),
-                                                  ?;""",
-                                          (granter_name, recipient_name, amount))
-            # make an entry in the 'entities' table, which tracks total karma for each user
-            self.db_mgr.execute_statement("""
-                                              UPDATE entities
-                                              SET karma = karma + ?
-                                              WHERE name = ?;""",
-                                          (amount, recipient_name))
-            self.logger.info(StringMgr.get_string('karma.grant-karma.granted',
-                                                  granter_name=granter_name,
-                                                  amount=amount,
-                                                  recipient_name=recipient_name))
+            if not recipient.opted_in:
+                self.logger.info(LazyString('karma.grant-karma.recipient-opted-out',
+                                            granter_name=granter_name,
+                                            amount=amount,
+                                            recipient_name=recipient_name))
+                raise OptedOutRecipientError
+
+            try:
+                recipient_total_karma: int = self.grant_writer.write(granter.entity_id, recipient.entity_id, amount)
+            except OptedOutGranterError:  # opted out after the cache was filled, as the grant's transaction found
+                self.logger.info(LazyString('karma.grant-karma.granter-opted-out',
+                                            granter_name=granter_name,
+                                            amount=amount,
+                                            recipient_name=recipient_name))
+                raise
+            except OptedOutRecipientError:
+                self.logger.info(LazyString('karma.grant-karma.recipient-opted-out',
+                                            granter_name=granter_name,
+                                            amount=amount,
+                                            recipient_name=recipient_name))
+                raise
         except sqlite3.Error as e:
-            self.logger.error(StringMgr.get_string('karma.grant-karma.sql-error',
-                                                   granter_name=granter_name,
-                                                   amount=amount,
-                                                   recipient_name=recipient_name,
-                                                   e=e))
+            self.logger.error(LazyString('karma.grant-karma.sql-error',
+                                         granter_name=granter_name,
+                                         amount=amount,
+                                         recipient_name=recipient_name,
+                                         e=e))
             raise
+        self.logger.info(LazyString('karma.grant-karma.granted',
+                                    granter_name=granter_name,
+                                    amount=amount,
+                                    recipient_name=recipient_name))
+        return recipient_total_karma
@@ -0,0 +1,20 @@
+from string_mgr import StringMgr
+
+from typing import Any
+
+
+class LazyString:
+    """A string from `StringMgr` that isn't built until something turns it into a `str`.
+
+    Pass one to a logger instead of calling `StringMgr.get_string()` first. If the logger's level drops the record,
+    the string is never built, and otherwise it's built on the thread that writes the log, not the caller's.
+    """
+
+    __slots__ = ('key_path', 'kwargs')
+
+    def __init__(self, key_path: str, **kwargs: Any):
+        self.key_path: str = key_path
+        self.kwargs: dict[str, Any] = kwargs
+
+    def __str__(self) -> str:
+        return StringMgr.get_string(self.key_path, **self.kwargs)
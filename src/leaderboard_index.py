@@ -0,0 +1,156 @@
+from constants import LEADERBOARD_PAGE_SIZE
+from db_mgr import DbMgr
+from lazy_string import LazyString
+import response_blocks
+from string_mgr import StringMgr
+
+from bisect import bisect_left, insort
+from logging import Logger
+import math
+import sqlite3
+from threading import Lock
+
+
+class LeaderboardIndex:
+    """In-process, always-sorted index of the objects shown by `/instakarma leaderboard`, with rendered pages.
+
+    Holds every non-user entity with non-zero karma, sorted by descending karma and then by name, which is the
+    order the leaderboard shows them in. It's loaded from the DB on first use, then kept current by `update()`
+    after each grant, so showing a page never has to query or sort the whole 'entities' table.
+
+    Rendered Slack blocks are cached per page. A grant only invalidates the pages whose entries moved or changed,
+    so most requests for a page are served straight from the cache. If another process, like `instakarma-admin`,
+    changes entities, `DbMgr.check_for_changes()` invalidates the whole index. Thread-safe, since grants are recorded
+    on the grant writer thread while slash commands run on a worker pool.
+    """
+
+    def __init__(self, db_mgr: DbMgr, logger: Logger, page_size: int = LEADERBOARD_PAGE_SIZE):
+        self.db_mgr = db_mgr
+        self.logger = logger
+        self.page_size: int = page_size
+        self._keys: list[tuple[int, str]] = []  # (-karma, name), so ascending order is the leaderboard's order
+        self._karma_by_name: dict[str, int] = {}
+        self._page_blocks: dict[int, list[dict]] = {}  # 1-based page number -> rendered Slack blocks
+        self._is_loaded: bool = False
+        self._lock: Lock = Lock()
+        self.db_mgr.add_change_listener(self.invalidate)
+
+    def get_page_blocks(self, page_number: int) -> list[dict] | None:
+        """Get the rendered Slack blocks for one page of the leaderboard.
+
+        :param page_number: 1 for the entities with the most karma
+        :returns: The page's blocks, or None if there's no such page (page 1 always exists, even if it's empty)
+        :raises sqlite3.Error: If the leaderboard has to be loaded and anything goes wrong with the DB
+        """
+
+        self.db_mgr.check_for_changes()
+        with self._lock:
+            if not self._is_loaded:
+                self._load()
+            num_pages: int = self._num_pages()
+            if not 1 <= page_number <= num_pages:
+                return None
+            blocks: list[dict] | None = self._page_blocks.get(page_number)
+            if blocks is None:
+                blocks = self._render_page(page_number, num_pages)
+                self._page_blocks[page_number] = blocks
+            return blocks
+
+    def get_num_pages(self) -> int:
+        """:returns: Number of pages in the leaderboard, which is at least 1 even if nothing has karma
+        :raises sqlite3.Error: If the leaderboard has to be loaded and anything goes wrong with the DB
+        """
+
+        self.db_mgr.check_for_changes()
+        with self._lock:
+            if not self._is_loaded:
+                self._load()
+            return self._num_pages()
+
+    def update(self, name: str, user_id: str | None, karma: int) -> None:
+        """Record an entity's new karma after a grant has been committed.
+
+        Users (entities with a Slack user ID) aren't on the leaderboard, so they're ignored. Must be called in
+        the order grants were committed, which the grant writer thread guarantees.
+        """
+
+        if user_id is not None:
+            return
+        with self._lock:
+            if not self._is_loaded:
+                return  # the next `get_page_blocks()` loads everything from the DB, including this grant
+            num_pages_before: int = self._num_pages()
+            changed_positions: list[int] = []
+
+            old_karma: int | None = self._karma_by_name.pop(name, None)
+            if old_karma is not None:
+                old_position: int = bisect_left(self._keys, (-old_karma, name))
+                del self._keys[old_position]
+                changed_positions.append(old_position)
+            if karma != 0:
+                self._karma_by_name[name] = karma
+                insort(self._keys, (-karma, name))
+                changed_positions.append(bisect_left(self._keys, (-karma, name)))
+
+            if not changed_positions:
+                return
+            if self._num_pages() != num_pages_before:
+                self._page_blocks.clear()  # every page shows the number of pages
+                return
+            # entries between the old and new positions each shift by one place; if the entity was only added
+            # or removed, every entry after it shifts
+            first_page: int = min(changed_positions) // self.page_size + 1
+            last_page: int = (max(changed_positions) // self.page_size + 1 if len(changed_positions) == 2
+                              else num_pages_before)
+            for page_number in range(first_page, last_page + 1):
+                self._page_blocks.pop(page_number, None)
+
+    def invalidate(self) -> None:
+        """Forget everything, so the next request reloads the leaderboard from the DB.
+
+        Use this when the DB may have changed without `update()` being called, like after a failed transaction.
+        """
+
+        with self._lock:
+            self._is_loaded = False
+            self._keys = []
+            self._karma_by_name = {}
+            self._page_blocks = {}
+
+    def _load(self) -> None:
+        """Load every non-user entity with non-zero karma from the DB. Caller must hold `_lock`.
+
+        :raises sqlite3.Error: If anything goes wrong with the DB
+        """
+
+        try:
+            results: list = self.db_mgr.execute_statement("""
+                                                          SELECT name, karma
+                                                          FROM entities
+                                                          WHERE user_id IS NULL
+                                                          AND karma IS NOT 0;""",
+                                                          ())
+        except sqlite3.Error as e:
+            self.logger.error(LazyString('action.leaderboard.sqlite3-error', e=e))
+            raise
+        self._karma_by_name = {name: karma for name, karma in results}
+        self._keys = sorted((-karma, name) for name, karma in results)
+        self._page_blocks = {}
+        self._is_loaded = True
+
+    def _num_pages(self) -> int:
+        """:returns: Number of pages in the leaderboard, which is at least 1 even if nothing has karma"""
+
+        return max(1, math.ceil(len(self._keys) / self.page_size))
+
+    def _render_page(self, page_number: int, num_pages: int) -> list[dict]:
+        """Render one page of the leaderboard as Slack blocks. Caller must hold `_lock`."""
+
+        start: int = (page_number - 1) * self.page_size
+        leader_text: str = '\n'.join(StringMgr.get_string('action.leaderboard.entry',
+                                                          karma=-negative_karma,
+                                                          name=name)
+                                     for negative_karma, name in self._keys[start:start + self.page_size])
+        if not leader_text:
+            leader_text = StringMgr.get_string('action.leaderboard.leader-text-when-no-karma')
+        return response_blocks.leaderboard(leader_text, page_number, num_pages)
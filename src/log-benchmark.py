@@ -0,0 +1,171 @@
+import os
+import sys
+
+if os.path.basename(os.getcwd()) != 'src':
+    print("Error: 'log-benchmark' must be run from the '<REPO-ROOT-DIR>/src/' directory")
+    sys.exit(1)
+
+from constants import *
+from db_mgr import DbMgr
+from entity_mgr import EntityMgr
+from enums import LogFormat
+from grant_mgr import GrantMgr
+from grant_writer import GrantWriter
+from karma_mgr import KarmaMgr
+from lazy_string import LazyString
+from log_mgr import LogMgr
+from message_parser import MessageParser
+from string_mgr import StringMgr
+
+import argparse
+from argparse import ArgumentParser
+import logging
+from logging import Logger
+from logging.handlers import QueueListener
+from pathlib import Path
+import random
+import tempfile
+from threading import Event, Thread
+import time
+
+# (name, format, whether records are queued for a writer thread, log level) of each logging setup to time
+LOG_SETUPS: tuple[tuple[str, LogFormat, bool, str], ...] = (
+    ('unqueued', LogFormat.TEXT, False, 'INFO'),  # how the bot logged before: formatted and written by the caller
+    ('queued', LogFormat.TEXT, True, 'INFO'),
+    ('queued-json', LogFormat.JSON, True, 'INFO'),
+    ('queued-warning', LogFormat.TEXT, True, 'WARNING'),  # INFO records are dropped before their strings are built
+)
+
+
+def time_log_calls(logger: Logger, listener: QueueListener | None, num_calls: int) -> float:
+    """Time how long the caller spends logging one grant, then wait for any queued records to be written.
+
+    :returns: Seconds per call
+    """
+
+    start: float = time.perf_counter()
+    for i in range(num_calls):
+        logger.info(LazyString('karma.grant-karma.granted',
+                               granter_name='@user0',
+                               amount=1,
+                               recipient_name=f'thing{i}'))
+    seconds_per_call: float = (time.perf_counter() - start) / num_calls
+    while listener is not None and not listener.queue.empty():
+        time.sleep(0.01)
+    return seconds_per_call
+
+
+def run_load(grant_mgr: GrantMgr,
+             num_users: int,
+             num_objects: int,
+             num_threads: int,
+             messages_per_second: float,
+             seconds: float) -> list[float]:
+    """Handle `messages_per_second` messages that each grant karma to 2 objects, spread over `num_threads` threads.
+
+    Messages arrive at random intervals like real ones. Threads that handled messages as fast as they could would
+    mostly measure how long they waited for each other.
+
+    :returns: Latency of every message in seconds
+    """
+
+    stop: Event = Event()
+    latencies_by_thread: list[list[float]] = [[] for _ in range(num_threads)]
+
+    def say(*args, **kwargs) -> None:
+        """Stand-in for Slack Bolt's `say`, which sends nothing."""
+
+    def grant(latencies: list[float]) -> None:
+        while not stop.wait(random.expovariate(messages_per_second / num_threads)):
+            msg_text: str = f'thing{random.randrange(num_objects)}++ thing{random.randrange(num_objects)}--'
+            start: float = time.perf_counter()
+            grant_mgr.handle_grants(say, f'U{random.randrange(num_users):08d}', msg_text)
+            latencies.append(time.perf_counter() - start)
+
+    threads: list[Thread] = [Thread(target=grant, args=(latencies,)) for latencies in latencies_by_thread]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return [latency for latencies in latencies_by_thread for latency in latencies]
+
+
+def main() -> None:
+    """Parse CLI parameters, then time grant handling on a test DB with each logging setup."""
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description=StringMgr.get_string('log-benchmark.description'),
+        prog=StringMgr.get_string('log-benchmark.prog'))
+    parser.add_argument('--log-calls',
+                        default=LOG_BENCHMARK_LOG_CALLS,
+                        help=StringMgr.get_string('log-benchmark.help.log-calls'),
+                        type=int)
+    parser.add_argument('--log-dir',
+                        help=StringMgr.get_string('log-benchmark.help.log-dir'),
+                        metavar='DIR')
+    parser.add_argument('--rate',
+                        default=LOG_BENCHMARK_RATE,
+                        help=StringMgr.get_string('log-benchmark.help.rate'),
+                        type=float)
+    parser.add_argument('--seconds',
+                        default=LOG_BENCHMARK_SECONDS,
+                        help=StringMgr.get_string('log-benchmark.help.seconds'),
+                        type=float)
+    parser.add_argument('--threads',
+                        default=GRANT_WORKERS,
+                        help=StringMgr.get_string('log-benchmark.help.threads'),
+                        type=int)
+    args: argparse.Namespace = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_dir: Path = Path(args.log_dir or temp_dir)
+        db_mgr: DbMgr = DbMgr(logging.getLogger(StringMgr.get_string('log-benchmark.prog')),
+                              db_file_name=str(Path(temp_dir) / 'instakarma.db'))
+        db_mgr.init_db()
+        db_mgr.migrate_db()
+        with db_mgr.transaction() as conn:
+            conn.executemany('INSERT INTO entities (name, user_id) VALUES (?, ?);',
+                             [(f'@user{i}', f'U{i:08d}') for i in range(LOG_BENCHMARK_USERS)] +
+                             [(f'thing{i}', None) for i in range(LOG_BENCHMARK_OBJECTS)])
+
+        for name, log_format, queued, log_level in LOG_SETUPS:
+            logger: Logger = logging.getLogger(f"{StringMgr.get_string('log-benchmark.prog')}.{name}")
+            logger.propagate = False
+            logger.setLevel(log_level)
+            log_file: Path = log_dir / f'log-benchmark-{name}.log'
+            listener: QueueListener | None = LogMgr.add_file_handler(logger, str(log_file), log_format=log_format,
+                                                                     queued=queued)
+            seconds_per_log_call: float = time_log_calls(logger, listener, args.log_calls)
+
+            entity_mgr: EntityMgr = EntityMgr(db_mgr, logger)
+            grant_writer: GrantWriter = GrantWriter(db_mgr, entity_mgr.entity_cache, logger)
+            karma_mgr: KarmaMgr = KarmaMgr(db_mgr, entity_mgr, logger, grant_writer)
+            grant_mgr: GrantMgr = GrantMgr(entity_mgr, karma_mgr, logger, MessageParser(logger), db_mgr)
+            grant_writer.start()
+            try:
+                latencies: list[float] = run_load(grant_mgr, LOG_BENCHMARK_USERS, LOG_BENCHMARK_OBJECTS,
+                                                  args.threads, args.rate, args.seconds)
+            finally:
+                grant_writer.close()
+                if listener is not None:
+                    listener.stop()
+                for handler in logger.handlers:
+                    handler.close()
+
+            latencies.sort()
+            print(StringMgr.get_string('log-benchmark.result',
+                                       setup=name,
+                                       log_call_us=seconds_per_log_call * 1e6,
+                                       messages=len(latencies),
+                                       p50_ms=latencies[len(latencies) // 2] * 1e3,
+                                       p99_ms=latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1e3,
+                                       max_ms=latencies[-1] * 1e3))
+            if args.log_dir is not None:
+                log_file.unlink(missing_ok=True)
+        db_mgr.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,21 @@
-from constants import LOG_FILE, LOG_LEVEL, LOG_FILE_SIZE, LOG_FILE_COUNT
+from constants import LOG_FILE, LOG_FILE_COUNT, LOG_FILE_SIZE, LOG_FORMAT, LOG_LEVEL, LOG_QUEUED
+from enums import LogFormat
+from json_log_formatter import JsonLogFormatter
+from log_queue_handler import LogQueueHandler
 
-from logging import Logger
+import atexit
+from logging import Formatter, Handler, Logger
 import logging.handlers
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueListener, RotatingFileHandler
 import pathlib
+from queue import SimpleQueue
 
 
 class LogMgr:
     """Singleton class, so `LogMgr.get_logger()` always returns the same `logger` instance."""
 
     _logger: Logger | None = None
+    _listener: QueueListener | None = None
 
     def __new__(cls):
         """Prevent instantiation of this class."""
@@ -22,34 +28,65 @@ class LogMgr:
                    log_file: str = LOG_FILE,
                    log_level: str = LOG_LEVEL,
                    log_file_size: int = LOG_FILE_SIZE,
-                   log_file_count: int = LOG_FILE_COUNT) -> Logger:
+                   log_file_count: int = LOG_FILE_COUNT,
+                   log_format: LogFormat = LOG_FORMAT,
+                   queued: bool = LOG_QUEUED) -> Logger:
         """Retrieve the single logger instance used throughout instakarma-bot.
 
         :returns Logger: The instakarma-bot logger
         """
 
         if LogMgr._logger is None:
-            LogMgr._logger = LogMgr._init_logger(name, log_file, log_level, log_file_size, log_file_count)
+            LogMgr._logger = logging.getLogger(name)
+            LogMgr._logger.setLevel(log_level)
+            LogMgr._listener = LogMgr.add_file_handler(LogMgr._logger, log_file, log_file_size, log_file_count,
+                                                       log_format, queued)
+            atexit.register(LogMgr.stop)  # runs before `logging` shuts down, so queued records are still written
         return LogMgr._logger
 
+    @classmethod
+    def stop(cls) -> None:
+        """Write any queued log records and stop the writer thread. No-op if logging isn't queued."""
+
+        if LogMgr._listener is not None:
+            LogMgr._listener.stop()
+            LogMgr._listener = None
+
     @staticmethod  # doesn't need access to class state, so can be static
-    def _init_logger(name: str,
-                     log_file: str = LOG_FILE,
-                     log_level: str = LOG_LEVEL,
-                     log_file_size: int = LOG_FILE_SIZE,
-                     log_file_count: int = LOG_FILE_COUNT):
-        """Make the single logger if it doesn't exist as a class variable yet."""
+    def add_file_handler(logger: Logger,
+                         log_file: str = LOG_FILE,
+                         log_file_size: int = LOG_FILE_SIZE,
+                         log_file_count: int = LOG_FILE_COUNT,
+                         log_format: LogFormat = LOG_FORMAT,
+                         queued: bool = LOG_QUEUED) -> QueueListener | None:
+        """Make `logger` write to a rotating log file.
+
+        If `queued` is set, logging a record only puts it on a queue. A `QueueListener` thread formats it and
+        writes it to the file, so the disk write, and rotating the file when it's full, never hold up the caller.
+
+        :returns: The running listener that writes queued records, to stop when shutting down, or None if logging
+                  isn't queued
+        """
 
         log_path = pathlib.Path(log_file)
         log_path.parent.mkdir(parents=True, exist_ok=True)  # make parent dir(s) if needed
-        logger: Logger = logging.getLogger(name)
-        logger.setLevel(log_level)
-        formatter = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(message)s',
-                                      datefmt='%m/%d/%Y %I:%M:%S %p')
-        handler = RotatingFileHandler(filename=log_file,
-                                      mode='a',
-                                      maxBytes=log_file_size,
-                                      backupCount=log_file_count)
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        return logger
+        if log_format is LogFormat.JSON:
+            formatter: Formatter = JsonLogFormatter()
+        else:
+            formatter: Formatter = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(message)s',
+                                                     datefmt='%m/%d/%Y %I:%M:%S %p')
+        file_handler = RotatingFileHandler(filename=log_file,
+                                           mode='a',
+                                           maxBytes=log_file_size,
+                                           backupCount=log_file_count)
+        file_handler.setFormatter(formatter)
+        if not queued:
+            logger.addHandler(file_handler)
+            return None
+
+        log_queue: SimpleQueue = SimpleQueue()  # unbounded, so logging never blocks or drops records
+        queue_handler: Handler = LogQueueHandler(log_queue)
+        logger.addHandler(queue_handler)
+        listener: QueueListener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        listener.start()
+        return listener
@@ -0,0 +1,14 @@
+from logging import LogRecord
+from logging.handlers import QueueHandler
+
+
+class LogQueueHandler(QueueHandler):
+    """Put log records on a queue exactly as they were logged, for a `QueueListener` to format and write.
+
+    `QueueHandler` formats each record before queueing it, so it can be pickled and sent to another process. This
+    queue stays in one process, so skipping that step moves all the formatting, including building any
+    `LazyString` message, onto the listener's thread.
+    """
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        return record
@@ -0,0 +1,227 @@
+from constants import (MEMORY_CHECK_INTERVAL_SECONDS, MEMORY_REPORT_FILE, MEMORY_REPORT_INTERVAL_SECONDS,
+                       MEMORY_REPORT_TOP_N, MEMORY_RSS_WARNING_MB, MEMORY_RSS_WARNING_STEP_MB, MEMORY_TRACE_FRAMES)
+from lazy_string import LazyString
+from string_mgr import StringMgr
+
+from collections import defaultdict
+from datetime import datetime
+from logging import Logger
+import os
+from pathlib import Path
+import sys
+import sysconfig
+from threading import Event, Thread
+import time
+import tracemalloc
+
+SRC_DIR: Path = Path(__file__).resolve().parent
+STDLIB_DIR: Path = Path(sysconfig.get_paths()['stdlib']).resolve()
+
+# allocations made by tracing and importing themselves, which would only add noise to reports
+IGNORED_TRACES: tuple[tracemalloc.Filter, ...] = (tracemalloc.Filter(False, tracemalloc.__file__),
+                                                   tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                                                   tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+                                                   tracemalloc.Filter(False, '<unknown>'))
+
+
+class MemoryMonitor:
+    """Watch the bot's memory on a background thread, so a leak is noticed before the host kills the process.
+
+    Every `MEMORY_CHECK_INTERVAL_SECONDS`, the process's resident set size (RSS) is checked. A warning is logged when
+    it first goes over `rss_warning_mb`, and again every time it grows another `MEMORY_RSS_WARNING_STEP_MB`.
+
+    With `trace=True` (the bot's `--memory-diagnostics` flag), allocations are also traced with `tracemalloc`. The
+    first snapshot, taken one report interval after starting so caches have filled, is the baseline. Every later
+    report interval, after an RSS warning, and when the monitor stops, a report of what has grown since the baseline
+    is appended to `report_file`: growth per `src/` module, then the top allocation sites. Tracing makes every
+    allocation slower and uses memory of its own, so it's off unless asked for.
+    """
+
+    def __init__(self,
+                 logger: Logger,
+                 report_file: str = MEMORY_REPORT_FILE,
+                 rss_warning_mb: int = MEMORY_RSS_WARNING_MB,
+                 check_interval_seconds: float = MEMORY_CHECK_INTERVAL_SECONDS,
+                 report_interval_seconds: float = MEMORY_REPORT_INTERVAL_SECONDS):
+        self.logger = logger
+        self.report_file: str = report_file
+        self.rss_warning_mb: int = rss_warning_mb  # 0 turns off the warning
+        self.check_interval_seconds: float = check_interval_seconds
+        self.report_interval_seconds: float = report_interval_seconds
+        self._baseline: tracemalloc.Snapshot | None = None
+        self._baseline_taken_at: datetime | None = None
+        self._is_tracing: bool = False  # whether `start()` started tracemalloc, so `stop()` should stop it
+        self._stop_monitoring: Event = Event()
+        self._monitor_thread: Thread | None = None
+
+    def start(self, trace: bool = False) -> None:
+        """Start checking RSS, and tracing allocations if `trace` is True, on a background thread."""
+
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_TRACE_FRAMES)
+            self._is_tracing = True
+            self.logger.info(LazyString('memory-monitor.tracing-started',
+                                        frames=MEMORY_TRACE_FRAMES,
+                                        report_file=self.report_file,
+                                        interval_seconds=self.report_interval_seconds))
+        self._stop_monitoring.clear()
+        self._monitor_thread = Thread(target=self._monitor, name='memory-monitor', daemon=True)
+        self._monitor_thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread started by `start()`, then write a last report if tracing."""
+
+        self._stop_monitoring.set()
+        if self._monitor_thread is None:
+            return
+        self._monitor_thread.join()
+        self._monitor_thread = None
+        if self._baseline is not None:
+            self._write_report('stopping')
+            self._baseline = None
+        if self._is_tracing:
+            tracemalloc.stop()
+            self._is_tracing = False
+
+    def _monitor(self) -> None:
+        """Check RSS every check interval, and take a snapshot every report interval if tracing, until stopped."""
+
+        next_warning_mb: int = self.rss_warning_mb
+        next_snapshot_at: float = time.monotonic() + self.report_interval_seconds
+        while not self._stop_monitoring.wait(self.check_interval_seconds):
+            rss_mb: float | None = self.get_rss_mb()
+            if self.rss_warning_mb and rss_mb is not None and rss_mb >= next_warning_mb:
+                self.logger.warning(LazyString('memory-monitor.rss-warning',
+                                               rss_mb=rss_mb,
+                                               warning_mb=self.rss_warning_mb,
+                                               report_file=self.report_file))
+                next_warning_mb = int(rss_mb) + MEMORY_RSS_WARNING_STEP_MB
+                if self._baseline is not None:
+                    self._write_report('rss-warning')  # show what grew while it's still growing
+            if self._is_tracing and time.monotonic() >= next_snapshot_at:
+                next_snapshot_at += self.report_interval_seconds
+                if self._baseline is None:
+                    self._baseline = tracemalloc.take_snapshot().filter_traces(IGNORED_TRACES)
+                    self._baseline_taken_at = datetime.now()
+                else:
+                    self._write_report('scheduled')
+
+    def _write_report(self, reason: str) -> None:
+        """Append a report of what has grown since the baseline snapshot to the report file.
+
+        Failing to write is logged, not raised, since it shouldn't stop the bot.
+        """
+
+        started_at: float = time.perf_counter()
+        snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED_TRACES)
+        lines: list[str] = self._format_report(snapshot, reason)
+        try:
+            Path(self.report_file).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.report_file, 'a') as report_file:
+                report_file.write('\n'.join(lines) + '\n\n')
+        except OSError as e:
+            self.logger.error(LazyString('memory-monitor.could-not-write', report_file=self.report_file, e=e))
+            return
+        self.logger.info(LazyString('memory-monitor.report-written',
+                                    reason=reason,
+                                    report_file=self.report_file,
+                                    seconds=time.perf_counter() - started_at))
+
+    def _format_report(self, snapshot: tracemalloc.Snapshot, reason: str) -> list[str]:
+        """Compare a snapshot to the baseline, grouping growth by module and by allocation site.
+
+        An allocation is grouped under the innermost `src/` module on its stack, so it's blamed on the bot code that
+        caused it even if a library made it. Allocations with no `src/` module in their last `MEMORY_TRACE_FRAMES`
+        frames, like those made by slack_sdk's own threads, are grouped under the package that made them instead.
+
+        :returns: The report's lines
+        """
+
+        traced_bytes, peak_traced_bytes = tracemalloc.get_traced_memory()
+        total_growth_bytes: int = 0
+        total_growth_blocks: int = 0
+        growth_by_module: dict[str, list[int]] = defaultdict(lambda: [0, 0])  # module -> [bytes, blocks]
+        for diff in snapshot.compare_to(self._baseline, 'traceback'):
+            growth: list[int] = growth_by_module[self._get_module_name(diff.traceback)]
+            growth[0] += diff.size_diff
+            growth[1] += diff.count_diff
+            total_growth_bytes += diff.size_diff
+            total_growth_blocks += diff.count_diff
+
+        rss_mb: float | None = self.get_rss_mb()
+        lines: list[str] = [StringMgr.get_string('memory-monitor.report.header',
+                                                 time=datetime.now().isoformat(sep=' ', timespec='seconds'),
+                                                 reason=reason,
+                                                 rss=f'{rss_mb:.1f}MB' if rss_mb is not None else '?',
+                                                 traced_mb=traced_bytes / 1e6,
+                                                 peak_traced_mb=peak_traced_bytes / 1e6,
+                                                 tracing_mb=tracemalloc.get_tracemalloc_memory() / 1e6,
+                                                 growth_mb=total_growth_bytes / 1e6,
+                                                 growth_blocks=total_growth_blocks,
+                                                 baseline_time=self._baseline_taken_at.isoformat(sep=' ',
+                                                                                                 timespec='seconds')),
+                             StringMgr.get_string('memory-monitor.report.by-module')]
+        modules: list[tuple[str, list[int]]] = sorted(growth_by_module.items(), key=lambda item: item[1][0],
+                                                      reverse=True)
+        for module_name, (growth_bytes, growth_blocks) in modules[:MEMORY_REPORT_TOP_N]:
+            if not growth_bytes and not growth_blocks:
+                continue
+            lines.append(StringMgr.get_string('memory-monitor.report.growth',
+                                              growth_mb=growth_bytes / 1e6,
+                                              growth_blocks=growth_blocks,
+                                              where=module_name))
+        lines.append(StringMgr.get_string('memory-monitor.report.by-site'))
+        for diff in snapshot.compare_to(self._baseline, 'lineno')[:MEMORY_REPORT_TOP_N]:
+            frame: tracemalloc.Frame = diff.traceback[0]
+            lines.append(StringMgr.get_string('memory-monitor.report.growth',
+                                              growth_mb=diff.size_diff / 1e6,
+                                              growth_blocks=diff.count_diff,
+                                              where=f'{self._get_short_path(frame.filename)}:{frame.lineno}'))
+        return lines
+
+    @staticmethod
+    def _get_module_name(traceback: tracemalloc.Traceback) -> str:
+        """:returns: The innermost `src/` module on an allocation's stack, like 'string_mgr.py', or else the
+                     package that made the allocation, like 'slack_sdk' or 'logging'
+        """
+
+        for frame in reversed(traceback):  # a traceback runs from the outermost frame to the innermost
+            if Path(frame.filename).parent == SRC_DIR:
+                return os.path.basename(frame.filename)
+        return MemoryMonitor._get_short_path(traceback[-1].filename).split('/')[0].removesuffix('.py')
+
+    @staticmethod
+    def _get_short_path(file_name: str) -> str:
+        """:returns: A file's path relative to `src/`, `site-packages/`, or the standard library, like
+                     'slack_sdk/web/base_client.py', or the whole path if it's none of those
+        """
+
+        path: Path = Path(file_name)
+        if path.parent == SRC_DIR:
+            return path.name
+        for i in range(len(path.parts) - 1, -1, -1):
+            if path.parts[i] in ('site-packages', 'dist-packages'):
+                return '/'.join(path.parts[i + 1:])
+        if path.is_relative_to(STDLIB_DIR):
+            return path.relative_to(STDLIB_DIR).as_posix()
+        return file_name
+
+    @staticmethod
+    def get_rss_mb() -> float | None:
+        """Get the process's current resident set size. Where `/proc` doesn't exist, like on macOS, this is the
+        peak RSS instead, which still crosses the warning threshold when the current RSS does.
+
+        :returns: RSS in MB, or None if it can't be read on this platform
+        """
+
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+        except (OSError, ValueError):
+            pass
+        try:
+            import resource  # Unix only
+        except ImportError:
+            return None
+        max_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / 1e6 if sys.platform == 'darwin' else max_rss / 1e3  # bytes on macOS, KB elsewhere
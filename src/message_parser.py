@@ -1,6 +1,10 @@
-from enums import Action
+from constants import PARSER_MAX_MESSAGE_LENGTH, PARSER_MAX_RECIPIENTS
+from enums import Action, RecipientKind
+from lazy_string import LazyString
+from recipient import Recipient
 from string_mgr import StringMgr
 
+from collections.abc import Iterator
 from logging import Logger
 import re
 from re import Pattern
@@ -8,101 +12,142 @@ from typing import Final
 
 
 class MessageParser:
-    BACKTICK_PAIR_REGEX: Final[Pattern] = re.compile(r'`[^`]+`')
-
-    # Regex components
-    AT_SYMBOL: Final[str] = r'@'
-    AT_SYMBOL_AND_USER_ID: Final[str] = r'(@\w+)'
-    EITHER_OPERATOR: Final[str] = r'(\+\+|--)'
-    GREATER_THAN_SYMBOL: Final[str] = r'>'
-    INCREMENT_OPERATOR: Final[str] = r'(\+\+)'
-    LESS_THAN_SYMBOL: Final[str] = r'<'
-    NO_EXTRA_OPERATORS: Final[str] = r'(?![-+])'
-    NO_PRECEDING_AT_SYMBOL: Final[str] = r'(?<!@)'
-    NO_PRECEDING_LESS_THAN_SYMBOL: Final[str] = r'(?<!<)'
-    ONE_OR_MORE_NON_GREATER_THAN: Final[str] = r'([^>]+)'
-    WHITESPACE_OR_NOTHING: Final[str] = r'(?!\S)'
-    WORD_BOUNDARY: Final[str] = r'\b'
-    WORD_WITH_NO_BACKTICK_GT_LT: Final[str] = r'([^\s`<>]+)'
-    WORD_WITH_NO_BACKTICK_GT_LT_AT: Final[str] = r'([^\s`<>@]+)'
-    WORD_WITH_NO_BACKTICK_OR_PLUS_OR_MINUS: Final[str] = r'([^\s`+-]+)'
-    ZERO_OR_ONE_WHITESPACE: Final[str] = r'\s?'
-
-    # Assembled regexes
-    INVALID_USER_RECIPIENT_REGEX: Final[str] = (NO_PRECEDING_LESS_THAN_SYMBOL +
-                                                AT_SYMBOL +
-                                                WORD_WITH_NO_BACKTICK_GT_LT +  # group 0
-                                                INCREMENT_OPERATOR +  # group 1
-                                                NO_EXTRA_OPERATORS)
-
-    OBJECT_RECIPIENT_REGEX: Final[str] = (NO_PRECEDING_AT_SYMBOL +
-                                          WORD_BOUNDARY +
-                                          WORD_WITH_NO_BACKTICK_GT_LT_AT +  # group 0
-                                          WORD_BOUNDARY +
-                                          EITHER_OPERATOR +  # group 1
-                                          WHITESPACE_OR_NOTHING)
-
-    VALID_USER_RECIPIENT_REGEX: Final[str] = (LESS_THAN_SYMBOL +
-                                              AT_SYMBOL +
-                                              WORD_WITH_NO_BACKTICK_OR_PLUS_OR_MINUS +  # group 0
-                                              GREATER_THAN_SYMBOL +
-                                              ZERO_OR_ONE_WHITESPACE +
-                                              INCREMENT_OPERATOR +  # group 1
-                                              NO_EXTRA_OPERATORS)
-
-    INVALID_USER_RECIPIENT_PATTERN: Final[Pattern] = re.compile(INVALID_USER_RECIPIENT_REGEX)
-    OBJECT_RECIPIENT_PATTERN: Final[Pattern] = re.compile(OBJECT_RECIPIENT_REGEX)
-    VALID_USER_RECIPIENT_PATTERN: Final[Pattern] = re.compile(VALID_USER_RECIPIENT_REGEX)
+    """Find karma recipients in Slack messages.
+
+    `scan()` finds all three kinds of recipient with one pass of one compiled regex, `RECIPIENT_PATTERN`, skipping
+    code spans (text between a pair of backticks) as it goes, since karma typed inside backticks doesn't count.
+    Outside code spans it finds exactly what these regexes used to find, run separately over the whole message:
+
+    * valid users:   <@([^\\s`+-]+)>\\s?(\\+\\+)(?![-+])
+    * invalid users: (?<!<)@([^\\s`<>]+)(\\+\\+)(?![-+])
+    * objects:       (?<!@)\\b([^\\s`<>@]+)\\b(\\+\\+|--)(?!\\S)
+
+    Inside code spans it finds nothing, as test/test-messages.md specifies. (The regexes let "`<@foo>++`" through,
+    and their backtick filter could drop a match whose name also appeared earlier inside a code span.)
+
+    Those regexes tried every position in a word, and could read to the end of the word from each one, so a long
+    word took quadratic time. A recipient's name can't contain whitespace or backticks, nor some other characters
+    that depend on its kind, so each kind can only match once per run of characters its name can contain, starting
+    at the beginning of the run. `RECIPIENT_PATTERN` only tries each kind there, so parsing time grows linearly
+    with message length. On top of that, `scan()` caps the message length and the number of recipients, so no
+    message can take longer to parse than the longest one Slack allows.
+    """
+
+    # each of these starts where a run of characters that its kind of name can contain starts, skips to where the
+    # name starts, and uses possessive quantifiers (`*+`, `?+`) wherever giving characters back couldn't help
+    VALID_USER_REGEX: Final[str] = (r'(?<![^\s`+-])'  # a run of characters that aren't whitespace, backticks, + or -
+                                    r'[^\s`+<-]*+(?:<(?!@)[^\s`+<-]*+)*+<@'  # up to its first "<@"
+                                    r'(?P<valid_user>[^\s`+-]+)>\s?\+\+(?![-+])')
+    INVALID_USER_REGEX: Final[str] = (r'(?<![^\s`<>])'  # a run of characters that aren't whitespace, backticks, < or >
+                                      r'(?:(?<=<)@)?+[^\s`<>@]*+@'  # up to its first "@" that doesn't follow "<"
+                                      r'(?P<invalid_user>[^\s`<>]+)\+\+(?![-+])')
+    OBJECT_REGEX: Final[str] = (r'(?<![^\s`<>@])'  # a run of characters that aren't whitespace, backticks, <, > or @
+                                r'(?:(?<!@)(?=\w)|(?<=@)\w++|[^\s`<>@\w]++)'  # up to its first word boundary
+                                r'(?P<object>[^\s`<>@]*?\w)(?P<operator>\+\+|--)(?!\S)')
+    # a match is one character that ends a run of some kind (every run starts after one, since `scan()` puts a space
+    # before the message), with the recipient it's followed by captured in a lookahead. Only one kind can match at
+    # any position, and runs that don't reach a "+", "-", "<", ">" or "@" are skipped before trying any kind
+    RECIPIENT_PATTERN: Final[Pattern] = re.compile(r'[\s`+<>@-](?=[^\s`+<>@-]*+[+<>@-])'
+                                                   f'(?:(?={VALID_USER_REGEX})|(?={INVALID_USER_REGEX})'
+                                                   f'|(?={OBJECT_REGEX}))')
 
     def __init__(self, logger: Logger):
         self.logger = logger
 
-    def find_backtick_pairs(self, text: str) -> list[tuple[int, int]]:
-        """Find the indices of all backtick pairs in a string.
+    def scan(self, text: str) -> list[Recipient]:
+        """Find every karma recipient in a message, skipping code spans.
 
-        :returns: List of tuples where each tuple contains the start and end indices of a backtick pair
+        :returns: Recipients in the order their names appear in the message, at most `PARSER_MAX_RECIPIENTS` of them
         """
-        backtick_pairs = []
-        for match in self.BACKTICK_PAIR_REGEX.finditer(text):
-            backtick_pairs.append((match.start(), match.end()))
-        return backtick_pairs
-
-    def remove_matches_within_backticks(self,
-                                        matches: list[tuple[str, Action]],
-                                        text: str) -> list[tuple[str, Action]]:
-        """Remove matches that are within backticks from the list of matches."""
-        backtick_pairs = self.find_backtick_pairs(text)
-        filtered_matches: list[tuple[str, Action]] = []
-        end_pos_of_last_match: int = 0
-        for match in matches:
-            start: int = text.find(match[0], end_pos_of_last_match)
-            end: int = start + len(match[0])
-            end_pos_of_last_match = end
-            within_backticks: bool = False
-            for pair in backtick_pairs:
-                if start > pair[0] and end < pair[1]:
-                    within_backticks = True
-                    break
-            if not within_backticks:
-                filtered_matches.append(match)
-        return filtered_matches
+
+        if len(text) > PARSER_MAX_MESSAGE_LENGTH:
+            self.logger.warning(LazyString('message-parser.truncated',
+                                           length=len(text),
+                                           max_length=PARSER_MAX_MESSAGE_LENGTH))
+            text = text[:PARSER_MAX_MESSAGE_LENGTH]
+
+        recipients: list[Recipient] = []
+        if '++' not in text and '--' not in text:  # every recipient needs one
+            return recipients
+        code_spans: Iterator[tuple[int, int]] | None = self._iter_code_spans(text) if '`' in text else None
+        code_span: tuple[int, int] | None = next(code_spans, None) if code_spans else None
+        cutoff: int = len(text)  # once there are too many recipients, no later one can be among the first few
+        # the space makes the message's first character start a run, like every character after a separator
+        for match in self.RECIPIENT_PATTERN.finditer(' ' + text):
+            if match.start() >= cutoff:
+                break
+            # positions are 1 past the name's, because of the space
+            recipient: Recipient
+            if match['valid_user'] is not None:
+                recipient = Recipient(kind=RecipientKind.VALID_USER,
+                                      name=match['valid_user'],
+                                      action=Action.INCREMENT,
+                                      position=match.start('valid_user') - 1)
+            elif match['invalid_user'] is not None:
+                recipient = Recipient(kind=RecipientKind.INVALID_USER,
+                                      name=match['invalid_user'],
+                                      action=Action.INCREMENT,
+                                      position=match.start('invalid_user') - 1)
+            else:
+                recipient = Recipient(kind=RecipientKind.OBJECT,
+                                      name=match['object'].lower(),
+                                      action=Action(match['operator']),
+                                      position=match.start('object') - 1)
+
+            while code_span is not None and code_span[1] < recipient.position:
+                code_span = next(code_spans, None)
+            if code_span is not None and code_span[0] < recipient.position:
+                continue  # a name inside a code span is inside it entirely, since it can't contain a backtick
+
+            recipients.append(recipient)
+            if len(recipients) > PARSER_MAX_RECIPIENTS:
+                # names start at or after their match, so only matches before the cap's last name can still count
+                recipients.sort(key=lambda recipient: recipient.position)
+                del recipients[PARSER_MAX_RECIPIENTS + 1:]
+                cutoff = recipients[PARSER_MAX_RECIPIENTS - 1].position + 1
+        # a match starts where its run does, which can be well before its name, so names can be out of order
+        if len(recipients) > 1:
+            recipients.sort(key=lambda recipient: recipient.position)
+
+        if len(recipients) > PARSER_MAX_RECIPIENTS:
+            self.logger.warning(LazyString('message-parser.too-many-recipients',
+                                           max_recipients=PARSER_MAX_RECIPIENTS))
+            del recipients[PARSER_MAX_RECIPIENTS:]
+        return recipients
+
+    @staticmethod
+    def _iter_code_spans(text: str) -> Iterator[tuple[int, int]]:
+        """Find code spans one at a time with `str.find()`, which runs in C, so a scan that stops early doesn't
+        look for the rest.
+
+        "``" isn't a code span, so in a run of backticks only the last one can open a code span, and a backtick with
+        no partner after it doesn't open one either.
+
+        :returns: Positions of each code span's opening and closing backticks, in order
+        """
+
+        backtick_pos: int = text.find('`')
+        while backtick_pos != -1:
+            closing_backtick_pos: int = text.find('`', backtick_pos + 1)
+            while closing_backtick_pos == backtick_pos + 1:
+                backtick_pos = closing_backtick_pos
+                closing_backtick_pos = text.find('`', backtick_pos + 1)
+            if closing_backtick_pos == -1:
+                return
+            yield backtick_pos, closing_backtick_pos
+            backtick_pos = text.find('`', closing_backtick_pos + 1)
 
     def detect_valid_user_recipients(self, text: str) -> list[tuple[str, Action]]:
         """Capture "foo" and "++" from "<@foo>++" and "<@foo> ++".
 
         This covers cases where the recipient is a user registered in Slack.
         Decrementing karma from valid users is not allowed, so this method doesn't look for "--".
-        Slack doesn't recognize @-mentioning usernames when within backticks, so we don't need to
-        look for backticks like we do for invalid users and objects.
 
         :returns: List of tuples where each tuple contains a recipient's name and the Action (increment or decrement)
         """
 
-        matches: list[tuple[str, Action]] = self.VALID_USER_RECIPIENT_PATTERN.findall(text)
-        valid_user_recipients = [(user_id,
-                                  Action.INCREMENT if action == Action.INCREMENT.value else Action.DECREMENT)
-                                 for user_id, action in matches]
-        return valid_user_recipients
+        return [(recipient.name, recipient.action)
+                for recipient in self.scan(text) if recipient.kind is RecipientKind.VALID_USER]
 
     def detect_invalid_user_recipients(self, text: str) -> list[tuple[str, Action]]:
         """Capture "foo" from "@foo++" and "@foo ++" where there's no "<" before the "@".
@@ -113,12 +158,8 @@ class MessageParser:
                   the Action (increment or decrement)
         """
 
-        matches: list[tuple[str, Action]] = self.INVALID_USER_RECIPIENT_PATTERN.findall(text)
-        invalid_user_recipients: list[tuple[str, Action]] = self.remove_matches_within_backticks(matches, text)
-        invalid_user_recipients = [(user_id,
-                                    Action.INCREMENT if action == Action.INCREMENT.value else Action.DECREMENT)
-                                   for user_id, action in invalid_user_recipients]
-        return invalid_user_recipients
+        return [(recipient.name, recipient.action)
+                for recipient in self.scan(text) if recipient.kind is RecipientKind.INVALID_USER]
 
     def detect_object_recipients(self, text: str) -> list[tuple[str, Action]]:
         """Capture "foo" and "++" or "--' from "foo++" and "foo--" only when there's no @ before "foo".
@@ -129,12 +170,8 @@ class MessageParser:
                   the Action (increment or decrement)
         """
 
-        matches: list[tuple[str, Action]] = self.OBJECT_RECIPIENT_PATTERN.findall(text)
-        object_recipients: list[tuple[str, Action]] = self.remove_matches_within_backticks(matches, text)
-        object_recipients = [(user_id.lower(),
-                             Action.INCREMENT if action == Action.INCREMENT.value else Action.DECREMENT)
-                             for user_id, action in object_recipients]
-        return object_recipients
+        return [(recipient.name, recipient.action)
+                for recipient in self.scan(text) if recipient.kind is RecipientKind.OBJECT]
 
     def get_amount_verb_emoji(self, action: Action) -> tuple[int, str, str] | None:
         """ Convert an action into three elements of a Slack message: karma amount, verb, and emoji.
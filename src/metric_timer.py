@@ -0,0 +1,47 @@
+from histogram import Histogram
+
+from collections.abc import Callable
+import functools
+import time
+
+
+class MetricTimer:
+    """Time a `with` block, or every call of a function it decorates, into a histogram. Made by `MetricsMgr.timer()`.
+
+    A plain class rather than a `@contextmanager` generator, since it's on the path of every DB statement and Slack
+    API call, and costs a third as much.
+    """
+
+    __slots__ = ('histogram', 'count_error', 'errors_name', 'labels', 'started_at')
+
+    def __init__(self,
+                 histogram: Histogram,
+                 count_error: Callable[..., None],
+                 errors_name: str,
+                 labels: dict[str, str]):
+        """:param count_error: Called like `count_error(errors_name, **labels)` if the timed block raises"""
+
+        self.histogram: Histogram = histogram
+        self.count_error: Callable[..., None] = count_error
+        self.errors_name: str = errors_name
+        self.labels: dict[str, str] = labels
+        self.started_at: float = 0.0
+
+    def __enter__(self) -> 'MetricTimer':
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.histogram.observe(time.perf_counter() - self.started_at)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.count_error(self.errors_name, **self.labels)
+
+    def __call__(self, func: Callable) -> Callable:
+        """Time every call of `func`, each with its own timer, so calls on different threads don't mix."""
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with MetricTimer(self.histogram, self.count_error, self.errors_name, self.labels):
+                return func(*args, **kwargs)
+
+        return timed
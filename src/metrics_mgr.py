@@ -0,0 +1,144 @@
+from constants import LATENCY_BUCKETS, METRICS_NAMESPACE
+from histogram import Histogram
+from metric_timer import MetricTimer
+from string_mgr import StringMgr
+
+from threading import Lock
+
+# a metric's name and its labels as sorted (label name, label value) pairs, like
+# ('db_query_seconds', (('query', 'EntityMgr.get_karma'),))
+MetricKey = tuple[str, tuple[tuple[str, str], ...]]
+
+
+class MetricsMgr:
+    """Singleton class that collects instakarma-bot's metrics in memory, so we can see where time goes.
+
+    There are 2 kinds of metric, each identified by a name and optional labels (like `query='EntityMgr.get_karma'`):
+    latency histograms, in seconds, and counters. `MetricsServer` serves them in Prometheus text format.
+    """
+
+    _counters: dict[MetricKey, int] = {}
+    _histograms: dict[MetricKey, Histogram] = {}
+    _lock: Lock = Lock()
+
+    def __new__(cls):
+        """Prevent instantiation of this class."""
+
+        raise Exception("MetricsMgr class cannot be instantiated. Use its class methods instead.")
+
+    @classmethod
+    def get_histogram(cls, name: str, **labels: str) -> Histogram:
+        """Get the latency histogram with this name and these labels, making it first if needed.
+
+        :returns: The histogram
+        """
+
+        key: MetricKey = (name, cls._label_pairs(labels))
+        try:
+            return cls._histograms[key]  # no lock needed to find one that already exists
+        except KeyError:
+            with cls._lock:
+                return cls._histograms.setdefault(key, Histogram(LATENCY_BUCKETS))
+
+    @classmethod
+    def observe(cls, name: str, seconds: float, **labels: str) -> None:
+        """Record one latency, in seconds, in the histogram with this name and these labels."""
+
+        cls.get_histogram(name, **labels).observe(seconds)
+
+    @classmethod
+    def increment(cls, name: str, amount: int = 1, **labels: str) -> None:
+        """Add `amount` to the counter with this name and these labels, which starts at 0."""
+
+        key: MetricKey = (name, cls._label_pairs(labels))
+        with cls._lock:
+            cls._counters[key] = cls._counters.get(key, 0) + amount
+
+    @classmethod
+    def timer(cls, name: str, **labels: str) -> MetricTimer:
+        """Time a `with` block, or every call of a function it decorates, in the histogram with this name.
+
+        If the block raises, it's also counted in the counter named like `name` with '_seconds' replaced by
+        '_errors_total', like 'db_query_errors_total' for 'db_query_seconds'.
+        """
+
+        return MetricTimer(cls.get_histogram(name, **labels),
+                           cls.increment,
+                           f"{name.removesuffix('_seconds')}_errors_total",
+                           labels)
+
+    @staticmethod
+    def _label_pairs(labels: dict[str, str]) -> tuple[tuple[str, str], ...]:
+        """:returns: Labels as (label name, label value) pairs, sorted so the same labels always make the same key"""
+
+        return tuple(labels.items()) if len(labels) < 2 else tuple(sorted(labels.items()))  # skip sorting if we can
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        """Take a copy of every metric, for `instakarma-admin dump-metrics`.
+
+        :returns: {'histograms': [...], 'counters': [...]}, each a list of dicts with the metric's 'name' and
+                  'labels', plus a histogram's 'count', 'sum', 'max', and cumulative 'buckets', or a counter's 'value'.
+                  Buckets are (upper bound, count) pairs, with bounds as strings like Prometheus's 'le' label
+                  ('0.01', ..., '+Inf'), so the snapshot is plain JSON.
+        """
+
+        with cls._lock:
+            histograms: list[tuple[MetricKey, Histogram]] = sorted(cls._histograms.items(), key=lambda item: item[0])
+            counters: list[tuple[MetricKey, int]] = sorted(cls._counters.items())
+        histogram_snapshots: list[dict] = []
+        for (name, labels), histogram in histograms:
+            histogram_snapshot: dict = histogram.snapshot()
+            histogram_snapshot['buckets'] = [('+Inf' if bound == float('inf') else repr(bound), count)
+                                             for bound, count in histogram_snapshot['buckets']]
+            histogram_snapshots.append({'name': name, 'labels': dict(labels)} | histogram_snapshot)
+        return {'histograms': histogram_snapshots,
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in counters]}
+
+    @classmethod
+    def render_prometheus(cls) -> str:
+        """Write every metric in Prometheus text format (version 0.0.4), with names prefixed by `METRICS_NAMESPACE`.
+
+        :returns: The metrics, one sample per line
+        """
+
+        snapshot: dict = cls.snapshot()
+        lines: list[str] = []
+        last_name: str | None = None
+        for histogram in snapshot['histograms']:
+            name: str = f"{METRICS_NAMESPACE}_{histogram['name']}"
+            if name != last_name:
+                lines += cls._header_lines(histogram['name'], 'histogram')
+                last_name = name
+            for le, count in histogram['buckets']:
+                lines.append(f"{name}_bucket{cls._format_labels(histogram['labels'] | {'le': le})} {count}")
+            lines.append(f"{name}_sum{cls._format_labels(histogram['labels'])} {histogram['sum']!r}")
+            lines.append(f"{name}_count{cls._format_labels(histogram['labels'])} {histogram['count']}")
+        for counter in snapshot['counters']:
+            name: str = f"{METRICS_NAMESPACE}_{counter['name']}"
+            if name != last_name:
+                lines += cls._header_lines(counter['name'], 'counter')
+                last_name = name
+            lines.append(f"{name}{cls._format_labels(counter['labels'])} {counter['value']}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _header_lines(name: str, metric_type: str) -> list[str]:
+        """:returns: The '# HELP' and '# TYPE' lines that start a metric, with its help text from `strings.yml`"""
+
+        help_text: str = StringMgr.get_string(f'metrics.help.{name}').replace('\\', r'\\').replace('\n', r'\n')
+        return [f'# HELP {METRICS_NAMESPACE}_{name} {help_text}',
+                f'# TYPE {METRICS_NAMESPACE}_{name} {metric_type}']
+
+    @staticmethod
+    def _format_labels(labels: dict[str, str]) -> str:
+        """:returns: Labels like '{query="EntityMgr.get_karma",le="0.01"}', or '' if there are none"""
+
+        if not labels:
+            return ''
+        escaped: list[str] = []
+        for label, value in labels.items():
+            value = value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+            escaped.append(f'{label}="{value}"')
+        return '{' + ','.join(escaped) + '}'
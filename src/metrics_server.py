@@ -0,0 +1,69 @@
+from constants import METRICS_HOST, METRICS_PORT
+from lazy_string import LazyString
+from metrics_mgr import MetricsMgr
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from logging import Logger
+from threading import Thread
+
+
+class MetricsServer:
+    """Serve instakarma-bot's metrics over HTTP on a background thread.
+
+    `/metrics` is in Prometheus text format, for scraping. `/metrics.json` is a `MetricsMgr.snapshot()`, for
+    `instakarma-admin dump-metrics`. The server only listens on `METRICS_HOST`, which is local by default.
+    """
+
+    def __init__(self, logger: Logger, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.logger = logger
+        self.host: str = host
+        self.port: int = port
+        self._server: ThreadingHTTPServer | None = None
+        self._server_thread: Thread | None = None
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        """Answer GET requests for `/metrics` and `/metrics.json`."""
+
+        def do_GET(self) -> None:
+            if self.path == '/metrics':
+                body: bytes = MetricsMgr.render_prometheus().encode()
+                content_type: str = 'text/plain; version=0.0.4; charset=utf-8'
+            elif self.path == '/metrics.json':
+                body: bytes = json.dumps(MetricsMgr.snapshot()).encode()
+                content_type: str = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            """Don't print a line to stderr for every scrape."""
+
+    def start(self) -> None:
+        """Start serving, unless the port can't be listened on, in which case the bot runs without metrics."""
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), self.RequestHandler)
+        except OSError as e:
+            self.logger.error(LazyString('metrics-server.could-not-start', host=self.host, port=self.port, e=e))
+            return
+        self._server.daemon_threads = True
+        self._server_thread = Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._server_thread.start()
+        self.logger.info(LazyString('metrics-server.started', host=self.host, port=self.port))
+
+    def stop(self) -> None:
+        """Stop the server started by `start()`."""
+
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server_thread.join()
+        self._server = None
+        self._server_thread = None
@@ -0,0 +1,185 @@
+import os
+import sys
+
+if os.path.basename(os.getcwd()) != 'src':
+    print("Error: 'my-stats-benchmark' must be run from the '<REPO-ROOT-DIR>/src/' directory")
+    sys.exit(1)
+
+from action_mgr import ActionMgr
+from constants import *
+from db_mgr import DbMgr
+from entity_mgr import EntityMgr
+from grant_writer import GrantWriter
+from karma_mgr import KarmaMgr
+from my_stats_cache import MyStatsCache
+from string_mgr import StringMgr
+
+import argparse
+from argparse import ArgumentParser
+import logging
+from logging import Logger
+from pathlib import Path
+import random
+import tempfile
+from threading import Event, Thread
+import time
+
+
+def populate_db(db_mgr: DbMgr, num_users: int, num_objects: int, num_grants: int) -> None:
+    """Fill an empty DB with users, objects, and random grants between them.
+
+    Grants go through the 'grants' table's triggers, so 'grant_pair_totals' ends up the same as in a real DB.
+    """
+
+    users: list[tuple[str, str]] = [(f'@user{i}', f'U{i:08d}') for i in range(num_users)]
+    objects: list[tuple[str, None]] = [(f'thing{i}', None) for i in range(num_objects)]
+    with db_mgr.transaction() as conn:
+        conn.executemany('INSERT INTO entities (name, user_id) VALUES (?, ?);', users + objects)
+        num_entities: int = num_users + num_objects
+        conn.executemany('INSERT INTO grants (granter_id, recipient_id, amount) VALUES (?, ?, ?);',
+                         ((random.randint(1, num_users), random.randint(1, num_entities), random.choice((1, -1)))
+                          for _ in range(num_grants)))
+        conn.execute("""
+                     UPDATE entities
+                     SET karma = (SELECT COALESCE(SUM(amount), 0)
+                                  FROM grants
+                                  WHERE recipient_id = entities.entity_id);""")
+
+
+def run_load(action_mgr: ActionMgr,
+             entity_mgr: EntityMgr,
+             karma_mgr: KarmaMgr,
+             num_users: int,
+             num_objects: int,
+             num_readers: int,
+             calls_per_second: float,
+             num_granters: int,
+             seconds: float) -> tuple[list[float], int]:
+    """Call `/instakarma my-stats` from `num_readers` threads while `num_granters` threads grant karma.
+
+    The readers make `calls_per_second` calls between them, at random intervals like real users. Readers that
+    called as fast as they could would mostly measure how long they waited for each other.
+
+    :returns: Latency of every my-stats call in seconds, and how many grants were made meanwhile
+    """
+
+    stop: Event = Event()
+    latencies_by_reader: list[list[float]] = [[] for _ in range(num_readers)]
+    grants_by_granter: list[int] = [0] * num_granters
+
+    def respond(*args, **kwargs) -> None:
+        """Stand-in for Slack Bolt's `respond`, which sends nothing."""
+
+    def read(latencies: list[float]) -> None:
+        while not stop.wait(random.expovariate(calls_per_second / num_readers)):
+            command: dict = {'user_id': f'U{random.randrange(num_users):08d}'}
+            start: float = time.perf_counter()
+            action_mgr.my_stats(command, respond, entity_mgr, karma_mgr)
+            latencies.append(time.perf_counter() - start)
+
+    def grant(granter_index: int) -> None:
+        while not stop.is_set():
+            recipient_index: int = random.randrange(num_users + num_objects)
+            recipient_name: str = (f'@user{recipient_index}' if recipient_index < num_users
+                                   else f'thing{recipient_index - num_users}')
+            karma_mgr.grant_karma(f'@user{random.randrange(num_users)}', recipient_name, random.choice((1, -1)))
+            grants_by_granter[granter_index] += 1
+
+    threads: list[Thread] = ([Thread(target=read, args=(latencies,)) for latencies in latencies_by_reader] +
+                             [Thread(target=grant, args=(i,)) for i in range(num_granters)])
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return [latency for latencies in latencies_by_reader for latency in latencies], sum(grants_by_granter)
+
+
+def main() -> None:
+    """Parse CLI parameters, build a test DB, put it under load, and check my-stats latency against the budget."""
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description=StringMgr.get_string('my-stats-benchmark.description'),
+        prog=StringMgr.get_string('my-stats-benchmark.prog'))
+    parser.add_argument('--budget-ms',
+                        default=MY_STATS_P99_BUDGET_SECONDS * 1e3,
+                        help=StringMgr.get_string('my-stats-benchmark.help.budget-ms'),
+                        type=float)
+    parser.add_argument('--grants',
+                        default=MY_STATS_BENCHMARK_GRANTS,
+                        help=StringMgr.get_string('my-stats-benchmark.help.grants'),
+                        type=int)
+    parser.add_argument('--granters',
+                        default=MY_STATS_BENCHMARK_GRANTERS,
+                        help=StringMgr.get_string('my-stats-benchmark.help.granters'),
+                        type=int)
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help=StringMgr.get_string('my-stats-benchmark.help.no-cache'))
+    parser.add_argument('--objects',
+                        default=MY_STATS_BENCHMARK_OBJECTS,
+                        help=StringMgr.get_string('my-stats-benchmark.help.objects'),
+                        type=int)
+    parser.add_argument('--rate',
+                        default=MY_STATS_BENCHMARK_RATE,
+                        help=StringMgr.get_string('my-stats-benchmark.help.rate'),
+                        type=float)
+    parser.add_argument('--readers',
+                        default=MY_STATS_BENCHMARK_READERS,
+                        help=StringMgr.get_string('my-stats-benchmark.help.readers'),
+                        type=int)
+    parser.add_argument('--seconds',
+                        default=MY_STATS_BENCHMARK_SECONDS,
+                        help=StringMgr.get_string('my-stats-benchmark.help.seconds'),
+                        type=float)
+    parser.add_argument('--users',
+                        default=MY_STATS_BENCHMARK_USERS,
+                        help=StringMgr.get_string('my-stats-benchmark.help.users'),
+                        type=int)
+    args: argparse.Namespace = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_mgr: DbMgr = DbMgr(logger, db_file_name=str(Path(temp_dir) / 'instakarma.db'))
+        db_mgr.init_db()
+        db_mgr.migrate_db()
+        print(StringMgr.get_string('my-stats-benchmark.populating', users=args.users, objects=args.objects,
+                                   grants=args.grants))
+        populate_db(db_mgr, args.users, args.objects, args.grants)
+
+        # a cache of size 0 drops every snapshot as soon as it's stored, so every call queries the DB
+        my_stats_cache: MyStatsCache = MyStatsCache(max_size=0 if args.no_cache else MY_STATS_CACHE_SIZE)
+        entity_mgr: EntityMgr = EntityMgr(db_mgr, logger)
+        grant_writer: GrantWriter = GrantWriter(db_mgr, entity_mgr.entity_cache, logger,
+                                                my_stats_cache=my_stats_cache)
+        karma_mgr: KarmaMgr = KarmaMgr(db_mgr, entity_mgr, logger, grant_writer, my_stats_cache)
+        action_mgr: ActionMgr = ActionMgr(db_mgr, logger)
+        grant_writer.start()
+        try:
+            latencies, num_grants = run_load(action_mgr, entity_mgr, karma_mgr, args.users, args.objects,
+                                             args.readers, args.rate, args.granters, args.seconds)
+        finally:
+            grant_writer.close()
+            db_mgr.close_all_connections()
+
+    latencies.sort()
+    p99_seconds: float = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]
+    lookups: int = my_stats_cache.hits + my_stats_cache.misses
+    print(StringMgr.get_string('my-stats-benchmark.result',
+                               calls=len(latencies),
+                               grants_per_sec=num_grants / args.seconds,
+                               p50_ms=latencies[len(latencies) // 2] * 1e3,
+                               p99_ms=p99_seconds * 1e3,
+                               max_ms=latencies[-1] * 1e3,
+                               hit_rate=my_stats_cache.hits / lookups if lookups else 0.0))
+    if p99_seconds * 1e3 > args.budget_ms:
+        sys.exit(StringMgr.get_string('my-stats-benchmark.over-budget', budget_ms=args.budget_ms))
+    print(StringMgr.get_string('my-stats-benchmark.within-budget', budget_ms=args.budget_ms))
+
+
+if __name__ == '__main__':
+    # thousands of grants and my-stats calls shouldn't go to the bot's log
+    logger: Logger = logging.getLogger(StringMgr.get_string('my-stats-benchmark.prog'))
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    main()
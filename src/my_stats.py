@@ -0,0 +1,9 @@
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class MyStats:
+    """Everything `/instakarma my-stats` shows a user, read from the DB at one moment."""
+    karma: int
+    top_positive_recipients: list[tuple[str, int]]  # (name, karma granted), most first
+    top_negative_recipients: list[tuple[str, int]]  # (name, karma removed as a negative number), most first
+    top_granters: list[tuple[str, int]]  # (name, number of grants), most first
@@ -0,0 +1,79 @@
+from constants import MY_STATS_CACHE_SIZE
+from my_stats import MyStats
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class MyStatsCache:
+    """In-process LRU cache of each user's `/instakarma my-stats` snapshot, keyed by entity_id.
+
+    A user's stats only change when they grant or receive karma, so `GrantWriter` invalidates the granter's and
+    recipient's snapshots after each committed grant, and a snapshot is otherwise served until it's evicted.
+    A snapshot read from the DB is only cached if its user wasn't invalidated while it was being read, so a read
+    that raced a grant can't put stale stats back in the cache.
+    Thread-safe, since slash commands run on a pool of worker threads.
+    """
+
+    def __init__(self, max_size: int = MY_STATS_CACHE_SIZE):
+        self.max_size: int = max_size
+        self.hits: int = 0
+        self.misses: int = 0
+        self._snapshots: OrderedDict[int, MyStats] = OrderedDict()  # keyed by entity_id, least recently used first
+        self._generation: int = 0  # goes up by one with every invalidation
+        self._invalidated_at: dict[int, int] = {}  # entity_id -> generation of its latest invalidation
+        self._cleared_at: int = -1  # generation of the latest `clear()`
+        self._lock: Lock = Lock()
+
+    def get(self, entity_id: int) -> MyStats | None:
+        """:returns: The cached snapshot for this entity, or None if it isn't cached"""
+
+        with self._lock:
+            stats: MyStats | None = self._snapshots.get(entity_id)
+            if stats is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._snapshots.move_to_end(entity_id)
+            return stats
+
+    def get_generation(self) -> int:
+        """Call this before reading a snapshot from the DB, and pass the result to `put()`.
+
+        :returns: The current invalidation generation
+        """
+
+        with self._lock:
+            return self._generation
+
+    def put(self, entity_id: int, stats: MyStats, generation: int) -> None:
+        """Cache a snapshot read from the DB, unless its entity was invalidated after `generation`.
+
+        :param generation: What `get_generation()` returned before the snapshot was read
+        """
+
+        with self._lock:
+            if max(self._cleared_at, self._invalidated_at.get(entity_id, -1)) >= generation:
+                return
+            self._snapshots[entity_id] = stats
+            self._snapshots.move_to_end(entity_id)
+            while len(self._snapshots) > self.max_size:
+                self._snapshots.popitem(last=False)
+
+    def invalidate(self, *entity_ids: int) -> None:
+        """Drop the snapshots of entities whose stats just changed, like a grant's granter and recipient."""
+
+        with self._lock:
+            for entity_id in entity_ids:
+                self._snapshots.pop(entity_id, None)
+                self._invalidated_at[entity_id] = self._generation
+            self._generation += 1
+
+    def clear(self) -> None:
+        """Drop every snapshot, e.g. after the DB was changed by something that didn't invalidate them."""
+
+        with self._lock:
+            self._snapshots.clear()
+            self._invalidated_at.clear()
+            self._cleared_at = self._generation
+            self._generation += 1
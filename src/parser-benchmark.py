@@ -0,0 +1,288 @@
+import os
+import sys
+
+if os.path.basename(os.getcwd()) != 'src':
+    print("Error: 'parser-benchmark' must be run from the '<REPO-ROOT-DIR>/src/' directory")
+    sys.exit(1)
+
+from constants import *
+from message_parser import MessageParser
+from recipient import Recipient
+from string_mgr import StringMgr
+
+import argparse
+from argparse import ArgumentParser
+from collections.abc import Callable
+import json
+import logging
+from logging import Logger
+from pathlib import Path
+import time
+from typing import Any
+
+# sections of test-messages.md whose example messages go into the corpus; each section's examples are under its
+# '###' subheadings, after the regex the section is about
+CORPUS_SECTIONS: dict[str, str] = {'## Valid users': 'valid-user',
+                                   '## Invalid users': 'invalid-user',
+                                   '## Objects': 'object'}
+
+METHODS: tuple[str, ...] = ('scan',
+                            'detect_valid_user_recipients',
+                            'detect_invalid_user_recipients',
+                            'detect_object_recipients')
+
+
+def build_corpus() -> list[dict[str, Any]]:
+    """Turn every example message in test-messages.md into a corpus entry.
+
+    Each entry records which section the message came from and what the parser finds in it right now. The corpus is
+    the parser's golden output: a later change that finds anything different shows up as a regression. It doesn't
+    record which subsection (like "### Don't match") a message came from, since the parser doesn't agree with all
+    of them; test-messages.md is where they're reviewed by hand.
+    """
+
+    corpus: list[dict[str, Any]] = []
+    seen: set[tuple[str, str]] = set()
+    section: str | None = None
+    in_examples: bool = False
+    for line in Path(TEST_MESSAGES_FILE).read_text().splitlines():
+        if line.startswith('## '):
+            section = CORPUS_SECTIONS.get(line.strip())
+            in_examples = False
+        elif line.startswith('### '):
+            in_examples = True
+        elif line.strip() and not line.startswith('#') and section and in_examples and (section, line) not in seen:
+            seen.add((section, line))
+            corpus.append({'section': section,
+                           'text': line,
+                           'recipients': recipients_to_json(message_parser.scan(line))})
+    return corpus
+
+
+def recipients_to_json(recipients: list[Recipient]) -> list[list[str]]:
+    """Reduce recipients to what a regression check compares: kind, name, and action."""
+
+    return [[recipient.kind.value, recipient.name, recipient.action.value] for recipient in recipients]
+
+
+def synthetic_messages() -> dict[str, list[str]]:
+    """Long messages that test-messages.md doesn't cover, up to the 40,000 characters Slack allows."""
+
+    prose: str = ('The quick brown fox jumps over the lazy dog, again and again. ' * 640)[:39_990] + ' python++'
+    karma_dense: str = ' '.join(f'thing{i}++ <@U{i:08d}>++ @nobody{i}++ --' for i in range(900))[:40_000]
+    code_heavy: str = ' '.join(f'`x{i}++` y{i}++' for i in range(3000))[:40_000]
+    return {'long-prose': [prose], 'karma-dense': [karma_dense], 'code-heavy': [code_heavy]}
+
+
+def adversarial_messages() -> dict[str, str]:
+    """Messages built to make a parser slow: long runs of operators, thousands of backticks, giant words, and
+    thousands of recipients. Also one message 10 times longer than Slack allows."""
+
+    length: int = PARSER_MAX_MESSAGE_LENGTH
+    return {'plus-minus-run': '+-' * (length // 2),
+            'at-plus-minus-run': '@a' + '++-' * (length // 3 - 1),
+            'backtick-run': '`' * length,
+            'backtick-pairs': '`a' * (length // 2),
+            'backtick-spaces': '` ' * (length // 2),
+            'giant-object': 'a' * (length - 2) + '++',
+            'giant-invalid-user': '@' + 'a' * (length - 3) + '++',
+            'giant-valid-user': '<@' + 'a' * (length - 5) + '>++',
+            'punctuation-object': '.' * (length - 3) + 'a++',
+            'recipient-per-word': 'a++ ' * (length // 4),
+            'recipients-in-one-word': '<@a>++' * (length // 6),
+            'near-miss-per-word': 'a++b ' * (length // 5),
+            'oversized': 'a++ ' * (length * 10 // 4)}
+
+
+def check_worst_case() -> list[str]:
+    """Time `scan()` on each adversarial message.
+
+    Uses the fastest of several calls, since the point is to catch parsing that is slow by design, like
+    backtracking, rather than a call that happened to wait for the CPU.
+
+    :returns: Names of the adversarial messages that took longer than `PARSER_WORST_CASE_BUDGET_SECONDS`
+    """
+
+    over_budget: list[str] = []
+    print(StringMgr.get_string('parser-benchmark.worst-case.header'))
+    for name, message in adversarial_messages().items():
+        best_seconds: float = float('inf')
+        for _ in range(PARSER_BENCHMARK_ROUNDS):
+            start: float = time.perf_counter()
+            message_parser.scan(message)
+            best_seconds = min(best_seconds, time.perf_counter() - start)
+        print(StringMgr.get_string('parser-benchmark.worst-case.row',
+                                   name=name,
+                                   length=len(message),
+                                   milliseconds=best_seconds * 1e3))
+        if best_seconds > PARSER_WORST_CASE_BUDGET_SECONDS:
+            over_budget.append(name)
+    return over_budget
+
+
+def measure(method: Callable[[str], Any], messages: list[str], min_seconds: float) -> dict[str, float]:
+    """Call `method` on each message, over and over, for at least `min_seconds`.
+
+    The time is split into rounds, and throughput comes from the fastest round (as `timeit` recommends), since
+    slower rounds measure whatever else the machine was doing rather than the parser.
+
+    :returns: Messages parsed per second, plus the median and 99th-percentile latency of one call in microseconds
+    """
+
+    latencies_ns: list[int] = []
+    best_msgs_per_sec: float = 0.0
+    for _ in range(PARSER_BENCHMARK_ROUNDS):
+        round_latencies_ns: list[int] = []
+        deadline: float = time.perf_counter() + min_seconds / PARSER_BENCHMARK_ROUNDS
+        while time.perf_counter() < deadline:
+            for message in messages:
+                start_ns: int = time.perf_counter_ns()
+                method(message)
+                round_latencies_ns.append(time.perf_counter_ns() - start_ns)
+        best_msgs_per_sec = max(best_msgs_per_sec, len(round_latencies_ns) / (sum(round_latencies_ns) / 1e9))
+        latencies_ns.extend(round_latencies_ns)
+    latencies_ns.sort()
+    return {'msgs_per_sec': best_msgs_per_sec,
+            'p50_us': latencies_ns[len(latencies_ns) // 2] / 1e3,
+            'p99_us': latencies_ns[min(len(latencies_ns) - 1, len(latencies_ns) * 99 // 100)] / 1e3}
+
+
+def check_corpus(corpus: list[dict[str, Any]]) -> int:
+    """Print every corpus message whose recipients differ from its golden output.
+
+    :returns: Number of messages that differ
+    """
+
+    num_changed: int = 0
+    for entry in corpus:
+        actual: list[list[str]] = recipients_to_json(message_parser.scan(entry['text']))
+        if actual != entry['recipients']:
+            num_changed += 1
+            print(StringMgr.get_string('parser-benchmark.changed',
+                                       text=entry['text'],
+                                       expected=entry['recipients'],
+                                       actual=actual))
+    return num_changed
+
+
+def run_benchmarks(corpus: list[dict[str, Any]], min_seconds: float) -> dict[str, dict[str, dict[str, float]]]:
+    """Time every parser method against the corpus and each synthetic message."""
+
+    workloads: dict[str, list[str]] = {'corpus': [entry['text'] for entry in corpus],
+                                       **synthetic_messages(),
+                                       'adversarial': list(adversarial_messages().values())}
+    results: dict[str, dict[str, dict[str, float]]] = {}
+    print(StringMgr.get_string('parser-benchmark.header'))
+    for workload, messages in workloads.items():
+        results[workload] = {}
+        for method_name in METHODS:
+            result: dict[str, float] = measure(getattr(message_parser, method_name), messages, min_seconds)
+            results[workload][method_name] = result
+            print(StringMgr.get_string('parser-benchmark.row', workload=workload, method=method_name, **result))
+    return results
+
+
+def find_slowdowns(results: dict[str, dict[str, dict[str, float]]],
+                   baseline: dict[str, dict[str, dict[str, float]]],
+                   threshold: float) -> list[str]:
+    """Compare throughput with the stored baseline.
+
+    :returns: One line for every workload and method whose throughput dropped by more than `threshold`
+    """
+
+    slowdowns: list[str] = []
+    for workload, methods in results.items():
+        for method_name, result in methods.items():
+            baseline_result: dict[str, float] | None = baseline.get(workload, {}).get(method_name)
+            if baseline_result is None:
+                continue
+            change: float = result['msgs_per_sec'] / baseline_result['msgs_per_sec'] - 1
+            if change < -threshold:
+                slowdowns.append(StringMgr.get_string('parser-benchmark.slowdown',
+                                                      workload=workload,
+                                                      method=method_name,
+                                                      change=change,
+                                                      baseline=baseline_result['msgs_per_sec'],
+                                                      actual=result['msgs_per_sec']))
+    return slowdowns
+
+
+def main() -> None:
+    """Parse CLI parameters and handle each valid parameter."""
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description=StringMgr.get_string('parser-benchmark.description'),
+        prog=StringMgr.get_string('parser-benchmark.prog'))
+
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparsers.add_parser('build-corpus', help=StringMgr.get_string('parser-benchmark.help.build-corpus'))
+
+    run_parser = subparsers.add_parser('run', help=StringMgr.get_string('parser-benchmark.help.run.command'))
+    run_parser.add_argument('--save-baseline',
+                            action='store_true',
+                            help=StringMgr.get_string('parser-benchmark.help.run.save-baseline'))
+    run_parser.add_argument('--seconds',
+                            default=PARSER_BENCHMARK_SECONDS,
+                            help=StringMgr.get_string('parser-benchmark.help.run.seconds'),
+                            type=float)
+    run_parser.add_argument('--threshold',
+                            default=PARSER_BENCHMARK_THRESHOLD,
+                            help=StringMgr.get_string('parser-benchmark.help.run.threshold'),
+                            type=float)
+
+    args: argparse.Namespace = parser.parse_args()
+
+    # print help if no command is provided
+    if not args.command:
+        parser.print_help()
+        sys.exit(1)
+
+    match args.command:
+        case 'build-corpus':
+            corpus: list[dict[str, Any]] = build_corpus()
+            # one message per line, so a rebuilt corpus diffs cleanly
+            Path(PARSER_CORPUS_FILE).write_text(
+                '[\n' + ',\n'.join(json.dumps(entry, ensure_ascii=False) for entry in corpus) + '\n]\n')
+            print(StringMgr.get_string('parser-benchmark.corpus-built', count=len(corpus), file=PARSER_CORPUS_FILE))
+
+        case 'run':
+            corpus: list[dict[str, Any]] = json.loads(Path(PARSER_CORPUS_FILE).read_text())
+            num_changed: int = check_corpus(corpus)
+            if num_changed:
+                sys.exit(StringMgr.get_string('parser-benchmark.corpus-failed', count=num_changed, total=len(corpus)))
+            print(StringMgr.get_string('parser-benchmark.corpus-passed', total=len(corpus)))
+
+            over_budget: list[str] = check_worst_case()
+            if over_budget:
+                sys.exit(StringMgr.get_string('parser-benchmark.worst-case.over-budget',
+                                              names=', '.join(over_budget),
+                                              milliseconds=PARSER_WORST_CASE_BUDGET_SECONDS * 1e3))
+            print(StringMgr.get_string('parser-benchmark.worst-case.within-budget',
+                                       milliseconds=PARSER_WORST_CASE_BUDGET_SECONDS * 1e3))
+
+            results: dict[str, dict[str, dict[str, float]]] = run_benchmarks(corpus, args.seconds)
+            if args.save_baseline:
+                Path(PARSER_BASELINE_FILE).write_text(json.dumps(results, indent=1) + '\n')
+                print(StringMgr.get_string('parser-benchmark.baseline-saved', file=PARSER_BASELINE_FILE))
+                return
+            if not Path(PARSER_BASELINE_FILE).exists():
+                print(StringMgr.get_string('parser-benchmark.no-baseline', file=PARSER_BASELINE_FILE))
+                return
+            baseline: dict[str, dict[str, dict[str, float]]] = json.loads(Path(PARSER_BASELINE_FILE).read_text())
+            slowdowns: list[str] = find_slowdowns(results, baseline, args.threshold)
+            if slowdowns:
+                print('\n'.join(slowdowns))
+                sys.exit(StringMgr.get_string('parser-benchmark.too-slow',
+                                              count=len(slowdowns),
+                                              threshold=args.threshold))
+            print(StringMgr.get_string('parser-benchmark.fast-enough', threshold=args.threshold))
+
+
+if __name__ == '__main__':
+    # timing adversarial messages makes the parser warn thousands of times, which shouldn't go to the bot's log
+    logger: Logger = logging.getLogger(StringMgr.get_string('parser-benchmark.prog'))
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    message_parser: MessageParser = MessageParser(logger)
+    main()
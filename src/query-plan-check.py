@@ -0,0 +1,160 @@
+import os
+import sys
+
+if os.path.basename(os.getcwd()) != 'src':
+    print("Error: 'query-plan-check' must be run from the '<REPO-ROOT-DIR>/src/' directory")
+    sys.exit(1)
+
+from constants import *
+from db_mgr import DbMgr
+from entity_mgr import EntityMgr
+from enums import Action
+from grant_exporter import GrantExporter
+from karma_mgr import KarmaMgr
+from string_mgr import StringMgr
+
+import argparse
+from argparse import ArgumentParser
+from collections.abc import Callable
+import logging
+from logging import Logger
+from pathlib import Path
+import random
+import re
+from sqlite3 import Connection
+import tempfile
+
+# a plan line like 'SCAN gr' reads a whole table without an index; 'SCAN (subquery-2)' only reads a subquery's rows
+FULL_SCAN_PATTERN: re.Pattern = re.compile(r'SCAN \w+')
+
+# indexes that a migration dropped because no query uses them any more, which mustn't come back
+DROPPED_INDEXES: tuple[str, ...] = ('grants_recipient_granter_idx', 'grants_granter_amount_recipient_idx')
+
+# (query, how to run it, lines its plan must include) for each query that reads 'grants' or 'grant_pair_totals'
+QUERY_PLAN_CHECKS: tuple[tuple[str, Callable[[KarmaMgr, GrantExporter], object], tuple[str, ...]], ...] = (
+    ('KarmaMgr.get_top_granters',
+     lambda karma_mgr, grant_exporter: karma_mgr.get_top_granters('thing1'),
+     ('SEARCH p USING INDEX grant_pair_totals_recipient_total_idx (recipient_id=?)',)),
+    ('KarmaMgr.get_top_recipients (++)',
+     lambda karma_mgr, grant_exporter: karma_mgr.get_top_recipients('@user1', Action.INCREMENT),
+     ('SEARCH p USING COVERING INDEX grant_pair_totals_granter_plus_idx (granter_id=? AND plus_count>?)',)),
+    ('KarmaMgr.get_top_recipients (--)',
+     lambda karma_mgr, grant_exporter: karma_mgr.get_top_recipients('@user1', Action.DECREMENT),
+     ('SEARCH p USING COVERING INDEX grant_pair_totals_granter_minus_idx (granter_id=? AND minus_count>?)',)),
+    ('KarmaMgr.get_my_stats',
+     lambda karma_mgr, grant_exporter: karma_mgr.get_my_stats(karma_mgr.entity_mgr.get_entity('@user1')),
+     ('SEARCH entities USING INTEGER PRIMARY KEY (rowid=?)',
+      'SEARCH p USING COVERING INDEX grant_pair_totals_granter_plus_idx (granter_id=? AND plus_count>?)',
+      'SEARCH p USING COVERING INDEX grant_pair_totals_granter_minus_idx (granter_id=? AND minus_count>?)',
+      'SEARCH p USING INDEX grant_pair_totals_recipient_total_idx (recipient_id=?)')),
+    ('GrantExporter.iter_grant_chunks',
+     lambda karma_mgr, grant_exporter: list(grant_exporter.iter_grant_chunks()),
+     ('SCAN gr USING COVERING INDEX grants_timestamp_idx',)),
+    ('GrantExporter.iter_grant_chunks (incremental)',
+     lambda karma_mgr, grant_exporter: list(grant_exporter.iter_grant_chunks(after_grant_id=0)),
+     ('SEARCH gr USING INTEGER PRIMARY KEY (rowid>?)',)),
+)
+
+
+def make_db(db_mgr: DbMgr, num_users: int, num_objects: int, num_grants: int) -> None:
+    """Create a fully migrated test DB with some random grants, so every query has rows to find."""
+
+    db_mgr.init_db()
+    db_mgr.migrate_db()
+    with db_mgr.transaction() as conn:
+        conn.executemany('INSERT INTO entities (name, user_id) VALUES (?, ?);',
+                         [(f'@user{i}', f'U{i:08d}') for i in range(num_users)] +
+                         [(f'thing{i}', None) for i in range(num_objects)])
+        conn.executemany('INSERT INTO grants (granter_id, recipient_id, amount) VALUES (?, ?, ?);',
+                         ((random.randint(1, num_users), random.randint(1, num_users + num_objects),
+                           random.choice((1, -1)))
+                          for _ in range(num_grants)))
+
+
+def get_query_plans(conn: Connection, run_query: Callable[[], object]) -> list[str]:
+    """Run a query the way the bot does, and get SQLite's plan for each SELECT it ran.
+
+    A trace callback sees each statement with its parameters filled in, so the plans are for the exact SQL the
+    bot's code builds, not a copy of it.
+
+    :returns: Each SELECT's plan, formatted by `DbMgr.format_query_plan()`
+    """
+
+    statements: list[str] = []
+    conn.set_trace_callback(statements.append)
+    try:
+        run_query()
+    finally:
+        conn.set_trace_callback(None)
+    return [DbMgr.format_query_plan(conn.execute(f'EXPLAIN QUERY PLAN {statement}').fetchall())
+            for statement in statements if statement.lstrip().upper().startswith('SELECT')]
+
+
+def find_problems(plans: list[str], expected_lines: tuple[str, ...]) -> list[str]:
+    """:returns: Every expected line missing from the plans, and every full table scan in them"""
+
+    plan_lines: list[str] = [line.strip() for plan in plans for line in plan.splitlines()]
+    problems: list[str] = [StringMgr.get_string('query-plan-check.problem.missing', line=line)
+                           for line in expected_lines if line not in plan_lines]
+    problems += [StringMgr.get_string('query-plan-check.problem.full-scan', line=line)
+                 for line in plan_lines if FULL_SCAN_PATTERN.fullmatch(line)]
+    return problems
+
+
+def find_dropped_indexes(conn: Connection) -> list[str]:
+    """:returns: A problem for every index in `DROPPED_INDEXES` that's still in the DB"""
+
+    index_names: set[str] = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index';")}
+    return [StringMgr.get_string('query-plan-check.problem.dropped-index', index=index)
+            for index in DROPPED_INDEXES if index in index_names]
+
+
+def main() -> None:
+    """Parse CLI parameters, build a test DB, and check the plan of every query that reads grants."""
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description=StringMgr.get_string('query-plan-check.description'),
+        prog=StringMgr.get_string('query-plan-check.prog'))
+    parser.add_argument('--verbose',
+                        action='store_true',
+                        help=StringMgr.get_string('query-plan-check.help.verbose'))
+    args: argparse.Namespace = parser.parse_args()
+
+    num_failed: int = 0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_mgr: DbMgr = DbMgr(logger, db_file_name=str(Path(temp_dir) / 'instakarma.db'))
+        make_db(db_mgr, QUERY_PLAN_CHECK_USERS, QUERY_PLAN_CHECK_OBJECTS, QUERY_PLAN_CHECK_GRANTS)
+        entity_mgr: EntityMgr = EntityMgr(db_mgr, logger)
+        karma_mgr: KarmaMgr = KarmaMgr(db_mgr, entity_mgr, logger)
+        grant_exporter: GrantExporter = GrantExporter(db_mgr, logger)
+        entity_mgr.get_entity('@user1')  # so only get_my_stats()'s own query is traced
+        conn: Connection = db_mgr.get_db_connection()
+        for query, run_query, expected_lines in QUERY_PLAN_CHECKS:
+            plans: list[str] = get_query_plans(conn, lambda: run_query(karma_mgr, grant_exporter))
+            problems: list[str] = find_problems(plans, expected_lines)
+            if problems:
+                num_failed += 1
+                print(StringMgr.get_string('query-plan-check.failed', query=query, problems='\n'.join(problems)))
+            else:
+                print(StringMgr.get_string('query-plan-check.passed', query=query))
+            if problems or args.verbose:
+                print('\n\n'.join(plans))
+        dropped_index_problems: list[str] = find_dropped_indexes(conn)
+        db_mgr.close_all_connections()
+
+    if dropped_index_problems:
+        print('\n'.join(dropped_index_problems))
+    if num_failed:
+        sys.exit(StringMgr.get_string('query-plan-check.some-failed', failed=num_failed,
+                                      total=len(QUERY_PLAN_CHECKS)))
+    if dropped_index_problems:
+        sys.exit(StringMgr.get_string('query-plan-check.indexes-not-dropped', count=len(dropped_index_problems)))
+    print(StringMgr.get_string('query-plan-check.all-passed', total=len(QUERY_PLAN_CHECKS)))
+
+
+if __name__ == '__main__':
+    # migrations and queries shouldn't go to the bot's log
+    logger: Logger = logging.getLogger(StringMgr.get_string('query-plan-check.prog'))
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    main()
@@ -0,0 +1,11 @@
+from enums import Action, RecipientKind
+
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class Recipient:
+    """A karma recipient found in a message by `MessageParser`."""
+    kind: RecipientKind
+    name: str  # Slack user ID for valid users, name for invalid users and objects
+    action: Action
+    position: int  # index of the recipient's name in the message text
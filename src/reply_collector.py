@@ -0,0 +1,32 @@
+import asyncio
+
+
+class ReplyCollector:
+    """Stand-in for Slack Bolt's `say` or `respond` callbacks that saves each reply instead of sending it.
+
+    This lets synchronous code like `GrantMgr` run on a worker thread in async mode, where the real callbacks
+    are coroutines that must be awaited on the event loop. It also lets `GrantMgr` answer a message that grants
+    karma to several recipients with one Slack message instead of one per recipient.
+    """
+
+    def __init__(self):
+        self.replies: list[tuple[tuple, dict]] = []  # (args, kwargs) of each call
+
+    def __call__(self, *args, **kwargs) -> None:
+        """Save a reply, taking the same arguments as the callback it stands in for."""
+
+        self.replies.append((args, kwargs))
+
+    async def send(self, async_callback) -> None:
+        """Send every saved reply through an async `say` or `respond` callback, all at once."""
+
+        await asyncio.gather(*(async_callback(*args, **kwargs) for args, kwargs in self.replies))
+
+    def send_as_one(self, say, **kwargs) -> None:
+        """Send the text of every saved reply through a `say` callback as one message, one reply per line.
+
+        :param kwargs: Passed on to `say`, like `thread_ts`
+        """
+
+        if self.replies:
+            say('\n'.join(args[0] if args else reply_kwargs['text'] for args, reply_kwargs in self.replies), **kwargs)
@@ -46,10 +46,13 @@ help: list[dict] = [
 ]
 
 
-def leaderboard(leader_text: str) -> list[dict]:
-    """Generate Slack text blocks that contain all object names and karma."""
+def leaderboard(leader_text: str, page_number: int = 1, num_pages: int = 1) -> list[dict]:
+    """Generate Slack text blocks that contain one page of object names and karma.
 
-    return [
+    If there's more than one page, a footer says which page this is and how to see the next one.
+    """
+
+    blocks: list[dict] = [
         {
             "type": "header",
             "text":
@@ -67,6 +70,22 @@ def leaderboard(leader_text: str) -> list[dict]:
                 }
         }
     ]
+    if num_pages > 1:
+        footer_key: str = ('response-blocks.leaderboard.footer' if page_number < num_pages
+                           else 'response-blocks.leaderboard.last-page-footer')
+        blocks.append({
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": StringMgr.get_string(footer_key,
+                                                 page_number=page_number,
+                                                 num_pages=num_pages,
+                                                 next_page_number=page_number + 1)
+                }
+            ]
+        })
+    return blocks
 
 
 def my_stats(name: str,
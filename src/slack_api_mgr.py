@@ -1,29 +1,106 @@
-from logging import Logger
+from constants import USER_DIRECTORY_REFRESH_SECONDS, USER_DIRECTORY_TTL_SECONDS, USERS_LIST_PAGE_SIZE
+from lazy_string import LazyString
 
-from string_mgr import StringMgr
+from logging import Logger
+from threading import Event, Lock, Thread
+import time
 
-from slack_bolt import App
+from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 from slack_sdk.web import SlackResponse
 
 
 class SlackApiMgr:
-    """Handle calls to the Slack API."""
+    """Handle calls to the Slack API.
+
+    User names are kept in an in-memory directory that's filled in bulk from `users.list` by a background thread,
+    so converting a user ID to a name rarely needs a `users.info` call of its own.
+    """
 
-    def __init__(self, app: App, logger: Logger):
-        self.app = app
+    def __init__(self,
+                 client: WebClient,
+                 logger: Logger,
+                 ttl_seconds: float = USER_DIRECTORY_TTL_SECONDS):
+        """:param client: Any object with the `users_info` and `users_list` methods of `slack_sdk.WebClient`,
+                          so tests can pass in a fake"""
+
+        self.client = client
         self.logger = logger
+        self.ttl_seconds: float = ttl_seconds
+        self._user_directory: dict[str, tuple[str, float]] = {}  # user_id -> (name, time.monotonic() when cached)
+        self._user_directory_lock: Lock = Lock()
+        self._stop_refreshing: Event = Event()
+        self._refresh_thread: Thread | None = None
 
     def get_name_from_slack_api(self, user_id: str) -> str:
-        """Use Slack API to convert a user ID like 'U07R69E3YKB' into a name like '@elvis'.
+        """Convert a user ID like 'U07R69E3YKB' into a name like '@elvis'.
+
+        Use the user directory if it has a fresh entry for the user, otherwise ask the Slack API.
 
         :raises SlackApiError: If something goes wrong with the API call
         """
 
+        with self._user_directory_lock:
+            cached: tuple[str, float] | None = self._user_directory.get(user_id)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl_seconds:
+            return cached[0]
+
         try:
-            user_info: SlackResponse = self.app.client.users_info(user=user_id)
+            user_info: SlackResponse = self.client.users_info(user=user_id)
         except SlackApiError as sae:
-            self.logger.error(StringMgr.get_string('slack-api.error', response=sae.response))
+            self.logger.error(LazyString('slack-api.error', response=sae.response))
             raise
-        name: str = user_info['user']['name']
-        return '@' + name
+        name: str = '@' + user_info['user']['name']
+        with self._user_directory_lock:
+            self._user_directory[user_id] = (name, time.monotonic())
+        return name
+
+    def warm_user_directory(self) -> int:
+        """Fill the user directory with every user in the workspace, one `users.list` page at a time.
+
+        :returns: Number of users cached
+        :raises SlackApiError: If something goes wrong with the API call
+        """
+
+        names: dict[str, str] = {}
+        cursor: str | None = None
+        while True:
+            try:
+                response: SlackResponse = self.client.users_list(limit=USERS_LIST_PAGE_SIZE, cursor=cursor)
+            except SlackApiError as sae:
+                self.logger.error(LazyString('slack-api.error', response=sae.response))
+                raise
+            for member in response['members']:
+                names[member['id']] = '@' + member['name']
+            cursor = (response.get('response_metadata') or {}).get('next_cursor')
+            if not cursor:
+                break
+
+        cached_at: float = time.monotonic()
+        with self._user_directory_lock:
+            self._user_directory.update((user_id, (name, cached_at)) for user_id, name in names.items())
+        self.logger.info(LazyString('slack-api.user-directory.warmed', count=len(names)))
+        return len(names)
+
+    def start_user_directory_refresh(self, interval_seconds: float = USER_DIRECTORY_REFRESH_SECONDS) -> None:
+        """Warm the user directory now and then every `interval_seconds`, on a background thread."""
+
+        def refresh_forever() -> None:
+            while not self._stop_refreshing.is_set():
+                try:
+                    self.warm_user_directory()
+                except Exception as e:  # keep refreshing; lookups fall back to `users.info` in the meantime
+                    self.logger.error(LazyString('slack-api.user-directory.refresh-failed', e=e))
+                self._stop_refreshing.wait(interval_seconds)
+
+        self._stop_refreshing.clear()
+        self._refresh_thread = Thread(target=refresh_forever, name='user-directory-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def stop_user_directory_refresh(self) -> None:
+        """Stop the background thread started by `start_user_directory_refresh()`."""
+
+        self._stop_refreshing.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join()
+            self._refresh_thread = None
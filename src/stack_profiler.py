@@ -0,0 +1,167 @@
+from constants import PROFILE_DIR, PROFILE_SAMPLE_INTERVAL_SECONDS
+from lazy_string import LazyString
+
+from collections import Counter
+from datetime import datetime
+from logging import Logger
+import marshal
+import os
+from pathlib import Path
+import sys
+import threading
+from threading import Event, Lock, Thread
+import time
+from types import FrameType
+
+# how `pstats` identifies a function: (file name, line number of its `def`, function name)
+FunctionKey = tuple[str, int, str]
+
+
+class StackProfiler:
+    """Profile every thread of the running bot by sampling their stacks, for a set number of seconds at a time.
+
+    While profiling, a background thread takes a snapshot of every other thread's stack every `interval_seconds`
+    with `sys._current_frames()`. When profiling stops, the samples are written to `output_dir` in 2 formats:
+
+    * `profile-<time>.collapsed`: one line per distinct stack, like 'grant-0;grant_mgr.py:GrantMgr.handle_grants;...
+      42', for flame graph tools like `flamegraph.pl` or speedscope
+    * `profile-<time>.pstats`: the same samples in `pstats` format, for `python -m pstats` or snakeviz. Its call
+      counts are numbers of samples, and its times are numbers of samples times `interval_seconds`.
+
+    Samples are wall-clock, so a thread waiting on a socket or a lock shows up there too, which is usually what
+    makes the bot sluggish. There's no cost while not profiling, since nothing is hooked into the other threads.
+    """
+
+    def __init__(self,
+                 logger: Logger,
+                 output_dir: str = PROFILE_DIR,
+                 interval_seconds: float = PROFILE_SAMPLE_INTERVAL_SECONDS):
+        self.logger = logger
+        self.output_dir: str = output_dir
+        self.interval_seconds: float = interval_seconds
+        self._stop_profiling: Event = Event()
+        self._profiler_thread: Thread | None = None
+        self._lock: Lock = Lock()  # so 2 callers can't both start profiling
+
+    def is_profiling(self) -> bool:
+        """:returns: Whether profiling is in progress"""
+
+        return self._profiler_thread is not None and self._profiler_thread.is_alive()
+
+    def start(self, seconds: float) -> bool:
+        """Start profiling every thread for `seconds`, or until `stop()` is called, on a background thread.
+
+        :returns: False if profiling was already in progress, in which case nothing changes
+        """
+
+        with self._lock:
+            if self.is_profiling():
+                return False
+            self._stop_profiling.clear()
+            self._profiler_thread = Thread(target=self._profile, args=(seconds,), name='profiler', daemon=True)
+            self._profiler_thread.start()
+        return True
+
+    def stop(self) -> None:
+        """Stop profiling early, and wait until the results are written. No-op if not profiling."""
+
+        self._stop_profiling.set()
+        profiler_thread: Thread | None = self._profiler_thread
+        if profiler_thread is not None:
+            profiler_thread.join()
+
+    def toggle(self, seconds: float) -> None:
+        """Start profiling for `seconds` if not profiling, otherwise stop. Used by the bot's SIGUSR1 handler.
+
+        Stopping doesn't wait for the results to be written, and nothing is logged here, since a signal handler
+        shouldn't block.
+        """
+
+        if not self.start(seconds):
+            self._stop_profiling.set()
+
+    def _profile(self, seconds: float) -> None:
+        """Sample every other thread's stack until `seconds` have passed or `stop()` is called, then write the
+        results."""
+
+        self.logger.info(LazyString('profiler.started', seconds=seconds, interval_ms=self.interval_seconds * 1e3))
+        samples: Counter[tuple[FunctionKey, ...]] = Counter()  # stack, from thread down to innermost function -> count
+        thread_names: dict[int, str] = {}
+        own_thread_id: int = threading.get_ident()
+        started_at: float = time.monotonic()
+        deadline: float = started_at + seconds
+        while not self._stop_profiling.wait(self.interval_seconds) and time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                if thread_id not in thread_names:
+                    thread_names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                    thread_names.setdefault(thread_id, str(thread_id))  # a thread not started by `threading`
+                samples[(('', 0, thread_names[thread_id]),) + self._stack(frame)] += 1
+        elapsed_seconds: float = time.monotonic() - started_at
+
+        try:
+            collapsed_path, pstats_path = self._write_results(samples)
+        except OSError as e:
+            self.logger.error(LazyString('profiler.could-not-write', output_dir=self.output_dir, e=e))
+            return
+        self.logger.info(LazyString('profiler.written',
+                                    samples=samples.total(),
+                                    seconds=elapsed_seconds,
+                                    collapsed_path=collapsed_path,
+                                    pstats_path=pstats_path))
+
+    @staticmethod
+    def _stack(frame: FrameType | None) -> tuple[FunctionKey, ...]:
+        """:returns: The functions on a thread's stack, outermost first"""
+
+        stack: list[FunctionKey] = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_qualname))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def _write_results(self, samples: Counter[tuple[FunctionKey, ...]]) -> tuple[Path, Path]:
+        """Write the samples as collapsed stacks and as `pstats` data.
+
+        :returns: Paths of the collapsed-stack file and the `pstats` file
+        :raises OSError: If the files can't be written
+        """
+
+        output_dir: Path = Path(self.output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        stem: str = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        collapsed_path: Path = output_dir / f'{stem}.collapsed'
+        pstats_path: Path = output_dir / f'{stem}.pstats'
+
+        with open(collapsed_path, 'w') as collapsed_file:
+            for stack, count in samples.most_common():
+                thread_name: str = stack[0][2]
+                frames: list[str] = [f'{os.path.basename(file_name)}:{function_name}'
+                                     for file_name, _, function_name in stack[1:]]
+                collapsed_file.write(f"{';'.join([thread_name, *frames])} {count}\n")
+
+        # pstats format: function -> (primitive calls, calls, own time, cumulative time, {caller -> same 4 numbers})
+        stats: dict[FunctionKey, tuple[int, int, float, float, dict]] = {}
+        for stack, count in samples.items():
+            functions: tuple[FunctionKey, ...] = stack[1:]  # without the thread, which isn't a function
+            seconds: float = count * self.interval_seconds
+            seen: set[FunctionKey] = set()  # count recursive functions once per sample
+            for depth, function in enumerate(functions):
+                if function in seen:
+                    continue
+                seen.add(function)
+                own_seconds: float = seconds if depth == len(functions) - 1 else 0.0
+                calls, _, total_own_seconds, total_seconds, callers = stats.get(function, (0, 0, 0.0, 0.0, {}))
+                if depth > 0:
+                    caller: FunctionKey = functions[depth - 1]
+                    caller_calls, _, caller_own_seconds, caller_seconds = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (caller_calls + count, caller_calls + count,
+                                       caller_own_seconds + own_seconds, caller_seconds + seconds)
+                stats[function] = (calls + count, calls + count,
+                                   total_own_seconds + own_seconds, total_seconds + seconds, callers)
+        with open(pstats_path, 'wb') as pstats_file:
+            marshal.dump(stats, pstats_file)
+        return collapsed_path, pstats_path
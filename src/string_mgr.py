@@ -1,39 +1,116 @@
-from constants import STRINGS_FILE
+from constants import STRINGS_CACHE_FILE, STRINGS_FILE
 
+import json
+import os
 from pathlib import Path
-import yaml
+from string import Formatter
+from typing import Any
 
 
 class StringMgr:
-    """Converts keys to user-facing strings, so we can collect all user-facing strings in one file."""
+    """Converts keys to user-facing strings, so we can collect all user-facing strings in one file.
 
-    _strings_map: dict[str, str] = {}
+    The nested YAML file is compiled once into flat tables keyed by dotted key paths (like 'error.sqlite3'), so a
+    lookup is a single dict access. Strings with no placeholders are stored already rendered, so they're never
+    formatted again. The compiled tables are cached on disk, keyed by the YAML file's modification time, so later
+    startups don't have to parse YAML at all.
+    """
+
+    _static_strings: dict[str, str] = {}  # dotted key path -> finished string
+    _templates: dict[str, str] = {}  # dotted key path -> string with placeholders to fill in with `str.format()`
     _is_map_loaded: bool = False
 
     @classmethod
     def _load_map(cls):
-        """Load the file with user-facing strings into a map that we can use throughout instakarma-bot.
+        """Load the compiled string tables, from the cache if it's up to date or else from the YAML file.
 
-        :raises FileNotFoundError: if the JSON file doesn't exist
-        :raises JSONDecodeError: if the JSON file is malformed
+        :raises FileNotFoundError: if the YAML file doesn't exist
+        :raises YAMLError: if the YAML file is malformed
         """
+
         strings_file_path: Path = Path(STRINGS_FILE)
-        with open(strings_file_path) as strings_file:
-            cls._strings_map = yaml.safe_load(strings_file)
-            cls._is_map_loaded = True
+        source_stat = strings_file_path.stat()
+        source_key: list[int] = [source_stat.st_mtime_ns, source_stat.st_size]
+
+        compiled: dict[str, Any] | None = cls._read_cache(source_key)
+        if compiled is None:
+            import yaml  # only pay for importing PyYAML when the cache is missing or stale
+            with open(strings_file_path) as strings_file:
+                compiled = cls._compile(yaml.safe_load(strings_file))
+            cls._write_cache(source_key, compiled)
+
+        cls._static_strings = compiled['static']
+        cls._templates = compiled['templates']
+        cls._is_map_loaded = True
+
+    @staticmethod
+    def _compile(strings_map: dict[str, Any]) -> dict[str, dict[str, str]]:
+        """Flatten the nested strings map into static strings and templates, both keyed by dotted key path.
+
+        Only strings are kept, since any other value (like a section of the YAML file) never formatted into a
+        string anyway.
+        """
+
+        compiled: dict[str, dict[str, str]] = {'static': {}, 'templates': {}}
+        sections: list[tuple[str, dict[str, Any]]] = [('', strings_map)]
+        while sections:
+            prefix, section = sections.pop()
+            for key, value in section.items():
+                key_path: str = f'{prefix}{key}'
+                if isinstance(value, dict):
+                    sections.append((f'{key_path}.', value))
+                elif isinstance(value, str):
+                    if all(field_name is None for _, field_name, _, _ in Formatter().parse(value)):
+                        compiled['static'][key_path] = value.format()  # still turns '{{' into '{'
+                    else:
+                        compiled['templates'][key_path] = value
+        return compiled
+
+    @staticmethod
+    def _read_cache(source_key: list[int]) -> dict[str, Any] | None:
+        """Read the compiled string tables from the cache file.
+
+        :returns: The compiled tables, or None if there's no cache file, it can't be read, or it was compiled from
+                  a different version of the YAML file
+        """
+
+        try:
+            with open(STRINGS_CACHE_FILE) as cache_file:
+                cache: dict[str, Any] = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if (not isinstance(cache, dict) or cache.get('source') != source_key or
+                not isinstance(cache.get('static'), dict) or not isinstance(cache.get('templates'), dict)):
+            return None
+        return cache
+
+    @staticmethod
+    def _write_cache(source_key: list[int], compiled: dict[str, dict[str, str]]) -> None:
+        """Save the compiled string tables for the next startup.
+
+        Best effort: if the cache can't be written (like on a read-only filesystem), the next startup just parses
+        the YAML file again.
+        """
+
+        cache_path: Path = Path(STRINGS_CACHE_FILE)
+        temp_path: Path = cache_path.with_suffix(f'.{os.getpid()}.tmp')  # processes mustn't share a temp file
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path.write_text(json.dumps({'source': source_key, **compiled}))
+            temp_path.replace(cache_path)  # atomic, so another process never reads a half-written cache
+        except OSError:
+            pass
 
     @classmethod
     def get_string(cls, key_path: str, **kwargs) -> str:
         if not cls._is_map_loaded:
             cls._load_map()
 
-        template = cls._strings_map
+        static_string: str | None = cls._static_strings.get(key_path)
+        if static_string is not None:
+            return static_string
         try:
-            for key in key_path.split('.'):
-                template = template[key]
-            string: str = template.format(**kwargs)
+            string: str = cls._templates[key_path].format(**kwargs)
             return string
         except (AttributeError, KeyError, TypeError):
             return StringMgr.get_string("error.undefined-string", undefined_key_path=key_path)
-        except yaml.YAMLError:
-            return StringMgr.get_string("error.malformed-yaml", undefined_key_path=key_path)
@@ -0,0 +1,148 @@
+import os
+import sys
+
+if os.path.basename(os.getcwd()) != 'src':
+    print("Error: 'strings-benchmark' must be run from the '<REPO-ROOT-DIR>/src/' directory")
+    sys.exit(1)
+
+from constants import *
+from string_mgr import StringMgr
+
+import argparse
+from argparse import ArgumentParser
+from pathlib import Path
+import subprocess
+import tempfile
+import time
+from typing import Any
+import yaml
+
+# (kind, key path, values for its placeholders) for each kind of string that's timed
+CALLS: tuple[tuple[str, str, dict[str, Any]], ...] = (
+    ('static', 'message-parser.increment.verb', {}),  # requested for every recipient of every grant
+    ('templated', 'grant.success', {'emoji': ':+1:',
+                                    'recipient_name': 'banyan',
+                                    'verb': 'leveled up',
+                                    'recipient_total_karma': 42}),
+)
+
+# run in a new Python process, so the first call pays for everything a real startup does, like importing PyYAML
+COMPILED_LOAD_TIMER: str = '''
+import string_mgr
+import sys
+import time
+string_mgr.STRINGS_CACHE_FILE = sys.argv[1]
+start = time.perf_counter()
+string_mgr.StringMgr.get_string('message-parser.increment.verb')
+print(time.perf_counter() - start)
+'''
+UNCOMPILED_LOAD_TIMER: str = '''
+import time
+start = time.perf_counter()
+import yaml
+with open('strings.yml') as strings_file:
+    yaml.safe_load(strings_file)
+print(time.perf_counter() - start)
+'''
+
+
+class UncompiledStringMgr(StringMgr):
+    """StringMgr as it was before strings.yml was compiled: every call walks the nested YAML map and formats."""
+
+    _strings_map: dict[str, Any] = {}
+    _is_map_loaded: bool = False  # StringMgr's own flag says nothing about this map
+
+    @classmethod
+    def _load_map(cls) -> None:
+        with open(STRINGS_FILE) as strings_file:
+            cls._strings_map = yaml.safe_load(strings_file)
+        cls._is_map_loaded = True
+
+    @classmethod
+    def get_string(cls, key_path: str, **kwargs) -> str:
+        if not cls._is_map_loaded:
+            cls._load_map()
+        template: Any = cls._strings_map
+        for key in key_path.split('.'):
+            template = template[key]
+        return template.format(**kwargs)
+
+
+def time_calls(string_mgr: type[StringMgr], key_path: str, kwargs: dict[str, Any], num_calls: int) -> float:
+    """Get the same string `num_calls` times in a row, after the strings are loaded.
+
+    :returns: Calls per second
+    """
+
+    get_string = string_mgr.get_string
+    get_string(key_path, **kwargs)
+    start: float = time.perf_counter()
+    for _ in range(num_calls):
+        get_string(key_path, **kwargs)
+    return num_calls / (time.perf_counter() - start)
+
+
+def time_load(timer: str, cache_file: Path) -> float:
+    """Time the first `get_string()` call of a new process, which loads the strings.
+
+    :returns: Seconds the first call took
+    """
+
+    return float(subprocess.run([sys.executable, '-c', timer, str(cache_file)],
+                                capture_output=True,
+                                check=True,
+                                text=True).stdout)
+
+
+def main() -> None:
+    """Parse CLI parameters, then time `StringMgr.get_string()` before and after strings.yml is loaded."""
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description=StringMgr.get_string('strings-benchmark.description'),
+        prog=StringMgr.get_string('strings-benchmark.prog'))
+    parser.add_argument('--calls',
+                        default=STRINGS_BENCHMARK_CALLS,
+                        help=StringMgr.get_string('strings-benchmark.help.calls'),
+                        type=int)
+    parser.add_argument('--rounds',
+                        default=STRINGS_BENCHMARK_ROUNDS,
+                        help=StringMgr.get_string('strings-benchmark.help.rounds'),
+                        type=int)
+    args: argparse.Namespace = parser.parse_args()
+
+    # rounds alternate between setups, so a slow patch on a shared machine doesn't land all on one of them
+    string_mgrs: dict[str, type[StringMgr]] = {'uncompiled': UncompiledStringMgr, 'compiled': StringMgr}
+    for kind, key_path, kwargs in CALLS:
+        best_calls_per_sec: dict[str, float] = dict.fromkeys(string_mgrs, 0.0)
+        for _ in range(args.rounds):
+            for setup, string_mgr in string_mgrs.items():
+                best_calls_per_sec[setup] = max(best_calls_per_sec[setup],
+                                                time_calls(string_mgr, key_path, kwargs, args.calls))
+        for setup, calls_per_sec in best_calls_per_sec.items():
+            print(StringMgr.get_string('strings-benchmark.calls-result',
+                                       setup=setup,
+                                       kind=kind,
+                                       calls_per_sec=calls_per_sec,
+                                       rounds=args.rounds))
+
+    # a cache file of its own, so the bot's cache is never deleted or rewritten
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_file: Path = Path(temp_dir) / 'strings.json'
+        best_seconds: dict[str, float] = dict.fromkeys(('uncompiled', 'compiled, cold cache', 'compiled, warm cache'),
+                                                       float('inf'))
+        for _ in range(args.rounds):
+            best_seconds['uncompiled'] = min(best_seconds['uncompiled'], time_load(UNCOMPILED_LOAD_TIMER, cache_file))
+            cache_file.unlink(missing_ok=True)
+            best_seconds['compiled, cold cache'] = min(best_seconds['compiled, cold cache'],
+                                                       time_load(COMPILED_LOAD_TIMER, cache_file))
+            best_seconds['compiled, warm cache'] = min(best_seconds['compiled, warm cache'],
+                                                       time_load(COMPILED_LOAD_TIMER, cache_file))
+    for setup, seconds in best_seconds.items():
+        print(StringMgr.get_string('strings-benchmark.load-result',
+                                   setup=setup,
+                                   milliseconds=seconds * 1e3,
+                                   rounds=args.rounds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+from metrics_mgr import MetricsMgr
+
+from slack_sdk.web.async_client import AsyncWebClient
+from slack_sdk.web.async_slack_response import AsyncSlackResponse
+
+
+class TimedAsyncWebClient(AsyncWebClient):
+    """Async version of `TimedWebClient`, for `./instakarma-bot.py --async`."""
+
+    @classmethod
+    def from_client(cls, client: AsyncWebClient) -> 'TimedAsyncWebClient':
+        """Make a timed copy of `client`, like the plain `AsyncWebClient` that Slack Bolt makes for each request.
+
+        :returns: A client with the same token, connection settings, and aiohttp session as `client`
+        """
+
+        return cls(token=client.token,
+                   base_url=client.base_url,
+                   timeout=client.timeout,
+                   ssl=client.ssl,
+                   proxy=client.proxy,
+                   session=client.session,
+                   trust_env_in_session=client.trust_env_in_session,
+                   headers=client.headers,
+                   team_id=client.default_params.get('team_id'),
+                   logger=client.logger,
+                   retry_handlers=client.retry_handlers)
+
+    async def api_call(self, api_method: str, **kwargs) -> AsyncSlackResponse:
+        """Make a Slack Web API call, like `await api_call('users.info', params={'user': 'U123'})`.
+
+        :returns: Slack's response
+        :raises SlackApiError: If Slack returns an error, which is also counted in 'slack_api_errors_total'
+        """
+
+        with MetricsMgr.timer('slack_api_seconds', method=api_method):
+            return await super().api_call(api_method, **kwargs)
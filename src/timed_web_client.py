@@ -0,0 +1,38 @@
+from metrics_mgr import MetricsMgr
+
+from slack_sdk import WebClient
+from slack_sdk.web import SlackResponse
+
+
+class TimedWebClient(WebClient):
+    """A `WebClient` that times every Slack Web API call in the 'slack_api_seconds' histogram, labelled by method.
+
+    Every method of `WebClient`, like `users_info()` or `chat_postMessage()`, makes its call through `api_call()`.
+    """
+
+    @classmethod
+    def from_client(cls, client: WebClient) -> 'TimedWebClient':
+        """Make a timed copy of `client`, like the plain `WebClient` that Slack Bolt makes for each request.
+
+        :returns: A client with the same token and connection settings as `client`
+        """
+
+        return cls(token=client.token,
+                   base_url=client.base_url,
+                   timeout=client.timeout,
+                   ssl=client.ssl,
+                   proxy=client.proxy,
+                   headers=client.headers,
+                   team_id=client.default_params.get('team_id'),
+                   logger=client.logger,
+                   retry_handlers=client.retry_handlers)
+
+    def api_call(self, api_method: str, **kwargs) -> SlackResponse:
+        """Make a Slack Web API call, like `api_call('users.info', params={'user': 'U123'})`.
+
+        :returns: Slack's response
+        :raises SlackApiError: If Slack returns an error, which is also counted in 'slack_api_errors_total'
+        """
+
+        with MetricsMgr.timer('slack_api_seconds', method=api_method):
+            return super().api_call(api_method, **kwargs)